@@ -4,10 +4,11 @@
 Application that can record and process video.
 '''
 
+import os
 import sys
-from os.path import dirname, join
+from os.path import dirname, join, expanduser
 
-__all__ = ('FilerException', 'root_data_path')
+__all__ = ('FilerException', 'root_data_path', 'user_data_path')
 
 __version__ = '0.2-dev'
 
@@ -25,6 +26,31 @@ if hasattr(sys, '_MEIPASS'):
     root_data_path = sys._MEIPASS
 
 
+def _get_user_data_path():
+    if os.environ.get('FILERS_DATA'):
+        return os.environ['FILERS_DATA']
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.environ.get('APPDATA') \
+            or expanduser('~')
+        return join(base, 'filers')
+    if sys.platform == 'darwin':
+        return join(expanduser('~'), 'Library', 'Application Support',
+                    'filers')
+    base = os.environ.get('XDG_DATA_HOME') or \
+        join(expanduser('~'), '.local', 'share')
+    return join(base, 'filers')
+
+
+user_data_path = _get_user_data_path()
+'''The user-writable directory where filers stores the data it creates while
+running, e.g. the journals and caches, unlike :attr:`root_data_path` which
+may be read-only when installed, or temporary when compiled as an exe. It's
+the `FILERS_DATA` environment variable if set, otherwise e.g.
+`%LOCALAPPDATA%\\filers` on Windows or `~/.local/share/filers` on Linux. It's
+created when first used.
+'''
+
+
 class FilerException(Exception):
     ''' Filers exception class.
     '''
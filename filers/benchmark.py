@@ -0,0 +1,655 @@
+'''Benchmarks
+=============
+
+Benchmarks that measure how fast various parts of Filers run on the local
+machine, e.g. to help select the
+:attr:`~filers.file_tools.FileTools.verify_type` hash algorithm to use.
+
+The benchmarks can be run from the command line and print their results. E.g.
+to benchmark all the hash algorithms::
+
+    python -m filers.benchmark hash
+    python -m filers.benchmark hash --file "C:\\videos\\video1.avi"
+
+Or to compare walking a directory tree with :mod:`filers.walker` to
+:func:`os.walk`::
+
+    python -m filers.benchmark walk --files 1000000
+    python -m filers.benchmark walk --dir "C:\\videos"
+
+Or to compare the :mod:`filers.filters` matchers to matching with a regex::
+
+    python -m filers.benchmark filter "*.avi" "*day?*.avi"
+
+Or to compare the time the Kivy thread spends reading the updates of
+:class:`~filers.tools.KivyQueue` and :class:`~filers.tools.CoalescingKivyQueue`
+while files are processed::
+
+    python -m filers.benchmark queue --files 10000
+
+Or to find the :attr:`~filers.engine.ProcessorEngine.compress_speed`,
+:attr:`~filers.engine.ProcessorEngine.crf`, and
+:attr:`~filers.engine.ProcessorEngine.num_threads` that encode a sample video
+fast enough on this machine, saving the results to a CSV file::
+
+    python -m filers.benchmark encoder "C:\\videos\\video1.avi" --speeds \
+ultrafast veryfast fast --crfs 18 23 --threads 2 4 --output results.csv
+'''
+
+import os
+from os.path import join, isfile, getsize
+import shutil
+import tempfile
+import re
+import argparse
+import csv
+import json
+from itertools import product
+from timeit import default_timer
+
+from filers.tools import hash_backends, get_hasher, hashfile, pretty_space, \
+    pretty_time, KivyQueue, CoalescingKivyQueue
+from filers import walker
+from filers.filters import compile_filter
+from filers.engine import ProcessorEngine
+from filers.ffmpeg import run_ffmpeg
+
+__all__ = ('benchmark_hash_backends', 'make_file_tree', 'benchmark_walk',
+           'benchmark_filters', 'benchmark_queues', 'benchmark_encoder',
+           'save_encoder_results', 'main')
+
+
+def benchmark_hash_backends(names=None, size=64 * 1024 * 1024,
+                            blocksize=1024 * 1024, filename=None, repeat=3,
+                            mmap_threshold=None):
+    '''
+    Measures how fast the hash algorithms in
+    :attr:`~filers.tools.hash_backends` run on this machine.
+
+    >>> benchmark_hash_backends(['sha256', 'blake2b'])
+    {'blake2b': 603.2, 'sha256': 211.7}
+
+    :Parameters:
+
+        `names`: list
+            The names of the algorithms to benchmark. If None, all the
+            algorithms are benchmarked. Defaults to None.
+        `size`: int
+            When `filename` is None, the number of bytes of random data that
+            are hashed from memory. Defaults to 64MB.
+        `blocksize`: int
+            The size of the blocks in which the data is hashed. Defaults to
+            1MB.
+        `filename`: str
+            If not None, the file is hashed using
+            :func:`~filers.tools.hashfile` instead of hashing data from memory,
+            so the disk speed is included. Defaults to None.
+        `repeat`: int
+            The number of times each algorithm is run. The fastest run is
+            used. Defaults to 3.
+        `mmap_threshold`: int
+            Passed to :func:`~filers.tools.hashfile` when hashing `filename`,
+            e.g. to compare hashing a memory mapped file with reading it.
+            Defaults to None.
+
+    :returns:
+
+        A dict whose keys are the algorithm names and whose values are their
+        speed, in MB/s.
+    '''
+    if names is None:
+        names = sorted(hash_backends)
+    if filename is None:
+        blocks = [os.urandom(blocksize)] * max(size // blocksize, 1)
+        size = len(blocks) * blocksize
+    else:
+        size = os.path.getsize(filename)
+
+    results = {}
+    for name in names:
+        best = None
+        for _ in range(repeat):
+            ts = default_timer()
+            if filename is None:
+                hasher = get_hasher(name)
+                for block in blocks:
+                    hasher.update(block)
+                hasher.digest()
+            else:
+                hashfile(filename, name, blocksize=blocksize,
+                         mmap_threshold=mmap_threshold)
+            elapsed = default_timer() - ts
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = size / float(max(best, 1e-9)) / (1024 * 1024)
+    return results
+
+
+def make_file_tree(root, num_files=1000000, files_per_dir=1000):
+    '''
+    Creates a synthetic directory tree of empty files, e.g. to benchmark
+    :func:`benchmark_walk` with.
+
+    :Parameters:
+
+        `root`: str
+            The directory in which the tree is created.
+        `num_files`: int
+            The number of files to create. Defaults to 1000000.
+        `files_per_dir`: int
+            The number of files in each directory. The directories are
+            grouped in turn into directories of `files_per_dir` directories.
+            Defaults to 1000.
+    '''
+    num_dirs = max((num_files + files_per_dir - 1) // files_per_dir, 1)
+    for d in range(num_dirs):
+        dirname = join(root, 'group{}'.format(d // files_per_dir),
+                       'dir{}'.format(d))
+        os.makedirs(dirname)
+        for i in range(min(files_per_dir, num_files - d * files_per_dir)):
+            open(join(dirname, 'file{}.avi'.format(i)), 'wb').close()
+
+
+def benchmark_walk(top, num_threads=1):
+    '''
+    Compares the time and number of ``stat`` system calls needed to get the
+    size of all the files in a directory tree with :func:`filers.walker.walk`
+    and with :func:`os.walk` followed by :func:`os.path.isfile` and
+    :func:`os.path.getsize` for every file, which is how the files used to be
+    enumerated.
+
+    The ``stat`` calls made through :func:`os.stat` and :func:`os.lstat` are
+    counted. The
+    :func:`os.scandir` directory entries used by the walker cannot be
+    intercepted, so they are counted as a call per file, except on Windows
+    where the stat info comes with the directory listing.
+
+    If `num_threads` is more than one, :func:`filers.walker.walk_parallel`
+    with that many threads is also timed.
+
+    >>> benchmark_walk('C:\\videos')
+    {'os.walk': (12.5, 2000000, 1000000), 'walker': (3.1, 0, 1000000)}
+
+    :Parameters:
+
+        `top`: str
+            The directory to walk.
+        `num_threads`: int
+            The number of threads used to time
+            :func:`~filers.walker.walk_parallel`. Defaults to 1.
+
+    :returns:
+
+        A dict whose keys are `'os.walk'`, `'walker'`, and, with
+        `num_threads`, `'parallel'`, and whose values are
+        3-tuples of the time it took in seconds, the number of ``stat``
+        calls, and the number of files found.
+    '''
+    calls = [0]
+    stat = os.stat
+    lstat = os.lstat
+
+    def counted(func):
+        def counted_func(*largs, **kwargs):
+            calls[0] += 1
+            return func(*largs, **kwargs)
+        return counted_func
+
+    results = {}
+    os.stat = counted(stat)
+    os.lstat = counted(lstat)
+    try:
+        ts = default_timer()
+        count = 0
+        for root, _, files in os.walk(top):
+            for filename in files:
+                filepath = join(root, filename)
+                if isfile(filepath):
+                    getsize(filepath)
+                    count += 1
+        results['os.walk'] = default_timer() - ts, calls[0], count
+
+        calls[0] = 0
+        ts = default_timer()
+        count = sum(1 for _ in walker.iter_files(top))
+        elapsed = default_timer() - ts
+    finally:
+        os.stat = stat
+        os.lstat = lstat
+
+    if walker.scandir is not None and os.name != 'nt':
+        calls[0] += count
+    results['walker'] = elapsed, calls[0], count
+
+    if num_threads > 1:
+        ts = default_timer()
+        count = 0
+        for _, _, _, files in walker.walk_parallel(
+                [top], num_threads=num_threads):
+            count += sum(1 for f in files if f[1] is not None)
+        results['parallel'] = default_timer() - ts, results['walker'][1], \
+            count
+    return results
+
+
+def benchmark_filters(patterns, num_paths=100000, depth=8, repeat=3):
+    '''
+    Measures how fast the simple glob patterns are matched against synthetic
+    file paths using :func:`~filers.filters.compile_filter`, compared to
+    matching them with the unanchored `.*` regex they used to be translated
+    to.
+
+    >>> benchmark_filters(['*.avi'])
+    {'*.avi': ('suffix', 0.0071, 0.1603)}
+
+    :Parameters:
+
+        `patterns`: list
+            The glob patterns to benchmark.
+        `num_paths`: int
+            The number of paths to match. Defaults to 100000.
+        `depth`: int
+            The number of directories in each path. Defaults to 8.
+        `repeat`: int
+            The number of times each pattern is run. The fastest run is
+            used. Defaults to 3.
+
+    :returns:
+
+        A dict whose keys are the patterns, and whose values are 3-tuples of
+        the :attr:`~filers.filters.FileFilter.kind` of the compiled filter,
+        and the time in seconds it took to match all the paths with the
+        compiled filter, and with the regex.
+    '''
+    exts = ('.avi', '.txt', '.mp4', '.avi.bak', '')
+    paths = [
+        os.sep.join(['', 'data'] + ['day{}_dir{}'.format(i % 7, d)
+                                    for d in range(depth)] +
+                    ['video{}{}'.format(i, exts[i % len(exts)])])
+        for i in range(num_paths)]
+
+    def best_time(match):
+        best = None
+        for _ in range(repeat):
+            ts = default_timer()
+            for path in paths:
+                match(path)
+            elapsed = default_timer() - ts
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    results = {}
+    for pattern in patterns:
+        filt = compile_filter(pattern)
+        regex = re.compile(re.sub(re.escape('\\?'), '.', re.sub(
+            re.escape('\\*'), '.*', re.escape(pattern))))
+        results[pattern] = (filt.kind, best_time(filt.match),
+                            best_time(regex.match))
+    return results
+
+
+def benchmark_queues(num_files=10000, files_per_frame=100):
+    '''
+    Measures the time the Kivy thread spends reading the `cmd` and `file_stat`
+    updates that :class:`~filers.file_tools.FileTools` sends for every file,
+    using a :class:`~filers.tools.KivyQueue` and using a
+    :class:`~filers.tools.CoalescingKivyQueue`.
+
+    The files are processed in frames of `files_per_frame` files, after each
+    of which the queue is read if it was notified, as the Kivy clock would do.
+    The updates are handled similarly to
+    :meth:`~filers.file_tools.FileTools.read_queue`.
+
+    >>> benchmark_queues()
+    {'KivyQueue': (0.0777, 20000, 20000), 'CoalescingKivyQueue': (0.0069, 100, 200)}
+
+    :Parameters:
+
+        `num_files`: int
+            The number of files processed. Defaults to 10000.
+        `files_per_frame`: int
+            The number of files processed in each frame. Defaults to 100.
+
+    :returns:
+
+        A dict whose keys are the queue class names, and whose values are
+        3-tuples of the time in seconds spent reading the queue, the number
+        of times the queue notified, and the number of items read.
+    '''
+    results = {}
+    for cls in (KivyQueue, CoalescingKivyQueue):
+        notified = [0]
+
+        def notify():
+            notified[0] += 1
+
+        if cls is KivyQueue:
+            q = cls(notify)
+        else:
+            q = cls(notify, coalesce_keys=('file_stat', ),
+                    batch_keys=('cmd', ))
+        cmd_lines = []
+        state = {'cmd': '', 'rate': ''}
+        elapsed = 0.
+        count = 0
+        last_notified = 0
+
+        for i in range(num_files):
+            src = os.path.join('C:', 'videos', 'day{}'.format(i // 1000),
+                               'video{}.avi'.format(i))
+            dst = src.replace('C:', 'E:')
+            q.put('cmd', (src, 'copy', dst))
+            q.put('file_stat', (i * 1024, num_files * 1024, i, num_files,
+                                'copy', 1024. * 1024, i / 100., 10.))
+            if (i + 1) % files_per_frame and i + 1 != num_files:
+                continue
+            if notified[0] == last_notified:
+                continue
+            last_notified = notified[0]
+
+            ts = default_timer()
+            while True:
+                try:
+                    key, val = q.get()
+                except KivyQueue.Empty:
+                    break
+                count += 1
+                if key == 'cmd':
+                    vals = val if cls is CoalescingKivyQueue else [val]
+                    for src, mode, dst in vals[-100:]:
+                        cmd_lines.append(
+                            '[color=00FFFF]Copying[/color]: {} '
+                            '[color=FF0000]-->[/color] {}'.format(src, dst))
+                    del cmd_lines[:-100]
+                    state['cmd'] = '\n'.join(cmd_lines)
+                else:
+                    state['rate'] = '{}, {} sec'.format(
+                        pretty_space(val[5], is_rate=True),
+                        pretty_time(val[6]))
+            elapsed += default_timer() - ts
+        results[cls.__name__] = elapsed, notified[0], count
+    return results
+
+
+encoder_fields = ('compress_speed', 'crf', 'num_threads', 'wall_time', 'fps',
+                  'speed', 'bitrate', 'size', 'duration', 'frames')
+''' The keys of each result of :func:`benchmark_encoder`, in the order of the
+columns saved by :func:`save_encoder_results`.
+'''
+
+
+def benchmark_encoder(filename, speeds=('ultrafast', 'veryfast', 'medium'),
+                      crfs=('18', '23', '28'), threads=('auto', ),
+                      duration=None, ffmpeg_path=None, callback=None):
+    '''
+    Encodes the sample video `filename` with every combination of the
+    :attr:`~filers.engine.ProcessorEngine.compress_speed`,
+    :attr:`~filers.engine.ProcessorEngine.crf`, and
+    :attr:`~filers.engine.ProcessorEngine.num_threads` in `speeds`, `crfs`,
+    and `threads`, and measures how fast it was encoded and how large the
+    output is.
+
+    Each command is generated by
+    :meth:`~filers.engine.ProcessorEngine.gen_cmd`, so it's encoded exactly
+    like when processing the files, and the outputs are written to a
+    temporary directory that is removed afterwards.
+
+    >>> results = benchmark_encoder('video1.avi', ['veryfast'], ['18', '23'])
+    >>> [(r['crf'], r['fps'], r['bitrate']) for r in results]
+    [('18', 212.4, 6820.5), ('23', 240.9, 2710.1)]
+
+    :Parameters:
+
+        `filename`: str
+            The sample video.
+        `speeds`: list
+            The `compress_speed` values to test. Defaults to `ultrafast`,
+            `veryfast`, and `medium`.
+        `crfs`: list
+            The `crf` values to test. Defaults to `18`, `23`, and `28`.
+        `threads`: list
+            The `num_threads` values to test. Defaults to `auto`.
+        `duration`: float
+            If not None, only the first `duration` seconds of the video are
+            encoded. Defaults to None.
+        `ffmpeg_path`: str
+            The FFmpeg executable. If None, it's searched for like
+            :class:`~filers.engine.ProcessorEngine` does. Defaults to None.
+        `callback`: callable
+            If not None, it's called with each result as soon as it's
+            measured, e.g. to print it. Defaults to None.
+
+    :returns:
+
+        A list of dicts, one for each combination, whose keys are in
+        :attr:`encoder_fields`. `wall_time` is the time in seconds it took to
+        encode the video, `fps` is the number of frames encoded per second,
+        `speed` is the encoding rate as a multiple of real time (it must be
+        at least 1 to keep up with recording), `bitrate` is the bitrate of the
+        output in kbit/s, `size` is the size of the output in bytes,
+        `duration` is its duration in seconds, and `frames` is its number of
+        frames.
+    '''
+    engine = ProcessorEngine()
+    if ffmpeg_path:
+        engine.ffmpeg_path = ffmpeg_path
+    if not engine.ffmpeg_path:
+        raise Exception('Cannot find the ffmpeg binary.')
+    engine.out_codec = 'h264'
+    engine.out_audio = False
+    engine.out_overwrite = True
+    engine.num_jobs = 1
+    engine.input_end = duration or 0.
+    size = getsize(filename)
+    root = tempfile.mkdtemp()
+
+    results = []
+    try:
+        for speed, crf, num_threads in product(speeds, crfs, threads):
+            engine.compress_speed = speed
+            engine.crf = crf
+            engine.num_threads = num_threads
+            dst = join(root, '{}_{}_{}.mp4'.format(speed, crf, num_threads))
+            cmd = engine.gen_cmd([(dst, [(filename, size)])])[0][0]
+            state = {}
+
+            ts = default_timer()
+            code, lines, _ = run_ffmpeg(
+                cmd, callback=lambda progress, _: state.update(progress))
+            elapsed = default_timer() - ts
+            if code:
+                raise Exception('FFmpeg failed:\n{}'.format('\n'.join(lines)))
+
+            out_size = getsize(dst)
+            out_time = state.get('out_time') or 0.
+            frames = state.get('frame') or 0
+            result = {
+                'compress_speed': speed, 'crf': crf,
+                'num_threads': num_threads, 'wall_time': elapsed,
+                'fps': frames / elapsed if elapsed else 0.,
+                'speed': out_time / elapsed if elapsed else 0.,
+                'bitrate': out_size * 8 / out_time / 1000. if out_time else 0.,
+                'size': out_size, 'duration': out_time, 'frames': frames}
+            os.remove(dst)
+            results.append(result)
+            if callback is not None:
+                callback(result)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def save_encoder_results(results, filename):
+    '''
+    Saves the results of :func:`benchmark_encoder` to `filename`. If it ends
+    with `.json`, it's saved as a json list of the results, otherwise as a CSV
+    file with a header row of the :attr:`encoder_fields`.
+    '''
+    if filename.lower().endswith('.json'):
+        with open(filename, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+        return
+
+    with open(filename, 'w') as fh:
+        writer = csv.writer(fh, lineterminator='\n')
+        writer.writerow(encoder_fields)
+        for result in results:
+            writer.writerow([result[key] for key in encoder_fields])
+
+
+def _print_encoder_results(args):
+    print('{:<12}{:>5}{:>8}{:>10}{:>10}{:>8}{:>12}'.format(
+        'speed', 'crf', 'threads', 'time', 'fps', 'x', 'kbit/s'))
+
+    def print_result(r):
+        print('{:<12}{:>5}{:>8}{:>8.2f} s{:>10.1f}{:>8.2f}{:>12.1f}'.format(
+            r['compress_speed'], r['crf'], r['num_threads'], r['wall_time'],
+            r['fps'], r['speed'], r['bitrate']))
+
+    results = benchmark_encoder(
+        args.filename, speeds=args.speeds, crfs=args.crfs,
+        threads=args.threads, duration=args.duration,
+        ffmpeg_path=args.ffmpeg_path, callback=print_result)
+    if args.output:
+        save_encoder_results(results, args.output)
+
+
+def _print_queue_results(args):
+    results = benchmark_queues(args.files, args.files_per_frame)
+    for name in ('KivyQueue', 'CoalescingKivyQueue'):
+        elapsed, notified, count = results[name]
+        print('{:<22}{:>10.4f} sec{:>10} notifications{:>10} items'.format(
+            name, elapsed, notified, count))
+
+
+def _print_filter_results(args):
+    results = benchmark_filters(args.patterns, args.paths, repeat=args.repeat)
+    print('{:<20}{:<16}{:>12}{:>12}'.format(
+        'pattern', 'kind', 'filter', 'regex'))
+    for pattern in args.patterns:
+        kind, filt_time, regex_time = results[pattern]
+        print('{:<20}{:<16}{:>10.4f} s{:>10.4f} s'.format(
+            pattern, kind, filt_time, regex_time))
+
+
+def _print_walk_results(args):
+    top = args.dir
+    if top is None:
+        top = tempfile.mkdtemp()
+        print('Creating {} files in {}'.format(args.files, top))
+        make_file_tree(top, args.files)
+    try:
+        results = benchmark_walk(top, args.threads)
+    finally:
+        if args.dir is None:
+            shutil.rmtree(top)
+    for name in ('os.walk', 'walker', 'parallel'):
+        if name not in results:
+            continue
+        elapsed, calls, count = results[name]
+        print('{:<10}{:>10.2f} sec{:>12} stat calls{:>12} files'.format(
+            name, elapsed, calls, count))
+
+
+def _print_hash_results(args):
+    results = benchmark_hash_backends(
+        names=args.names or None, size=args.size * 1024 * 1024,
+        blocksize=args.blocksize, filename=args.file, repeat=args.repeat,
+        mmap_threshold=1 if args.mmap else None)
+    for name, rate in sorted(results.items(), key=lambda x: -x[1]):
+        print('{:<12}{:>12}'.format(
+            name, pretty_space(rate * 1024 * 1024, is_rate=True)))
+
+
+def main(args=None):
+    '''
+    Runs the benchmark selected from the command line arguments and prints
+    its results. See the module description.
+
+    :Parameters:
+
+        `args`: list
+            The command line arguments. If None, `sys.argv` is used.
+            Defaults to None.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Benchmarks Filers on this machine.')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    hash_parser = subparsers.add_parser(
+        'hash', help='The speed of the hash algorithms.')
+    hash_parser.add_argument(
+        'names', nargs='*', help='The algorithms to benchmark (default all).')
+    hash_parser.add_argument(
+        '--file', default=None, help='Hash this file rather than from memory.')
+    hash_parser.add_argument(
+        '--size', type=int, default=64,
+        help='The number of MB to hash from memory.')
+    hash_parser.add_argument('--blocksize', type=int, default=1024 * 1024)
+    hash_parser.add_argument(
+        '--mmap', action='store_true',
+        help='Memory map the file rather than reading it.')
+    hash_parser.add_argument('--repeat', type=int, default=3)
+    hash_parser.set_defaults(func=_print_hash_results)
+
+    walk_parser = subparsers.add_parser(
+        'walk', help='Walking a directory tree with and without the walker.')
+    walk_parser.add_argument(
+        '--dir', default=None,
+        help='Walk this directory rather than a synthetic tree.')
+    walk_parser.add_argument(
+        '--files', type=int, default=1000000,
+        help='The number of files in the synthetic tree.')
+    walk_parser.add_argument(
+        '--threads', type=int, default=1,
+        help='Also time walking with this many threads.')
+    walk_parser.set_defaults(func=_print_walk_results)
+
+    filter_parser = subparsers.add_parser(
+        'filter', help='The speed of matching the input filters.')
+    filter_parser.add_argument(
+        'patterns', nargs='+', help='The simple glob patterns to benchmark.')
+    filter_parser.add_argument(
+        '--paths', type=int, default=100000,
+        help='The number of paths to match.')
+    filter_parser.add_argument('--repeat', type=int, default=3)
+    filter_parser.set_defaults(func=_print_filter_results)
+
+    queue_parser = subparsers.add_parser(
+        'queue', help='The Kivy thread time spent reading file updates.')
+    queue_parser.add_argument(
+        '--files', type=int, default=10000,
+        help='The number of files processed.')
+    queue_parser.add_argument(
+        '--files-per-frame', type=int, default=100,
+        help='The number of files processed between Kivy frames.')
+    queue_parser.set_defaults(func=_print_queue_results)
+
+    encoder_parser = subparsers.add_parser(
+        'encoder', help='The speed and bitrate of the h264 encoder settings.')
+    encoder_parser.add_argument('filename', help='The sample video.')
+    encoder_parser.add_argument(
+        '--speeds', nargs='+', default=['ultrafast', 'veryfast', 'medium'],
+        help='The compress_speed presets to test.')
+    encoder_parser.add_argument(
+        '--crfs', nargs='+', default=['18', '23', '28'],
+        help='The crf values to test.')
+    encoder_parser.add_argument(
+        '--threads', nargs='+', default=['auto'],
+        help='The num_threads values to test.')
+    encoder_parser.add_argument(
+        '--duration', type=float, default=None,
+        help='Only encode the first this many seconds of the video.')
+    encoder_parser.add_argument(
+        '--ffmpeg-path', default=None, help='The FFmpeg executable.')
+    encoder_parser.add_argument(
+        '--output', default=None,
+        help='Save the results to this .csv or .json file.')
+    encoder_parser.set_defaults(func=_print_encoder_results)
+
+    args = parser.parse_args(args)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,416 @@
+'''Cache
+=======
+
+Persistent caches used to avoid redoing expensive work, e.g. hashing files
+or probing them with a command, across runs.
+'''
+
+import os
+from os.path import join, abspath, dirname, isdir
+import sqlite3
+from threading import RLock
+import time
+
+from filers import user_data_path
+
+__all__ = ('SQLiteCache', 'HashCache', 'ProbeCache')
+
+
+class SQLiteCache(object):
+    '''
+    The base class of the persistent on-disk caches, stored in a SQLite
+    database, that cache a value (bytes) computed from a file.
+
+    Each value is keyed by a tuple, e.g. the file's path and the hash
+    algorithm, and it's stored together with the file's signature (e.g. its
+    size and modification time) when the value was computed. A cached value
+    is only returned if the file's current signature is unchanged.
+
+    The cache is bounded to :attr:`max_entries` values, beyond which the least
+    recently used values are evicted. It can be used from multiple threads.
+
+    Subclasses define the schema with :attr:`table`, :attr:`key_columns`, and
+    :attr:`signature_columns`, and define :meth:`stat_signature`.
+
+    :Parameters:
+
+        `filename`: str
+            The filename of the database. If None, it's
+            :attr:`default_filename` in :attr:`~filers.user_data_path`.
+            Defaults to None.
+        `max_entries`: int
+            The value of :attr:`max_entries`. If None, the class default is
+            used. Defaults to None.
+    '''
+
+    table = ''
+    ''' The name of the database table. '''
+
+    key_columns = ()
+    ''' The names of the text columns that make up the key of a value. '''
+
+    signature_columns = ()
+    ''' 2-tuples of the name and SQLite type of the columns of the file's
+    signature, in the order of :meth:`stat_signature`.
+    '''
+
+    value_column = 'value'
+    ''' The name of the blob column of the value. '''
+
+    default_filename = ''
+    ''' The filename of the database in :attr:`~filers.user_data_path` when no
+    filename is given.
+    '''
+
+    filename = ''
+    ''' The filename of the database. '''
+
+    max_entries = 1000000
+    ''' The maximum number of values to keep in the cache. '''
+
+    _conn = None
+
+    _lock = None
+
+    _num_added = 0
+    ''' The number of values added since we last evicted. '''
+
+    def __init__(self, filename=None, max_entries=None):
+        super(SQLiteCache, self).__init__()
+        if not filename:
+            filename = join(user_data_path, self.default_filename)
+        if dirname(filename) and not isdir(dirname(filename)):
+            os.makedirs(dirname(filename))
+        self.filename = filename
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self._lock = RLock()
+
+        table = self.table
+        columns = ['{} TEXT NOT NULL'.format(c) for c in self.key_columns]
+        columns += ['{} {}'.format(c, t) for c, t in self.signature_columns]
+        self._where = ' AND '.join(
+            ['{} = ?'.format(c) for c in self.key_columns])
+
+        self._conn = conn = sqlite3.connect(filename, check_same_thread=False)
+        # it's only a cache, so we don't need to wait for the disk
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS {} ({}, {} BLOB, atime REAL, '
+            'PRIMARY KEY ({}))'.format(
+                table, ', '.join(columns), self.value_column,
+                ', '.join(self.key_columns)))
+        conn.execute('CREATE INDEX IF NOT EXISTS {0}_atime ON {0} (atime)'.
+                     format(table))
+        conn.commit()
+
+    @staticmethod
+    def stat_signature(filename):
+        '''
+        Returns the signature of the file used to tell whether it changed
+        since its value was computed, as a tuple matching
+        :attr:`signature_columns`.
+        '''
+        raise NotImplementedError
+
+    def get_value(self, key, signature):
+        '''
+        Returns the cached value of `key`, or None if it's not cached or if
+        the file's current `signature` is different than when it was cached,
+        in which case the value is removed.
+        '''
+        num = len(self.signature_columns)
+        with self._lock:
+            conn = self._conn
+            row = conn.execute(
+                'SELECT {}, {} FROM {} WHERE {}'.format(
+                    ', '.join([c for c, _ in self.signature_columns]),
+                    self.value_column, self.table, self._where),
+                key).fetchone()
+            if row is None:
+                return None
+            if tuple(row[:num]) != tuple(signature):
+                conn.execute('DELETE FROM {} WHERE {}'.format(
+                    self.table, self._where), key)
+                conn.commit()
+                return None
+
+            conn.execute('UPDATE {} SET atime = ? WHERE {}'.format(
+                self.table, self._where), (time.time(), ) + tuple(key))
+            conn.commit()
+            return bytes(row[num])
+
+    def set_value(self, key, value, signature):
+        '''
+        Adds the `value` of `key`, computed when the file's signature was
+        `signature`, to the cache, replacing any existing value.
+        '''
+        columns = list(self.key_columns) + \
+            [c for c, _ in self.signature_columns] + \
+            [self.value_column, 'atime']
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO {} ({}) VALUES ({})'.format(
+                    self.table, ', '.join(columns),
+                    ', '.join(['?'] * len(columns))),
+                tuple(key) + tuple(signature) +
+                (sqlite3.Binary(value), time.time()))
+            self._conn.commit()
+
+            self._num_added += 1
+            if self._num_added >= max(self.max_entries // 10, 1):
+                self.evict()
+
+    def remove_values(self, key):
+        '''
+        Removes the values whose key starts with the items in `key`, e.g.
+        all the values of a file if the first key column is its path.
+        '''
+        where = ' AND '.join(
+            ['{} = ?'.format(c) for c in self.key_columns[:len(key)]])
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM {} WHERE {}'.format(self.table, where),
+                tuple(key))
+            self._conn.commit()
+
+    def evict(self):
+        '''
+        Removes the least recently used values so that the cache contains no
+        more than :attr:`max_entries` values.
+        '''
+        table = self.table
+        with self._lock:
+            self._num_added = 0
+            conn = self._conn
+            count = conn.execute(
+                'SELECT COUNT(*) FROM {}'.format(table)).fetchone()[0]
+            if count <= self.max_entries:
+                return
+            conn.execute(
+                'DELETE FROM {0} WHERE rowid IN (SELECT rowid FROM {0} '
+                'ORDER BY atime ASC, rowid ASC LIMIT ?)'.format(table),
+                (count - self.max_entries, ))
+            conn.commit()
+
+    def clear(self):
+        ''' Removes all the values from the cache.
+        '''
+        with self._lock:
+            self._conn.execute('DELETE FROM {}'.format(self.table))
+            self._conn.commit()
+
+    def close(self):
+        ''' Closes the database. The cache cannot be used afterwards.
+        '''
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class HashCache(SQLiteCache):
+    '''
+    A persistent on-disk cache of file hashes. See :class:`SQLiteCache`.
+
+    Each hash is keyed by the file's path and the hash algorithm, and it's
+    stored together with the file's stat signature (size, modification time,
+    and inode) at the time it was hashed. A cached hash is only returned if
+    the file's current signature is unchanged, otherwise the file must be
+    re-hashed.
+
+    >>> from hashlib import sha256
+    >>> from filers.tools import hashfile
+    >>> cache = HashCache()
+    >>> hashfile('filepath', sha256(), cache=cache)
+    '6Zxvdsfk327*'
+    >>> cache.get('filepath', 'sha256')
+    '6Zxvdsfk327*'
+
+    :Parameters:
+
+        `filename`: str
+            The filename of the database. If None, it's `hash_cache.sqlite`
+            in :attr:`~filers.user_data_path`. Defaults to None.
+        `max_entries`: int
+            The value of :attr:`max_entries`. Defaults to 1000000.
+    '''
+
+    table = 'hashes'
+
+    key_columns = ('path', 'algorithm')
+
+    signature_columns = (
+        ('size', 'INTEGER'), ('mtime', 'REAL'), ('inode', 'INTEGER'))
+
+    value_column = 'digest'
+
+    default_filename = 'hash_cache.sqlite'
+
+    max_entries = 1000000
+    ''' The maximum number of hashes to keep in the cache. '''
+
+    @staticmethod
+    def stat_signature(filename):
+        '''
+        Returns the signature of the file used to tell whether it changed
+        since it was hashed. It's a 3-tuple of its size, modification time,
+        and inode.
+        '''
+        st = os.stat(filename)
+        return st.st_size, st.st_mtime, st.st_ino
+
+    def get(self, filename, algorithm, signature=None):
+        '''
+        Returns the cached hash of the file, or None if it's not cached or if
+        the file changed since it was hashed.
+
+        :Parameters:
+
+            `filename`: str
+                The filename of the file.
+            `algorithm`: str
+                The name of the hash algorithm, e.g. `'sha256'`. It's case
+                insensitive.
+            `signature`: tuple
+                The current signature of the file as returned by
+                :meth:`stat_signature`. If None, it's computed. Defaults to
+                None.
+        '''
+        if signature is None:
+            signature = self.stat_signature(filename)
+        return self.get_value(
+            (abspath(filename), algorithm.lower()), signature)
+
+    def set(self, filename, algorithm, digest, signature=None):
+        '''
+        Adds the hash of the file to the cache, replacing any existing hash.
+
+        :Parameters:
+
+            `filename`: str
+                The filename of the file.
+            `algorithm`: str
+                The name of the hash algorithm, e.g. `'sha256'`.
+            `digest`: bytes
+                The hash of the file.
+            `signature`: tuple
+                The signature of the file, as returned by
+                :meth:`stat_signature`, when it was hashed. If None, it's
+                computed. Defaults to None.
+        '''
+        if signature is None:
+            signature = self.stat_signature(filename)
+        self.set_value(
+            (abspath(filename), algorithm.lower()), digest, signature)
+
+    def remove(self, filename, algorithm=None):
+        '''
+        Removes the file's hashes from the cache, forcing it to be re-hashed.
+
+        :Parameters:
+
+            `filename`: str
+                The filename of the file.
+            `algorithm`: str
+                The name of the hash algorithm, e.g. `'sha256'`, whose hash
+                to remove. If None, all the file's hashes are removed.
+                Defaults to None.
+        '''
+        if algorithm is None:
+            self.remove_values((abspath(filename), ))
+        else:
+            self.remove_values((abspath(filename), algorithm.lower()))
+
+
+class ProbeCache(SQLiteCache):
+    '''
+    A persistent on-disk cache of the output of commands run on files, e.g.
+    :attr:`~filers.engine.ProcessorEngine.pre_process` commands such as
+    `ffprobe {}`. See :class:`SQLiteCache`.
+
+    Each output is keyed by the command template and the file's path, and it's
+    stored together with the file's size and modification time when the
+    command was run. A cached output is only returned if the file's current
+    size and modification time are unchanged, otherwise the command must be
+    run again.
+
+    >>> cache = ProbeCache()
+    >>> cache.get('ffprobe {}', 'video.avi')
+    >>> cache.set('ffprobe {}', 'video.avi', b'duration=10.0')
+    >>> cache.get('ffprobe {}', 'video.avi')
+    b'duration=10.0'
+
+    :Parameters:
+
+        `filename`: str
+            The filename of the database. If None, it's `probe_cache.sqlite`
+            in :attr:`~filers.user_data_path`. Defaults to None.
+        `max_entries`: int
+            The value of :attr:`max_entries`. Defaults to 100000.
+    '''
+
+    table = 'outputs'
+
+    key_columns = ('command', 'path')
+
+    signature_columns = (('size', 'INTEGER'), ('mtime', 'REAL'))
+
+    value_column = 'output'
+
+    default_filename = 'probe_cache.sqlite'
+
+    max_entries = 100000
+    ''' The maximum number of outputs to keep in the cache. '''
+
+    @staticmethod
+    def stat_signature(filename):
+        '''
+        Returns the signature of the file used to tell whether it changed
+        since the command was run. It's a 2-tuple of its size and modification
+        time.
+        '''
+        st = os.stat(filename)
+        return st.st_size, st.st_mtime
+
+    def get(self, command, filename, signature=None):
+        '''
+        Returns the cached output of the command run on the file, or None if
+        it's not cached or if the file changed since.
+
+        :Parameters:
+
+            `command`: str
+                The command template, e.g. `'ffprobe {}'`.
+            `filename`: str
+                The filename of the file.
+            `signature`: tuple
+                The current signature of the file as returned by
+                :meth:`stat_signature`. If None, it's computed. Defaults to
+                None.
+        '''
+        if signature is None:
+            signature = self.stat_signature(filename)
+        return self.get_value((command, abspath(filename)), signature)
+
+    def set(self, command, filename, output, signature=None):
+        '''
+        Adds the output of the command run on the file to the cache, replacing
+        any existing output.
+
+        :Parameters:
+
+            `command`: str
+                The command template, e.g. `'ffprobe {}'`.
+            `filename`: str
+                The filename of the file.
+            `output`: bytes
+                The output of the command.
+            `signature`: tuple
+                The signature of the file, as returned by
+                :meth:`stat_signature`, when the command was run. If None,
+                it's computed. Defaults to None.
+        '''
+        if signature is None:
+            signature = self.stat_signature(filename)
+        self.set_value((command, abspath(filename)), output, signature)
@@ -0,0 +1,243 @@
+'''Command Line
+===============
+
+Runs the file tools and video processing engines of :mod:`filers.engine`
+without a display, e.g. on a server. E.g.::
+
+    filers-cli files --input /data/videos --input-filter "*.avi" \\
+--output /backup/videos --mode move --verify-type sha256 --preview false
+
+or::
+
+    python -m filers.cli process --input /data/videos --output /data/mp4
+
+The first argument selects the engine, `files` for
+:class:`~filers.engine.FileToolsEngine` and `process` for
+:class:`~filers.engine.ProcessorEngine`. Every setting of the engine, e.g.
+:attr:`~filers.engine.FileToolsEngine.input_filter`, can be passed as an
+option with the underscores replaced by dashes, e.g. `--input-filter`. Like in
+the GUI, :attr:`~filers.engine.FileToolsEngine.preview` defaults to true, in
+which case the files are only listed. Because no one can resume a paused job,
+:attr:`~filers.engine.FileToolsEngine.on_error` is always `skip`.
+
+The progress is written to stdout as JSON lines, one for every message of the
+engine's `queue`. Each is an object whose `event` key is the message key,
+e.g. `file_stat`, and whose other keys are the message values. E.g.::
+
+    {"event": "count_done", "files_out": 2, "files": 2, "dirs": 1, ...}
+    {"event": "cmd", "src": "/data/videos/a.avi", "mode": "move", ...}
+    {"event": "file_stat", "size_done": 1048576, "size_total": 2097152, ...}
+
+The exit code is one of :attr:`EXIT_OK`, :attr:`EXIT_FAILED`,
+:attr:`EXIT_SKIPPED`, or :attr:`EXIT_INTERRUPTED`, or `2` if the options are
+invalid.
+'''
+
+import sys
+import json
+import argparse
+from time import sleep
+
+from six import text_type
+
+from filers.engine import FileToolsEngine, ProcessorEngine
+from filers.tools import KivyQueue
+
+__all__ = ('EXIT_OK', 'EXIT_FAILED', 'EXIT_SKIPPED', 'EXIT_INTERRUPTED',
+           'engines', 'run', 'main')
+
+EXIT_OK = 0
+''' The exit code when all the files were processed successfully. '''
+
+EXIT_FAILED = 1
+''' The exit code when the job failed, e.g. the settings were invalid. '''
+
+EXIT_SKIPPED = 3
+''' The exit code when the job completed, but some files failed and were
+skipped.
+'''
+
+EXIT_INTERRUPTED = 130
+''' The exit code when the job was stopped with Ctrl-C. '''
+
+_count_fields = ('files_out', 'files', 'dirs', 'size', 'ignored')
+
+engines = {
+    'files': (FileToolsEngine, {
+        'count': _count_fields, 'count_done': _count_fields,
+        'cmd': ('src', 'mode', 'dst'),
+        'file_stat': ('size_done', 'size_total', 'count_done', 'count_total',
+                      'mode', 'bps', 'elapsed', 'remaining',
+                      'count_unchanged'),
+        'failure': 'reason', 'skipped': 'error', 'warning': 'message'}),
+    'process': (ProcessorEngine, {
+        'count': _count_fields, 'count_done': _count_fields,
+        'file_cmd': 'cmd',
+        'file_progress': ('dst', 'out_time', 'done', 'fps', 'speed',
+                          'remaining'),
+        'file_stat': ('out_size_done', 'out_size_total', 'in_size_done',
+                      'in_size_total', 'in_count_done', 'in_count_total',
+                      'out_count_done', 'out_count_total', 'bps', 'elapsed',
+                      'remaining'),
+        'failure': 'reason', 'skipped': 'error', 'warning': 'message'})
+}
+''' A dict whose keys are the names of the engines, and whose values are
+2-tuples of the engine class, and a dict that names the values of its queue
+messages. For each message key, it's either the name of the value, or for
+tuple values, a tuple of the names of the items.
+'''
+
+_excluded = ('on_error', 'pause_on_skip')
+''' The settings that cannot be set from the command line, because they
+pause the job. '''
+
+
+def _event(key, val, fields):
+    ''' Returns the list of the JSON objects (dicts) of a queue message.
+    '''
+    names = fields.get(key)
+    if val is None:
+        return [{'event': key}]
+    if key == 'cmd' and isinstance(val, list):
+        # batched by the coalescing queue
+        return [_event(key, item, fields)[0] for item in val]
+    if names is None:
+        return [{'event': key, 'value': val}]
+    if isinstance(names, tuple):
+        event = dict(zip(names, val))
+    else:
+        event = {names: val}
+    event['event'] = key
+    return [event]
+
+
+def run(engine, fields, out=None, poll_interval=.1):
+    '''
+    Runs the engine until it's done, writing its progress to `out` as JSON
+    lines.
+
+    :Parameters:
+
+        `engine`: engine instance
+            A :class:`~filers.engine.FileToolsEngine` or
+            :class:`~filers.engine.ProcessorEngine`, whose settings are
+            already set.
+        `fields`: dict
+            The dict naming the values of the queue messages. See
+            :attr:`engines`.
+        `out`: file
+            The file to which the JSON lines are written. If None,
+            `sys.stdout` is used. Defaults to None.
+        `poll_interval`: float
+            How often, in seconds, the engine's queue is read. Defaults to
+            `0.1`.
+
+    :returns:
+
+        The exit code. See :mod:`filers.cli`.
+    '''
+    out = out or sys.stdout
+    queue = engine.queue
+    state = {'code': EXIT_FAILED, 'skipped': 0}
+
+    def write_events():
+        while True:
+            try:
+                key, val = queue.get()
+            except KivyQueue.Empty:
+                break
+            if key == 'pause':
+                engine.set_pause(False)
+            elif key == 'skipped':
+                state['skipped'] += 1
+            elif key == 'failure':
+                state['code'] = EXIT_FAILED
+            elif key == 'done':
+                state['code'] = EXIT_SKIPPED if state['skipped'] else EXIT_OK
+            for event in _event(key, val, fields):
+                out.write(json.dumps(event))
+                out.write('\n')
+        out.flush()
+
+    if not engine.start():
+        return EXIT_FAILED
+    try:
+        while True:
+            running = engine.running
+            write_events()
+            if not running:
+                break
+            sleep(poll_interval)
+    except KeyboardInterrupt:
+        engine.stop()
+        write_events()
+        return EXIT_INTERRUPTED
+    return state['code']
+
+
+def _bool_option(val):
+    ''' Converts a bool option string, e.g. `true` or `0`, to a bool.
+    '''
+    val = val.lower()
+    if val in ('true', 'yes', '1'):
+        return True
+    if val in ('false', 'no', '0'):
+        return False
+    raise argparse.ArgumentTypeError('{} is not true or false'.format(val))
+
+
+def _setting_type(default):
+    ''' Returns the callable that converts an option string to the type of
+    the setting's default value.
+    '''
+    if isinstance(default, bool):
+        return _bool_option
+    if isinstance(default, (int, float)):
+        return type(default)
+    return text_type
+
+
+def main(argv=None):
+    '''
+    The entry point of the command line. It parses the options in `argv`,
+    or `sys.argv` if None, runs the selected engine, and returns the exit
+    code.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Process files without the GUI, writing the progress to '
+        'stdout as JSON lines.')
+    subparsers = parser.add_subparsers(dest='engine')
+    subparsers.required = True
+    for name, (cls, _) in sorted(engines.items()):
+        engine_parser = subparsers.add_parser(
+            name, help='Runs the {}.'.format(cls.__name__))
+        for setting in cls.settings:
+            if setting in _excluded:
+                continue
+            default = getattr(cls, setting)
+            engine_parser.add_argument(
+                '--' + setting.replace('_', '-'), dest=setting,
+                type=_setting_type(default), default=default,
+                help='Defaults to {!r}. See {}.{}.'.format(
+                    default, cls.__name__, setting))
+        if cls is ProcessorEngine:
+            engine_parser.add_argument(
+                '--ffmpeg-path', dest='ffmpeg_path', default='',
+                help='The FFmpeg executable. If empty, it is searched for.')
+
+    args = parser.parse_args(argv)
+    cls, fields = engines[args.engine]
+    engine = cls()
+    for setting in cls.settings:
+        if setting not in _excluded:
+            setattr(engine, setting, getattr(args, setting))
+    if cls is FileToolsEngine:
+        engine.on_error = 'skip'
+        engine.preview_pause = False
+    elif args.ffmpeg_path:
+        engine.ffmpeg_path = args.ffmpeg_path
+    return run(engine, fields)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,2672 @@
+'''Engine
+==========
+
+The Kivy-free engines that enumerate and process the files of
+:class:`~filers.file_tools.FileTools` and of the video processor, so that
+they can also be run without a display, e.g. from the command line with
+:mod:`filers.cli`, or from other code::
+
+    >>> from filers.engine import FileToolsEngine
+    >>> engine = FileToolsEngine()
+    >>> engine.input = 'C:\\\\videos'
+    >>> engine.input_filter = '*.avi'
+    >>> engine.output = 'E:\\\\backup'
+    >>> engine.preview = False
+    >>> engine.start()
+    True
+
+The engines run in their own thread, and report their progress through their
+`queue`. The GUI classes, e.g. :class:`~filers.file_tools.FileTools`,
+subclass the engines, turning their settings into config properties, and
+reading the queue from the Kivy thread.
+
+This module doesn't import Kivy, so it's quick to import.
+'''
+
+import os
+from os import makedirs, remove, chmod
+from os.path import join, exists, expanduser, abspath, isdir, isfile, dirname,\
+    split, splitext, getsize, sep
+import stat
+import logging
+from threading import Thread, Lock
+import time
+import math
+import traceback
+import tempfile
+import re
+from re import match, escape, sub
+from binascii import hexlify
+from collections import defaultdict
+from functools import partial
+from multiprocessing import cpu_count
+from timeit import default_timer as clock
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+from time import sleep
+
+from filers.tools import KivyQueue, CoalescingKivyQueue, hashfile, copyfile, \
+    copyfile_hash, copyfile_resumable, hash_backends
+from filers import FilerException, user_data_path
+from filers.cache import HashCache, ProbeCache
+from filers.journal import FileJournal, job_journal_filename, \
+    OutputManifest, output_manifest_filename
+from filers.walker import walk, walk_many
+from filers.filters import compile_filter, DirFilter, split_patterns
+from filers.table import FileTable
+from filers.ffmpeg import find_ffmpeg, popen, run_ffmpeg, probe_video
+
+__all__ = ('FileToolsEngine', 'ProcessorEngine')
+
+_run_options_pat = re.compile(
+    r' -(?:threads|progress) \S+| -nostats| -[yn](?= )')
+''' Matches the FFmpeg options of :meth:`ProcessorEngine.gen_cmd` that only
+affect how it runs, not the output file.
+'''
+
+
+class _BestEffortCache(object):
+    ''' Wraps a :class:`~filers.cache.SQLiteCache` so that it's only used as
+    an optimization. The first time reading or writing the cache fails,
+    `on_error` is called with the exception and the cache is no longer used,
+    rather than failing the file that used it.
+    '''
+
+    def __init__(self, cache, on_error):
+        self.cache = cache
+        self.on_error = on_error
+        self.stat_signature = cache.stat_signature
+        self._lock = Lock()
+
+    def _call(self, name, *largs):
+        cache = self.cache
+        if cache is None:
+            return None
+        try:
+            return getattr(cache, name)(*largs)
+        except Exception as e:
+            with self._lock:
+                if self.cache is None:
+                    return None
+                self.cache = None
+            self.on_error(e)
+            try:
+                cache.close()
+            except Exception:
+                pass
+            return None
+
+    def get(self, *largs):
+        return self._call('get', *largs)
+
+    def set(self, *largs):
+        self._call('set', *largs)
+
+    def remove(self, *largs):
+        self._call('remove', *largs)
+
+    def close(self):
+        cache = self.cache
+        self.cache = None
+        if cache is not None:
+            cache.close()
+
+
+class FileToolsEngine(object):
+    '''
+    The engine of :class:`~filers.file_tools.FileTools`, which
+    moves/copies/verifies/deletes files en-masse, based on a list of input
+    files and patterns determining how the output files should look. See
+    :mod:`filers.file_tools`.
+
+    The settings, e.g. :attr:`input`, are plain attributes that should be set
+    before calling :meth:`start`.
+    '''
+
+    settings = ('input', 'simple_filt', 'input_filter', 'dir_include',
+                'dir_exclude', 'mode', 'verify_type', 'use_hash_cache',
+                'hash_cache_size', 'force_rehash', 'trust_fsync',
+                'io_block_size', 'mmap_threshold', 'part_file_size',
+                'checkpoint_size', 'ext', 'on_error', 'num_workers',
+                'stream_files', 'walk_threads', 'resume', 'data_path',
+                'preview', 'output')
+    ''' The names of the settings of the engine, which are stored in the
+    config by :class:`~filers.file_tools.FileTools`.
+    '''
+
+    queue = None
+    ''' The :class:`~filers.tools.CoalescingKivyQueue` with which we
+    communicate with the outside world, e.g. the kivy event loop. The work
+    thread sends updates with this queue, and :meth:`notify_queue` is called
+    when there are updates waiting to be read. The keys and values sent are:
+
+        `clean`: None
+            Sent when the threads starts.
+        `count`: int
+            Sent periodically, at most every :attr:`progress_interval`
+            seconds, while reading the input files describing
+            the files read so far. It's a 5-tuple of: # output files,
+            # input files, # of walked directories, total size of the input
+            files, and a dictionary where the keys are ignored files, or
+            extensions types (e.g. .txt) and their values are the number of
+            times they were ignored since the last `count`, i.e. only the
+            changes are sent. Directories that were skipped because of
+            :attr:`dir_include` or :attr:`dir_exclude` are also included,
+            keyed by their name followed by the path separator.
+        `count_done`: int
+            Identical to `count`, except it's sent when the count is done and
+            its dictionary contains the total number of times each file was
+            ignored, rather than the changes.
+        `failure`: str
+            Sent when something went wrong and the threads ends. The
+            value is a string with the reason for the failure. Upon failure,
+            the controller should call stop and set itself in stopped mode.
+        `cmd`: 3-tuple
+            Sent for every file as it is processed (e.g. moved) or when
+            previewing in preview mode. It's a 3-tuple of the source file, the
+            mode (e.g. verifying), and the destination filename. These are
+            batched, so when read from the queue, the value is a list of the
+            3-tuples sent since it was last read (up to the last 100).
+        `pause`: None
+            Sent when the controller should set itself in pause mode,
+            because the thread is paused. In preview mode, this is sent after
+            every cmd. Otherwise, it might be sent e.g. if too many files were
+            skipped.
+        `file_stat`: 9-tuple
+            Sent after each file that has been processed (e.g. moved)
+            containing status information. When read from the queue, only the
+            latest `file_stat` sent since it was last read is returned. It's a
+            9-tuple of: the total size of files processed, the total size of
+            all files , the total number of files processed, the count of all
+            files, the mode (e.g. move), the estimated bps at which things are
+            done, the total time elapsed, the estimated time left, and the
+            number of files processed that were skipped because they were
+            unchanged (in `sync` mode). The size of the unchanged files is not
+            included in the total sizes.
+        `skipped`: str
+            A string. Sent when the file is skipped due to error. The
+            string describes the files involved and the reason.
+        `warning`: str
+            Sent when the journal or the hash cache cannot be used, e.g. when
+            they cannot be written. The files are still processed, without
+            them. The string describes the problem.
+        `done`: None
+            Sent when the thread has completed it's work.
+    '''
+
+    thread = None
+    ''' The thread that runs our secondary thread. All disk R/W is done from
+    that thread. See :attr:`process_thread`. Defaults to None.
+    '''
+
+    running = False
+    ''' Whether the thread is running. It is set to True before launching the
+    thread, and the thread resets it to False before exiting. Defaults to
+    False. See :attr:`process_thread`.
+    '''
+    finish = False
+    ''' When set to True, it signals the thread to terminate. Defaults to
+    False.
+    '''
+    pause = False
+    ''' When set to True, it signals the thread to pause. Setting to False will
+    un-pause. Defaults to False.
+    '''
+    report = ''
+    ''' A text report of the files to be processed and ignored. This is
+    generated before any processing occurs. Defaults to `''`.
+    '''
+    error_list = []
+    ''' A list of text items, each item representing a file that failed to be
+    processed. It is updated dynamically. Defaults to `[]`.
+    '''
+    success_list = []
+    ''' A list of text items, each item representing a file that was
+    successfully processed. It is updated dynamically. Defaults to `[]`.
+    '''
+
+    input_split_pat = re.compile('''((?:[^,"']|"[^"]*"|'[^']*')+)''')
+    ''' The compiled pattern we use to break apart the list of input files to
+    process. Defaults to the compiled value of `', *'`.
+    '''
+
+    input = u''
+    ''' The list of input files and folders to be processed. It is
+    a comma (plus optional space) separated list. File or directory names
+    that contain a space, should be quoted with `"`. In the GUI, triple
+    clicking on this field will launch a file browser.
+    Defaults to `u''`.
+    '''
+    simple_filt = True
+    ''' Whether the filter we use to filter the input files with
+    uses the simple common format (where * - match anything, ? match any single
+    char), if True. If False, it's a python regex string. Defaults to True.
+
+    `True`:
+
+        When true, we filter the input files using **\\*** and **?**. For
+        example `\*.avi` will match all the avi files and `*.txt` all the .txt
+        files. The **?** symbol can be used to match any single character, for
+        example, ``video??.avi`` will match files named ``videoab.avi``,
+        ``video12.avi`` etc. The pattern must match the whole file path, so
+        e.g. `*.avi` does not match `video.avi.txt`. See
+        :mod:`filers.filters`.
+
+        Also, the ``output`` variable is then assumed to be the path to a
+        directory into which all the input files will be copied. For example,
+        given the following directory structure::
+
+            C:\\videos\\day1\\file1 day1.avi
+            C:\\videos\\day1\\file2 day1.avi
+            C:\\videos\\day1\\file1 day2.avi
+            C:\\videos\\day1\\file2 day2.avi
+            C:\\videos\\file10.avi
+            C:\\videos\\file11.avi
+
+        If the ``input`` variable is ``"C:\\videos"``, the ``mode`` is
+        ``copy``, and the ``output`` variable is ``"C:\\other videos"`` then
+        the whole directory structure in ``"videos"`` will be duplicated at
+        ``"other videos"``. The resulting files will be as follows::
+
+            C:\\other videos\\day1\\file1 day1.avi
+            C:\\other videos\\day1\\file2 day1.avi
+            C:\\other videos\\day1\\file1 day2.avi
+            C:\\other videos\\day1\\file2 day2.avi
+            C:\\other videos\\file10.avi
+            C:\\other videos\\file11.avi
+
+    `False`:
+
+        When ``false`` we filter the input files using a python regex. Only
+        files that match the regex will be included. For example, if
+        ``filter files`` is ``video[0-9]+\.(avi|mp4)`` then it will accept e.g.
+        ``video2.avi``, ``video66.mp4``, but not ``video2.txt`` or
+        ``video.avi``.
+
+        Also, the ``output`` variable is now a string into which the groups
+        of the input filename will be pasted using ``format``. For example, if
+        ``filter files`` is
+        ``".+(treatment([0-9]+)Day([0-9]+)Video(:?[0-9]+).+)"`` then there are
+        3 groups captured by the regex. The three groups are then passed as
+        arguments to format called on the ``output`` string. Basically,
+        the following operation is done on the contents of ``output``;
+        ``output.format(*re.match(re.compile(filter_files), filename).groups())``,
+        where ``filename`` is each input file and ``filter_files`` is the
+        contents of ``"filter files"``.
+
+        For example, if ``"filter files"`` is
+        ``".+(treatment([0-9]+)Day([0-9]+)Video(:?[0-9]+).+)"``, ``"output"``
+        is ``"C:\\sorted\\Treatment{1}\\Day{2}\\{0}``, and ``input`` is
+        ``C:\\videos"`` and we have the following file structure::
+
+            C:\\videos\\treatment1Day1Video1.avi
+            C:\\videos\\treatment1Day1Video3.avi
+            C:\\videos\\treatment1Day2Video1.avi
+            C:\\videos\\treatment2Day4Video1.avi
+            C:\\videos\\treatment2Day4Video2.avi
+            C:\\videos\\treatment2Day5Video2.avi
+
+        Then, for each input file above we match the full filename to
+        ``".+(treatment([0-9]+)Day([0-9]+)Video(:?[0-9]+).+)"`` which extracts
+        3 groups: the filename not including the folder name, the treatment
+        number, and the day number. These, when passed to format on the
+        contents of ``output`` will create a sorted directory containing a
+        folder for each treatment, which in turns contains a folder for each
+        day. Finally, each subfolder will contain the videos matching its
+        parent folders. The output files will now be::
+
+            C:\\sorted\\Treatment1\\Day1\\treatment1Day1Video1.avi
+            C:\\sorted\\Treatment1\\Day1\\treatment1Day1Video3.avi
+            C:\\sorted\\Treatment1\\Day2\\treatment1Day2Video1.avi
+            C:\\sorted\\Treatment2\\Day4\\treatment2Day4Video1.avi
+            C:\\sorted\\Treatment2\\Day4\\treatment2Day4Video2.avi
+            C:\\sorted\\Treatment2\\Day5\\treatment2Day5Video2.avi
+
+    .. note::
+        When False, as with all regex, special characters need to be escaped.
+        For example, ``\\`` needs to be written as ``\\`` to be used as a
+        backslash.
+    '''
+    input_filter = u''
+    ''' The filter to use to filter out input files. See
+    :attr:`simple_filt`. Defaults to `''`.
+    '''
+    dir_include = u''
+    ''' A comma separated list of simple globs of the directories, in the
+    :attr:`input` directories, to walk into when enumerating the input files.
+    Directories that don't match are skipped entirely, without listing
+    them, which can save a lot of time when :attr:`input_filter` can only
+    match files under certain directories. A glob can span multiple directory
+    levels, e.g. `*\\day*` only walks into the directories that start with
+    `day` in each of the directories in the input directory. If empty, all
+    the directories are walked, except those in :attr:`dir_exclude`. See
+    :class:`~filers.filters.DirFilter`. Defaults to `''`.
+    '''
+    dir_exclude = u''
+    ''' A comma separated list of simple globs of directory names that are
+    skipped entirely, at any depth, when enumerating the input files. E.g.
+    `.git, .svn, @eaDir, .thumbnails`. See :attr:`dir_include`. Defaults to
+    `''`.
+    '''
+    mode = u'copy'
+    ''' How to process the files. Can be one of `copy`, `sync`, `verify`,
+    `move`, or `delete originals`. Defaults to `copy`.
+
+        `copy`:
+            Will copy the files from source to destination, possibly
+            renaming or placing files in different places using the
+            `output` pattern. The copied file will be verified after the
+            copy with :attr:`verify_type`, an error will be generated for every
+            file that does not verify.
+        `sync`:
+            Similar to `copy`, except that when the destination file already
+            exists and matches the source, it's skipped rather than being an
+            error, and when it doesn't match, it's replaced with a new copy.
+            So only new or changed files are copied. With the `filename`
+            :attr:`verify_type`, every existing file matches. Otherwise, files
+            whose size and modification time match (within
+            :attr:`sync_mtime_tolerance`) are unchanged. If only their sizes
+            match, they match if :attr:`verify_type` is a hash algorithm
+            and their hashes match.
+        `move`:
+            Similar to `copy`, except the original files will be deleted
+            after the copy, provided it verified.
+        `verify`:
+            Will simply verify that the source files can be found
+            at the destination, as specified with the :attr:`output` pattern,
+            using :attr:`verify_type`. An error will be generated for every
+            file that does not verify.
+        `delete originals`:
+            Similar to what verify does, but then deletes the files that
+            verified.
+
+    Whatever the `mode`, all the files generated from the `input` variable
+    is compared to the corresponding filename generated from the `output` and
+    `filter files` variables using the verification procedure specified with
+    `verify type`. For example, when moving, the source files are copied
+    from their source location to the target location. Then if the source and
+    destination file are verified, the source file is deleted, otherwise,
+    an error is logged for this file.
+
+    In all instances, if the verification fails, no further processing is done
+    on that file. So e.g. `delete originals` will only delete the source files
+    if they verify.
+    '''
+    verify_type = u'size'
+    ''' The algorithm we use to verify that a source file also exists at the
+    destination. Can be one of `filename`, `size`, or the name of any hash
+    algorithm in :attr:`~filers.tools.hash_backends`, e.g. `sha256`, or
+    `blake2b`. Defaults to `size`.
+
+        `filename`:
+            simply checks that a file with the given input filename also
+            exists at the destination. Whether `simple filter` is `True` or
+            `False`, the files are compared without their extensions. For
+            example, in this mode, if the input file is `"Video file22.avi"`
+            and the output file is `"Video file22.mp4"`, even if their file
+            sizes were different it would pass verification.
+        `size`:
+            checks that the source and destination file sizes are identical,
+            ignoring their names. For example, in this mode, if the input file
+            is `"Video file22.avi"` and the output file is
+            `"New Video file104.mp4"`, as long as their size is the same, in
+            bytes, it would pass verification.
+        `sha256`:
+            uses the sha256 algorithm to verify that the source and destination
+            files are identical byte for byte. This ignores the filenames. The
+            files would pass verification only if the files are identical.
+
+            .. note::
+                The sha256 algorithm is slow and and its speed decreases
+                linearly with file size.
+        Other hash algorithms:
+            identical to `sha256`, except that the given algorithm is used to
+            hash the files. E.g. `blake2b`, or `xxh64` (if the `xxhash` package
+            is installed) are much faster than `sha256`. The hash of each file
+            is recorded in the :attr:`success_list`. Use
+            :mod:`filers.benchmark` to compare their speed on a particular
+            machine.
+
+        When copying using a hash algorithm, the source file is hashed while
+        it's copied so it's only read once. See also :attr:`trust_fsync`.
+    '''
+    use_hash_cache = False
+    ''' When :attr:`verify_type` is a hash algorithm, whether the file hashes
+    are stored in and read from a persistent :class:`~filers.cache.HashCache`.
+    When True, files that have not changed (same path, size, modification
+    time, and inode) since they were last hashed, e.g. in a previous run, will
+    not be hashed again. Defaults to `False`.
+    '''
+    hash_cache_size = 1000000
+    ''' The maximum number of file hashes stored in the hash cache when
+    :attr:`use_hash_cache` is True. Beyond that, the least recently used
+    hashes are evicted. Defaults to `1000000`.
+    '''
+    force_rehash = False
+    ''' When :attr:`use_hash_cache` is True, whether to ignore the cached
+    hashes and re-hash all the files. The new hashes are still saved to the
+    cache. Defaults to `False`.
+    '''
+    trust_fsync = False
+    ''' When copying or moving with a :attr:`verify_type` that is a hash
+    algorithm, e.g. `sha256`, whether
+    to trust the copy once it has been flushed to disk with `fsync`, rather
+    than reading back and hashing the destination file. When True, only the
+    file sizes are compared after the copy, which halves the I/O needed to
+    verify. Defaults to `False`.
+    '''
+    io_block_size = 1024 * 1024
+    ''' The size, in bytes, of the blocks in which files are read when hashing
+    or copying them. Each worker re-uses a single buffer of this size. Larger
+    blocks require fewer system calls, which may be faster for large files.
+    When possible (e.g. on Linux), files that are not hashed are copied
+    within the kernel instead. Defaults to `1048576` (1MB).
+    '''
+    mmap_threshold = 0
+    ''' When verifying files with a hash algorithm, files whose size in bytes
+    is at least :attr:`mmap_threshold` are hashed through a memory map rather
+    than by reading them into a buffer, which avoids the read system calls and
+    copies. This is typically faster for very large files, e.g. multi-GB raw
+    video files. When copying, the source file is still read as it's copied.
+    If zero, files are never memory mapped. Defaults to `0`.
+    '''
+    part_file_size = 0
+    ''' When copying or moving, files whose size in bytes is at least
+    :attr:`part_file_size` are copied into a temporary `.part` file next to
+    the destination, which is renamed to the destination filename only after
+    it has been verified. So a partially copied file is never mistaken for a
+    complete one. If zero, files are copied directly to the destination.
+    Defaults to `0`.
+
+    The copy is checkpointed every :attr:`checkpoint_size` bytes, so if it's
+    interrupted, e.g. by stopping or a crash, copying the file again
+    resumes from the last checkpoint rather than from the start. Stopping
+    also interrupts these files at their next checkpoint, rather than
+    waiting for them to finish. See
+    :func:`~filers.tools.copyfile_resumable`.
+    '''
+    checkpoint_size = 256 * 1024 * 1024
+    ''' When a file is copied into a `.part` file (see
+    :attr:`part_file_size`), the number of bytes copied between checkpoints.
+    Defaults to `268435456` (256MB).
+    '''
+    ext = u''
+    ''' When provided, and only if :attr:`simple_filt` is True, the output
+    filename will have its extension replaced with :attr:`ext`. Defaults to
+    `''`. The extension, if provided should include the period, `.`.
+    '''
+    on_error = u'pause'
+    ''' What to do when a file that is processed results in an error
+    e.g. if it doesn't verify. Can be one of `pause` or `skip`. Defaults to
+    `pause`.
+
+        `pause`:
+            Skips the file, notifies of error, and then pauses the program.
+        `skip`:
+            Simply skips the files and notifies of the error.
+    '''
+    num_workers = 1
+    ''' The number of files that are processed (e.g. copied and verified)
+    concurrently, each from its own worker thread. When copying many small
+    files, e.g. to a network drive, the time is dominated by the per-file
+    latency rather than the bandwidth, so using multiple workers can speed
+    things up considerably. Values less than 1 are treated as 1. Defaults to
+    `1`.
+
+    The files are still started in sorted order, but with more than one worker
+    they may complete out of order.
+    '''
+    stream_files = False
+    ''' Whether files should start being processed as soon as they are found,
+    rather than after all the input files have been enumerated. This is
+    useful for very large directory trees, where walking the tree can take a
+    long time. Defaults to `False`.
+
+    When True, the total number of files and their size, e.g. as shown in the
+    `file_stat` messages of :attr:`queue`, are the number of files found so
+    far. The :attr:`report` is generated once all the files have been
+    enumerated. It's ignored in :attr:`preview` mode.
+
+    In both modes, when multiple input files have the same output file, only
+    the first input file found is processed. See :attr:`output`.
+    '''
+    sync_mtime_tolerance = 2.
+    ''' In `sync` :attr:`mode`, the largest difference in seconds between the
+    modification times of the source and destination files for which they
+    are still considered equal. Some file systems, e.g. FAT, only store the
+    time at a 2 second resolution. Defaults to `2`.
+    '''
+    walk_threads = 1
+    ''' The number of directories that are listed concurrently when
+    enumerating the input files. On network shares, walking a large tree is
+    dominated by the round-trip latency of listing each directory, so listing
+    them in parallel, across all the :attr:`input` directories, is much
+    faster. The files are still enumerated in the same order. Values less than
+    2 list them one at a time. Defaults to `1`.
+    '''
+    progress_interval = .3
+    ''' The minimum time, in seconds, between the progress updates of
+    :meth:`enumerate_files`, and so between the `count` messages sent to
+    :attr:`queue`. Defaults to `0.3`.
+    '''
+    stream_queue_size = 1000
+    ''' The maximum number of files that can be waiting to be processed by
+    the workers. The files are passed on to the workers as they become free,
+    so only this many files are ever held outside of the compact
+    :class:`~filers.table.FileTable`. When :attr:`stream_files` is True, the
+    enumeration blocks when the workers fall behind by this many files.
+    Defaults to `1000`.
+    '''
+    resume = False
+    ''' Whether to resume the previous run of the same job (i.e. with the same
+    :attr:`mode`, :attr:`verify_type`, :attr:`input`, :attr:`input_filter`,
+    :attr:`simple_filt`, :attr:`output`, and :attr:`ext`), e.g. if it was
+    stopped or the app crashed. Defaults to `False`.
+
+    Every file processed is recorded in a journal (see
+    :class:`~filers.journal.FileJournal`). When resuming, the files that the
+    journal lists as successfully processed are skipped without accessing
+    them, and the files that failed are retried. When False, the journal of
+    any previous run is discarded. The journal is deleted once a job
+    completes without errors. If the journal cannot be written, a `warning`
+    message is sent to :attr:`queue` and the job runs without it.
+    '''
+    data_path = u''
+    ''' The directory where the journals and the hash cache are stored. If
+    empty, :attr:`~filers.user_data_path` is used. If they cannot be used,
+    e.g. when the directory is read-only, a `warning` message is sent to
+    :attr:`queue` and the files are processed without them. Defaults to `''`.
+    '''
+    preview = True
+    ''' If True, instead of running the action for this mode,
+    it will run through file by file, pausing after each file, showing
+    what action would be taken. For example, if the :attr:`mode` is `'move'`,
+    it'll show the source and target filenames for each file to be moved,
+    pausing after each, while not actually moving. Defaults to `True`.
+    '''
+    preview_pause = True
+    ''' Whether to pause after each file in :attr:`preview` mode. When False,
+    all the files are listed without pausing, e.g. by :mod:`filers.cli`,
+    where no one can resume. Defaults to `True`.
+    '''
+    output = u''
+    ''' If :attr:`simple_filt` is True, this is a directory into which the
+    source files are e.g. copied. If :attr:`simple_filt` is False, then the
+    regex is used to match the source file and then its groups are
+    used as substitute in the :attr:`output` string using format. I.e. if
+    :attr:`input` is an input file, `pat` is :attr:`input_filter`, then the
+    output file name for this input file is::
+
+        output.format(*re.match(re.compile(pat), input).groups())
+
+    When multiple input files have the same output file, only the first input
+    file found is processed, and the number of input files skipped is listed
+    in the :attr:`report`. This is the same whether or not
+    :attr:`stream_files` is True.
+
+    .. note::
+
+        Previously, the last input file found was processed instead. When
+        streaming, the files are processed as soon as they are found, before
+        it's known whether a later file has the same output file, so the
+        first file is kept in both modes.
+
+    Defaults to `u''`.
+    '''
+
+    def __init__(self, **kwargs):
+        super(FileToolsEngine, self).__init__(**kwargs)
+        self.queue = CoalescingKivyQueue(
+            self.notify_queue, coalesce_keys=('file_stat', ),
+            batch_keys=('cmd', ))
+
+    def notify_queue(self):
+        ''' Called, from the thread that added to :attr:`queue`, when the
+        queue goes from empty to non-empty. By default it does nothing, but
+        it can be overwritten to read the queue, as
+        :class:`~filers.file_tools.FileTools` does.
+        '''
+        pass
+
+    def save_report(self):
+        ''' Saves a report of what was processed up to now. See
+        :attr:`report`, :attr:`error_list`, and :attr:`success_list`.
+        The report includes the list of files to be processed, and once
+        processing started, also the list of files that succeeded and failed.
+
+        If :attr:`output` is a directory, the
+        file will be saved there, otherwise it's saved to the users main
+        directory. The report filename starts with ffmpeg_process_report and
+        ends with .txt.
+        '''
+        odir = self.output
+        if not isdir(odir):
+            odir = dirname(odir)
+        if (not odir) or not isdir(odir):
+            odir = expanduser('~')
+        odir = abspath(odir)
+        (fd, _) = tempfile.mkstemp(suffix='.txt',
+                                   prefix='ffmpeg_process_report_', dir=odir)
+        try:
+            f = os.fdopen(fd, 'wb')
+        except:
+            (fd, _) = tempfile.mkstemp(suffix='.txt',
+            prefix='ffmpeg_process_report_', dir=expanduser('~'))
+            try:
+                f = os.fdopen(fd, 'wb')
+            except:
+                return
+        f.write(self.report)
+        f.write('Success list:\n')
+        for s in self.success_list:
+            f.write(s)
+            f.write('\n')
+        f.write('Error list:\n')
+        for err in self.error_list:
+            f.write(err)
+            f.write('\n')
+        f.close()
+
+    def start(self):
+        ''' Starts the the processing.
+
+        This launches the second thread that does the disk I/O and starts
+        processing the files according to the settings. If it is already
+        running, it does nothing.
+
+        :return:
+
+            True, if it successfully started, False otherwise.
+        '''
+        if self.running and self.thread and self.thread.is_alive():
+            return True
+        self.stop()
+        self.running = True
+        try:
+            self.thread = Thread(target=self.process_thread,
+                                 name='File_tools')
+            self.thread.start()
+        except:
+            logging.error('File tools: Thread failed:\n' +
+                          traceback.format_exc())
+            self.stop()
+            return False
+        return True
+
+    def set_pause(self, pause):
+        ''' Sets whether the thread is paused or running.
+
+        :Parameters:
+
+            `pause`: bool
+                If True, the state will be set to pause, otherwise, to continue
+                running. This only has an effect once processing started.
+        '''
+        self.pause = pause
+
+    def stop(self):
+        ''' Asks the processing thread started with :meth:`start` to end.
+        This will cause processing to stop.
+        '''
+        self.finish = True
+        while self.running and self.thread and self.thread.is_alive():
+            time.sleep(0.05)
+        self.running = False
+        self.thread = None
+        self.finish = False
+
+    def enumerate_files(self, on_file=None, progress_interval=None):
+        ''' Returns an iterator that walks all the input files and directories
+        to return the files to be processed according to the current
+        configuration.
+
+        It walks all the input files and directories, and for every input file
+        generates a corresponding output file using the specified pattern
+        matching.
+
+        :Parameters:
+
+            `on_file`: callable
+                If not None, it is called with a 2-tuple of the key and value
+                (see below) of every input file as soon as it is added to the
+                dictionary. It's used to start processing files before all the
+                files have been enumerated. Defaults to None.
+            `progress_interval`: float
+                The minimum time, in seconds, between the progress updates
+                yielded. If None, :attr:`progress_interval` is used. Defaults
+                to None.
+
+        :yields:
+
+            While walking the files, it periodically yields a progress
+            5-tuple of: the number of output files, the number of files
+            processed, the number of directories processed, the total size of
+            the files processed, and a dictionary of the number of files
+            ignored since the last progress update (see `count` in
+            :attr:`queue`).
+
+            On the final iteration, it yields a 5-tuple of:
+            a :class:`~filers.table.FileTable` of the input and
+            output files, whose items are 2-tuples of a 2-tuple of the output
+            file and its filename, and a 3-tuple of the full input filepath,
+            filename, and file size. The number of files processed, the number
+            of directories processed, the total size of the files processed,
+            and a dictionary of all the ignored files (see `count_done` in
+            :attr:`queue`). The table is sorted by the input files and only
+            the first input file of each output file is kept (see
+            :meth:`~filers.table.FileTable.sort`).
+
+        :raises FilerException:
+
+            When the the config is inavlid an exception is raised.
+        '''
+        files_out = FileTable()
+        odir = self.output
+        simple = self.simple_filt
+        ext_new = self.ext
+        if simple:
+            if not isdir(odir):
+                raise FilerException('{} is not an output directory.'.
+                                     format(odir))
+            odir = abspath(odir)
+        try:
+            filt_in = compile_filter(self.input_filter, simple).match
+            dir_filt = DirFilter(include=split_patterns(self.dir_include),
+                                 exclude=split_patterns(self.dir_exclude))
+        except:
+            raise FilerException('invalid filtering pattern')
+
+        ignored = defaultdict(int)
+        ignored_delta = defaultdict(int)
+        src_list = [f.strip(''', '"''') for f in
+                    self.input_split_pat.split(self.input)]
+        src_list = [abspath(f) for f in src_list if f]
+        if progress_interval is None:
+            progress_interval = self.progress_interval
+
+        def ignore(key):
+            ignored[key] += 1
+            ignored_delta[key] += 1
+
+        def progress():
+            delta = dict(ignored_delta)
+            ignored_delta.clear()
+            return len(files_out), count, dir_count, size, delta
+
+        count = 0
+        dir_count = 0
+        size = 0
+        last_progress = clock()
+        src_dirs = [f for f in src_list if isdir(f)]
+        walks = walk_many(src_dirs, num_threads=self.walk_threads)
+        src_dirs = set(src_dirs)
+        for f in src_list:
+            m = filt_in(f)
+            if isfile(f) and m:
+                sz = getsize(f)
+                name, ext = splitext(split(f)[1])
+                if simple:
+                    if ext_new:
+                        oname = name + ext_new
+                    else:
+                        oname = name + ext
+                    oname = join(odir, oname)
+                else:
+                    oname = odir.format(*m.groups())
+                index = files_out.add(f, oname, sz)
+                if on_file is not None:
+                    on_file(files_out.item(index))
+                count += 1
+                size += sz
+            elif f in src_dirs:
+                dir_count -= 1
+                _, entries = next(walks)
+                for root, dirs, files in entries:
+                    dir_count += 1
+                    root = abspath(root)
+                    sdir = root.replace(f, '').strip(sep)
+                    if dir_filt and dirs:
+                        dirs[:], pruned = dir_filt.filter_dirs(
+                            sdir.split(sep) if sdir else [], dirs)
+                        for name in pruned:
+                            ignore(name + sep)
+                    if not files:
+                        continue
+                    for filename, sz, _ in files:
+                        filepath = join(root, filename)
+                        m = filt_in(filepath)
+                        if sz is not None and m:
+                            name, ext = splitext(filename)
+                            if simple:
+                                if ext_new:
+                                    oname = name + ext_new
+                                else:
+                                    oname = name + ext
+                                oname = join(odir, sdir, oname)
+                            else:
+                                oname = odir.format(*m.groups())
+                            index = files_out.add(filepath, oname, sz)
+                            if on_file is not None:
+                                on_file(files_out.item(index))
+                            count += 1
+                            size += sz
+                        else:
+                            fname, ext = splitext(filename)
+                            ignore(ext if ext else fname)
+                        if clock() - last_progress >= progress_interval:
+                            last_progress = clock()
+                            yield progress()
+            else:
+                fname, ext = splitext(f)
+                ignore(ext if ext else fname)
+            if clock() - last_progress >= progress_interval:
+                last_progress = clock()
+                yield progress()
+        files_out.sort()
+        yield files_out, count, dir_count, size, dict(ignored)
+
+    def process_thread(self):
+        ''' The thread that processes the input / output files. It communicates
+        with the outside world using :attr:`queue`.
+
+        The files are processed by :attr:`num_workers` worker threads, while
+        this thread collects their results and computes the overall
+        statistics.
+
+        Upon exit, it sets :attr:`running` to False.
+        '''
+        queue = self.queue
+        put = queue.put
+        mode = self.mode
+        verify_mode = self.verify_type
+        trust_fsync = self.trust_fsync
+        is_hash = verify_mode in hash_backends
+        blocksize = max(4096, self.io_block_size)
+        mmap_threshold = self.mmap_threshold or None
+        part_file_size = self.part_file_size
+        checkpoint_size = max(blocksize, self.checkpoint_size)
+        force_rehash = self.force_rehash
+        mtime_tolerance = self.sync_mtime_tolerance
+        cache = None
+        on_error = self.on_error
+        preview = self.preview
+        num_workers = max(1, self.num_workers)
+        stream = self.stream_files and not preview
+        put('clean', None)
+        rm_flag = stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO
+
+        def verify(dst, dst_name, src, src_name):
+            ''' Verifies using the current mode whether the two files match.
+            E.g. `dst` is the full file path, while `dst_name` is just the
+            filename. When verifying with a hash, it returns the hash if the
+            files match, otherwise it returns a bool.
+            '''
+            if verify_mode == 'filename':
+                return dst_name == src_name
+            elif verify_mode == 'size':
+                return getsize(dst) == getsize(src)
+            elif is_hash:
+                src_hash = hashfile(
+                    src, verify_mode, blocksize=blocksize, cache=cache,
+                    force=force_rehash, mmap_threshold=mmap_threshold)
+                if src_hash == hashfile(
+                        dst, verify_mode, blocksize=blocksize, cache=cache,
+                        force=force_rehash, mmap_threshold=mmap_threshold):
+                    return src_hash
+                return False
+            else:
+                return False
+
+        def is_synced(dst, dst_name, src, src_name):
+            ''' In `sync` mode, returns whether the existing `dst` file
+            matches `src` so it doesn't need to be copied. If they match by
+            their hash, it returns the hash.
+            '''
+            if verify_mode == 'filename':
+                return True
+            src_stat = os.stat(src)
+            dst_stat = os.stat(dst)
+            if src_stat.st_size != dst_stat.st_size:
+                return False
+            if abs(src_stat.st_mtime - dst_stat.st_mtime) <= mtime_tolerance:
+                return True
+            return is_hash and verify(dst, dst_name, src, src_name)
+
+        def process_file(dst, dst_name, src, src_name):
+            ''' Processes a single file according to the current mode. It
+            raises an exception if the file failed. It returns a 2-tuple of
+            the hash of the file when verifying with a hash, otherwise None,
+            and whether the file was processed, which is False for unchanged
+            files in `sync` mode.
+            '''
+            if src == dst:
+                raise FilerException('{}: source and target are identical.'
+                                     .format(dst))
+            dst_dir = dirname(dst)
+            if mode in ('copy', 'move', 'sync'):
+                if exists(dst):
+                    if mode != 'sync':
+                        raise FilerException('{}: already exists.'
+                                             .format(dst))
+                    synced = is_synced(dst, dst_name, src, src_name)
+                    if synced:
+                        return (synced if is_hash and synced is not True
+                                else None), False
+                if not exists(dst_dir):
+                    try:
+                        makedirs(dst_dir)
+                    except:
+                        pass
+                if part_file_size and getsize(src) >= part_file_size:
+                    def verify_part(part, src_hash):
+                        if not is_hash:
+                            return verify(part, dst_name, src, src_name)
+                        if trust_fsync:
+                            return getsize(part) == getsize(src)
+                        return src_hash == hashfile(
+                            part, verify_mode, blocksize=blocksize,
+                            mmap_threshold=mmap_threshold)
+
+                    if cache is not None and mode != 'move':
+                        signature = cache.stat_signature(src)
+                    src_hash = copyfile_resumable(
+                        src, dst, verify_mode if is_hash else None,
+                        verify=verify_part, blocksize=blocksize,
+                        checkpoint_size=checkpoint_size, fsync=trust_fsync,
+                        should_stop=lambda: self.finish)
+                    if is_hash and cache is not None and mode != 'move':
+                        cache.set(src, verify_mode, src_hash, signature)
+                    verified = src_hash if is_hash else True
+                elif is_hash:
+                    src_hash = copyfile_hash(
+                        src, dst, verify_mode, blocksize=blocksize,
+                        fsync=trust_fsync,
+                        cache=cache if mode != 'move' else None)
+                    if trust_fsync:
+                        verified = getsize(dst) == getsize(src)
+                    else:
+                        verified = src_hash == hashfile(
+                            dst, verify_mode, blocksize=blocksize,
+                            cache=cache, force=True,
+                            mmap_threshold=mmap_threshold)
+                    verified = verified and src_hash
+                else:
+                    copyfile(src, dst, blocksize=blocksize)
+                    verified = verify(dst, dst_name, src, src_name)
+                if not verified:
+                    raise FilerException('{}, {}: verification failed.'.
+                                         format(src, dst))
+                if mode == 'move':
+                    try:
+                        remove(src)
+                    except IOError:
+                        chmod(src, rm_flag)
+                        remove(src)
+            elif mode in ('delete originals', 'verify'):
+                verified = verify(dst, dst_name, src, src_name)
+                if not verified:
+                    raise FilerException('{}, {}: verification failed.'.
+                                         format(src, dst))
+                if mode == 'delete originals':
+                    try:
+                        remove(src)
+                    except IOError:
+                        chmod(src, rm_flag)
+                        remove(src)
+                    if cache is not None:
+                        cache.remove(src)
+            else:
+                return None, True
+            return (verified if is_hash else None), True
+
+        def worker(work, results):
+            ''' Processes files from the `work` queue until it gets a `None`
+            or until we're asked to finish, and puts the outcome of each file
+            in the `results` queue.
+            '''
+            while True:
+                while self.pause and not self.finish:
+                    sleep(.1)
+                if self.finish:
+                    return
+                try:
+                    item = work.get(timeout=.1)
+                except Empty:
+                    continue
+                if item is None:
+                    return
+                (dst, dst_name), (src, src_name, fsize) = item
+                put('cmd', (src, mode, dst))
+                try:
+                    digest, processed = process_file(
+                        dst, dst_name, src, src_name)
+                except Exception as e:
+                    results.put((src, dst, fsize, None, e, True))
+                else:
+                    results.put((src, dst, fsize, digest, None, processed))
+
+        def make_report(files, count, ignored):
+            ''' Returns the text report of the files to be processed and
+            ignored. See :attr:`report`.
+            '''
+            file_str = '\n'.join(['{} <-- {}'.format(k[0], v[0]) for k, v in
+                                  files])
+            ignored_str = '\n'.join(['{}:{:d}'.format(k, v) for k, v in
+                                     dict(ignored).items()])
+            report = 'Mode: {}\nVerify: {}\nFile list:\n{}\nIgnored list:\n'\
+                '{}\n'.format(mode, verify_mode, file_str, ignored_str)
+            # only the first input file of each output file is kept
+            if count > len(files):
+                report += 'Skipped {:d} input files whose output file is ' \
+                    'the same as an earlier input file.\n'.format(
+                        count - len(files))
+            return report
+
+        def count_files(on_file=None):
+            ''' Walks all the input files with :meth:`enumerate_files`,
+            sending its progress updates as `count` messages, and returns the
+            result of its final iteration.
+            '''
+            res = None
+            for item in self.enumerate_files(on_file=on_file):
+                if self.finish:
+                    raise FilerException('File tools terminated by user.')
+                # all but the final iteration are progress updates
+                if res is not None:
+                    put('count', res)
+                res = item
+            return res
+
+        self.error_list = []
+        self.success_list = []
+        if not stream:
+            try:
+                files, count, dir_count, size, ignored = count_files()
+            except FilerException as e:
+                put('failure', str(e))
+                self.running = False
+                return
+            self.report = make_report(files, count, ignored)
+            put('count_done', (len(files), count, dir_count, size, ignored))
+
+        if preview:
+            for (dst, dst_name), (src, src_name, fsize) in files:
+                put('cmd', (src, mode, dst))
+                if self.preview_pause:
+                    self.set_pause(True)
+                    put('pause', None)
+                if self.finish or self.pause:
+                    while self.pause and not self.finish:
+                        sleep(.1)
+                    if self.finish:
+                        put('failure', 'File tools terminated by user.')
+                        self.running = False
+                        return
+            put('done', None)
+            self.running = False
+            return
+
+        # the number and size of the files enumerated so far and whether the
+        # enumeration is done or failed. In stream mode it's updated as the
+        # files are discovered
+        enum_state = {'count': 0, 'size': 0, 'error': None, 'resumed': 0}
+
+        def put_work(item):
+            ''' Adds the item to the `work` queue, blocking while the queue
+            is full unless we're asked to finish.
+            '''
+            while not self.finish:
+                try:
+                    work.put(item, timeout=.1)
+                    return
+                except Full:
+                    pass
+
+        def count_item(item):
+            ''' Adds the file to the totals and returns True, unless the
+            journal lists it as already processed.
+            '''
+            if (item[1][0], item[0][0]) in completed:
+                enum_state['resumed'] += 1
+                return False
+            enum_state['count'] += 1
+            enum_state['size'] += item[1][2]
+            return True
+
+        # the output files of the files passed on to the workers in stream
+        # mode, so that like the sorted table, only the first input file of
+        # each output file is processed
+        dispatched = set()
+
+        def feed(item):
+            ''' Passes on a newly discovered file to the workers, unless an
+            earlier file has the same output file.
+            '''
+            dst = item[0][0]
+            if dst in dispatched:
+                return
+            dispatched.add(dst)
+            if count_item(item):
+                put_work(item)
+
+        def feeder():
+            ''' Passes on the enumerated files, which were already counted,
+            to the workers as they become free.
+            '''
+            try:
+                for item in files:
+                    if self.finish:
+                        return
+                    if (item[1][0], item[0][0]) not in completed:
+                        put_work(item)
+            finally:
+                for _ in range(num_workers):
+                    put_work(None)
+
+        def producer():
+            ''' Enumerates the input files into the `work` queue. '''
+            try:
+                files, count, dir_count, size, ignored = count_files(feed)
+                dispatched.clear()
+                self.report = make_report(files, count, ignored)
+                put('count_done', (len(files), count, dir_count, size,
+                                   ignored))
+            except Exception as e:
+                enum_state['error'] = str(e)
+            finally:
+                for _ in range(num_workers):
+                    put_work(None)
+
+        error_list = self.error_list
+        success_list = self.success_list
+        size_done = 0
+        size_failed = 0
+        size_unchanged = 0
+        count_done = 0
+        count_unchanged = 0
+        bps = 0.
+        time_total = 0.
+        t_left = 0
+
+        data_path = self.data_path or user_data_path
+        warnings = []
+
+        def warn(msg):
+            ''' Reports a problem that doesn't stop the job. '''
+            logging.warning('File tools: {}'.format(msg))
+            put('warning', msg)
+            warnings.append(msg)
+
+        if self.use_hash_cache and is_hash:
+            try:
+                cache = _BestEffortCache(
+                    HashCache(join(data_path, 'hash_cache.sqlite'),
+                              max_entries=self.hash_cache_size),
+                    lambda e: warn('Cannot use the hash cache: {}'.format(e)))
+            except Exception as e:
+                warn('Cannot open the hash cache: {}'.format(e))
+
+        journal = None
+        completed = {}
+        try:
+            journal = FileJournal(job_journal_filename(
+                mode, verify_mode, self.input, self.input_filter,
+                self.simple_filt, self.output, self.ext, data_path=data_path),
+                resume=self.resume)
+            completed = journal.completed
+        except Exception as e:
+            warn('Cannot open the journal, the job cannot be resumed: {}'.
+                 format(e))
+
+        work = Queue(self.stream_queue_size)
+        results = Queue()
+        threads = [Thread(target=worker, args=(work, results),
+                          name='File_tools_worker{}'.format(i))
+                   for i in range(num_workers)]
+        if stream:
+            threads.append(Thread(target=producer, name='File_tools_enum'))
+        else:
+            for item in files:
+                count_item(item)
+            threads.append(Thread(target=feeder, name='File_tools_feed'))
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        # time spent paused is not included in the elapsed time
+        ts = clock()
+        paused_ts = None
+        paused_total = 0.
+        while True:
+            if self.pause and paused_ts is None:
+                paused_ts = clock()
+            elif not self.pause and paused_ts is not None:
+                paused_total += clock() - paused_ts
+                paused_ts = None
+            if self.finish:
+                for t in threads:
+                    t.join()
+                if cache is not None:
+                    cache.close()
+                if journal is not None:
+                    journal.close()
+                put('failure', 'File tools terminated by user.')
+                self.running = False
+                return
+
+            try:
+                src, dst, fsize, digest, e, processed = results.get(
+                    timeout=.1)
+            except Empty:
+                if not any(t.is_alive() for t in threads) and results.empty():
+                    break
+                continue
+
+            if digest is not None:
+                digest = hexlify(digest).decode('ascii')
+            if journal is not None:
+                try:
+                    journal.add(src, dst, fsize, mode, verify_mode, e is None,
+                                digest=digest,
+                                error=None if e is None else str(e))
+                except Exception as exc:
+                    warn('Cannot write the journal, the job cannot be '
+                         'resumed: {}'.format(exc))
+                    try:
+                        journal.close()
+                    except Exception:
+                        pass
+                    journal = None
+
+            if e is None and not processed:
+                size_unchanged += fsize
+                count_unchanged += 1
+            size_total = enum_state['size'] - size_failed - size_unchanged
+            count_total = enum_state['count']
+            if e is None:
+                if processed:
+                    size_done += fsize
+                count_done += 1
+                time_total = max(clock() - ts - paused_total, 0.0000001)
+                bps = size_done / time_total
+                t_left = (size_total - size_done) / bps if bps else 0
+                put('file_stat', (size_done, size_total, count_done,
+                                  count_total, mode, bps, time_total, t_left,
+                                  count_unchanged))
+                if not processed:
+                    success_list.append('{}: {} --> {} (unchanged)'.format(
+                        mode, src, dst))
+                elif digest is None:
+                    success_list.append('{}: {} --> {}'.format(mode, src, dst))
+                else:
+                    success_list.append('{}: {} --> {} ({}: {})'.format(
+                        mode, src, dst, verify_mode, digest))
+            else:
+                size_failed += fsize
+                msg = '{}: {} --> {}\nFailed: {}'.format(mode, src, dst,
+                                                         str(e))
+                error_list.append(msg)
+                put('skipped', msg)
+                if on_error == 'pause':
+                    put('pause', None)
+                    self.set_pause(True)
+
+        if cache is not None:
+            cache.close()
+        if journal is not None:
+            try:
+                journal.close(
+                    delete=not error_list and enum_state['error'] is None)
+            except Exception as e:
+                logging.warning(
+                    'File tools: Cannot close the journal: {}'.format(e))
+        for msg in warnings:
+            self.report += '{}\n'.format(msg)
+        if count_unchanged:
+            self.report += 'Unchanged: skipped {:d} files that already match.'\
+                '\n'.format(count_unchanged)
+        if enum_state['resumed']:
+            self.report += 'Resumed: skipped {:d} files already processed.\n'\
+                .format(enum_state['resumed'])
+        if enum_state['error'] is not None:
+            put('failure', enum_state['error'])
+        else:
+            put('done', None)
+
+        self.running = False
+
+
+class _SegmentedJob(object):
+    ''' An output file of :class:`ProcessorEngine` that is encoded in
+    segments. See :meth:`ProcessorEngine.gen_segments`.
+    '''
+
+    __slots__ = ('cmd', 'fsize', 'fcount', 'dst', 'segments', 'remaining',
+                 'error', 'lock')
+
+    def __init__(self, cmd, fsize, fcount, dst, segments):
+        self.cmd = cmd
+        self.fsize = fsize
+        self.fcount = fcount
+        self.dst = dst
+        self.segments = segments
+        self.remaining = len(segments)
+        self.error = None
+        self.lock = Lock()
+
+
+class ProcessorEngine(object):
+    '''
+    The engine of the video processor, which manipulates files en-masse using
+    FFmpeg. It can compress/uncompress/merge/concatenate or perform other
+    tasks on video files.
+
+    The settings, e.g. :attr:`input`, are plain attributes that should be set
+    before calling :meth:`start`.
+    '''
+
+    settings = ('input', 'simple_filt', 'input_filter', 'group_filt',
+                'input_start', 'input_end', 'merge_type', 'overlay_rows',
+                'out_overwrite',
+                'out_audio', 'out_codec', 'crf', 'compress_speed',
+                'num_threads', 'num_jobs', 'segment_length', 'out_append',
+                'add_command', 'output', 'pre_process', 'pre_process_pat',
+                'use_pre_process_cache', 'use_output_manifest', 'data_path',
+                'pause_on_skip')
+    ''' The names of the settings of the engine, which are stored in the
+    config by the GUI.
+    '''
+
+    queue = None
+    ''' The :class:`~filers.tools.KivyQueue` with which we communicate with the
+    outside world, e.g. the kivy event loop. The work thread sends updates
+    with this queue, and :meth:`notify_queue` is called when an update is
+    added. Following is the list of queue keys that can be sent, along with
+    their possible values.
+
+        `clean`: None
+            Sent when the threads starts.
+        `count`: int
+            Sent periodically while pre-reading the input files describing
+            the files read so far. It's a 5-tuple of: # output files,
+            # input files, # of walked directories, total size of the input
+            files, and a dictionary where the keys are ignored files, or
+            extensions types (e.g. .txt) and their values are the number of
+            times they were ignored.
+        `count_done`: int
+            Identical to `count`, except it's sent when the count is done.
+        `failure`: str
+            Sent when something went wrong and the threads ends. The
+            value is a string with the reason for the failure. Upon failure,
+            the controller should call stop and set itself in stopped mode.
+        `file_cmd`: str
+            Sent for every file before it is processed. It's a string
+            containing the full command with which FFmpeg will be called.
+        `file_progress`: 6-tuple
+            Sent periodically, about twice a second, while a file is
+            processed. It's a 6-tuple of: the output filename, the time in
+            seconds of the output video encoded so far, the estimated
+            fraction of the file done (between 0 and 1), the number of frames
+            encoded per second, the encoding speed as a multiple of real time,
+            and the estimated time left for this file. The values that cannot
+            be estimated (e.g. when the duration of the input is unknown) are
+            None.
+        `file_stat`: 11-tuple
+            Sent after each file that has been processed (e.g. moved)
+            containing status information. It's a 11-tuple of: the total size
+            of output files processed, the estimated total size of all the
+            output files, the total size of input files processed, the total
+            size of all the input files (can change dynamically as files are
+            skipped), the total number of input files processed, the count of
+            all the input files, the total number of output files processed,
+            the count of all the output files, the estimated bps at which
+            things are done, the total time elapsed, the estimated time left.
+        `skipped`: str
+            Sent when the file is skipped due to error. The
+            string describes the files involved and the reason.
+        `warning`: str
+            Sent when the output manifest or the pre-process cache cannot be
+            used, e.g. when they cannot be written. The files are still
+            processed, without them. The string describes the problem.
+        `done`: None
+            Sent when the thread has completed it's work.
+    '''
+
+    thread = None
+    ''' The thread that runs our secondary thread. All disk R/W and processing
+    is done from that thread. See :attr:`process_thread`. Defaults to None.
+    '''
+
+    ffmpeg_path = ''
+    ''' The full path to the FFmpeg executable. It defaults to the path
+    returned by :func:`~filers.ffmpeg.find_ffmpeg`. If empty, processing fails.
+    '''
+
+    running = False
+    ''' Whether the thread is running. It is set to True before launching the
+    thread, and the thread resets it to False before exiting. Defaults to
+    False. See :attr:`process_thread`.
+    '''
+    finish = False
+    ''' When set to True, it signals the thread to terminate. Defaults to
+    False.
+    '''
+    pause = False
+    ''' When set to True, it signals the thread to pause. Setting to False will
+    un-pause. Defaults to False.
+    '''
+    report = ''
+    ''' A text report of the files to be processed and ignored. This is
+    generated before any processing occurs. Defaults to `''`.
+    '''
+    error_list = []
+    ''' A list of text items, each item representing a file that failed to be
+    processed. It is updated dynamically. Defaults to `[]`.
+    '''
+    success_list = []
+    ''' A list of text items, each item representing a file that was
+    successfully processed. It is updated dynamically. Defaults to `[]`.
+    '''
+
+    input_split_pat = re.compile('''((?:[^,"']|"[^"]*"|'[^']*')+)''')
+    ''' The compiled pattern we use to break apart the list of input files to
+    process. Defaults to the compiled value of `', *'`.
+    '''
+
+    input = u''
+    ''' The list of input files and folders to be processed. It is
+    a comma (plus optional spaces) separated list. File or directory names
+    that contain a space, should be quoted with `"`. In the GUI, triple
+    clicking on this field will launch a file browser.
+    Defaults to `u''`.
+    '''
+    simple_filt = True
+    ''' Whether the filter we use to filter the input files with
+    uses the simple common format (where * - match anything, ? match any single
+    char), if True. If False, it's a python regex string. Defaults to True.
+    See :mod:`filers.filters`.
+    '''
+    input_filter = u'*.avi'
+    ''' The filter to use to filter the input files. See
+    :attr:`simple_filt`. Defaults to `'*.avi'`.
+    '''
+    group_filt = u''
+    ''' The matching string parts to remove to get the output
+    filename. If :attr:`simple_filt` is True, it uses `*` to match any group
+    of chars, and `?` to match a single char. If :attr:`simple_filt` is
+    False, it uses a python regex for the matching. This really only
+    makes sense with a regex. This is mostly useful when merging
+    files.
+
+    For example, say we have two files called `Video file1.avi`,
+    and `Video file2.avi`, and we wish to merge them into a new file
+    called `Video file.avi`. Then :attr:`group_filt` will be
+    `'(?<=file).+(?=\\.avi)'`. This uses positive and negative lookahead
+    assertions to match the number, which then gets removed in
+    processing. Defaults to `''`.
+
+    If multiple input files match the same output filename, those files
+    will be merged using the :attr:`merge_type` mode.
+    '''
+    input_start = 0.
+    ''' The time in seconds to seek into the video. If specified,
+    the output video file will not have the first :attr:`input_start` seconds
+    of the original file. Defaults to `0`.
+    '''
+    input_end = 0.
+    ''' The duration of the output video file. If specified,
+    the output video file will start at :attr:`input_start` (or zero if not
+    specified) seconds and only copy the following :attr:`input_end` seconds.
+    If zero, it'll not cut anything. Defaults to `0`.
+    '''
+    merge_type = u'none'
+    ''' If multiple input files match the same output filename as
+    specified with :attr:`group_filt`, those files will be merged using the
+    mode specified here. Possible modes are `none`, `overlay`, or
+    `concatenate`. Defaults to `none`.
+
+        `none`
+            If multiple input files are specified for a single output
+            file, an error is raised.
+        `overlay`
+            The output video files will be overlaid, side by side, on
+            a single output video file, arranged in a grid. See
+            :attr:`overlay_rows`.
+        `concatenate`
+            The files will be concatenated, one after another in series.
+    '''
+    overlay_rows = 0
+    ''' When :attr:`merge_type` is `overlay`, the number of rows of the grid
+    in which the input videos are arranged, in sorted order, row by row.
+    The number of columns is then the smallest that fits all of them. If
+    `0`, the grid is as square as possible, e.g. 2 videos are side by side,
+    and 3 or 4 videos are in a 2x2 grid. Defaults to `0`.
+
+    All the videos are merged in a single pass with the FFmpeg `xstack`
+    filter, so any number of videos can be merged, each is only decoded
+    once, and the output is only encoded once. The videos should all have
+    the same size. See :meth:`gen_overlay_filter`.
+    '''
+    out_overwrite = False
+    ''' Whether a output file will overwrite an already
+    existing filename with that name. If False, the file will be
+    considered a error and skipped. Defaults to False.
+    '''
+    out_audio = False
+    ''' Whether the audio should be included in the output file. If False, the
+    output file will only have video, not audio, Defaults to False.
+    '''
+    out_codec = u'h264'
+    ''' The codec of the output file. This determines whether the output will
+    be compressed or uncompressed. Can be one of `raw`, `h264`. Defaults to
+    `h264`.
+
+        `raw`
+            The output file will be uncompressed.
+        `h264`
+            The output file will be compressed with h264.
+    '''
+    crf = u'18'
+    ''' How much the output file should be compressed, when :attr:`out_codec`
+    is `h264`. The valid numbers are between `18 - 28`. A larger
+    number means higher compression, and typically slower. A lower
+    number means less compression and better quality, but a larger
+    output file. Defaults to 18.
+    '''
+    compress_speed = u'veryfast'
+    ''' Similar to :attr:`crf`, but less effective. The faster
+    the compression, the lower the output quality. In practice,
+    `veryfast` seems to work well. Can be one of `ultrafast`,
+    `superfast`, `veryfast`, `faster`, `fast`, `medium`, `slow`,
+    `slower`, `veryslow`. Defaults to `veryfast`.
+    '''
+    num_threads = u'auto'
+    ''' The number of threads FFmpeg should use. Valid values are
+    `0`, or `auto`, in which case FFmpeg selects the optimum number. Or
+    any integer. The integer should probably not be larger than the
+    number of cores on the machine.
+
+    When :attr:`num_jobs` is more than one, this is the total number of
+    threads, which is split evenly between the FFmpeg processes running at
+    once. With `0` or `auto`, the total is the number of cores. See
+    :meth:`get_job_threads`.
+    '''
+    num_jobs = 1
+    ''' The number of FFmpeg processes that are run at once, each from its own
+    thread. When encoding many short files, a single FFmpeg process often
+    cannot use all the cores, so running a few at once can be much faster.
+    The files are still started in sorted order, but they may complete out
+    of order. Values less than 1 are treated as 1. Defaults to `1`.
+    '''
+    segment_length = 0.
+    ''' When positive, videos longer than this many seconds are split into
+    segments of about this length, which are encoded in parallel by the
+    :attr:`num_jobs` processes and then losslessly concatenated into the
+    output file. This speeds up encoding a few long videos, since a single
+    x264 process doesn't scale well past a few threads. Defaults to `0`.
+
+    The segments are cut at whole frames, so no frames are dropped or
+    repeated, and each segment starts with a keyframe. They are all encoded
+    with the same settings, e.g. :attr:`crf`, so the quality matches encoding
+    the video in one pass. It's only used for single input files encoded
+    with `h264`, without audio or :attr:`pre_process`. See
+    :meth:`gen_segments`.
+    '''
+    out_append = u''
+    ''' A string that gets appended to the output filename. See
+    :attr:`output`. Defaults to `''`.
+    '''
+    add_command = u''
+    ''' An additional string that could be used to add any
+    commands to the FFmpeg command line. Defaults to `''`.
+    '''
+    output = u''
+    ''' The output directory where the output files are saved. For
+    input files specified directly, they are placed directly in this
+    directory. For input directories, for all the files and subfiles,
+    their root directory specified is replaced with this directory, so
+    that the output will have the same tree structure as the input.
+
+    Each output filename will be a directory, followed by the input
+    filename without the extension, with all matches to :attr:`group_filt`
+    deleted. Followed by the :attr:`out_append` string and finally followed
+    by the extension, which is `.avi` if :attr:`out_codec` is `raw`,
+    otherwise it's '.mp4'. Defaults to `''`.
+    '''
+    pre_process = u''
+    '''
+    When specified, we run the command given in :attr:`pre_process`, where
+    the first instance of `{}` in :attr:`pre_process` is replaced by the
+    source filename (the first, if there's more than one source file for this
+    output file). This command is run from an internally created second
+    process. Example commands is::
+
+        ffprobe {}
+
+    which will run ffprobe on the input file. The output of this command will
+    be used with :attr:`pre_process_pat`.
+    '''
+    pre_process_pat = u''
+    '''
+    When :attr:`pre_process` is provided, we use this pattern to process the
+    output of that command. For the first step, we use the
+    :attr:`pre_process_pat` python regex to match the output of
+    :attr:`pre_process`. If the output doesn't match the pattern, that file is
+    skipped.
+
+    If the output matches, in the next step, we call the python format method
+    on the final ffmpeg command that will be executed, where the arguments to
+    the format method is the groups of the match object generated from the
+    regex match. That formatted string is then used as the executed string.
+
+    The command is run for all the files before FFmpeg is run for any of
+    them, running several at once. See also :attr:`use_pre_process_cache`.
+    '''
+    use_pre_process_cache = False
+    ''' Whether the output of :attr:`pre_process` is stored in and read from a
+    persistent :class:`~filers.cache.ProbeCache`. When True, the command is
+    not run again for files that have not changed (same path, size, and
+    modification time) since it was last run for them with the same
+    :attr:`pre_process` command, e.g. in a previous run. The number of files
+    found in the cache is added to the :attr:`report`. Defaults to `False`.
+    '''
+    use_output_manifest = True
+    ''' Whether the output files produced are recorded in a
+    :class:`~filers.journal.OutputManifest` of the :attr:`output` directory.
+
+    When True and :attr:`out_overwrite` is False, output files that were
+    already produced, with the same FFmpeg command (i.e. the same settings)
+    from the same unchanged input files, are skipped without running
+    anything. If the settings or the input files changed, the stale output
+    file that we produced is replaced. Other existing output files are still
+    an error. The number of files skipped is added to the :attr:`report`.
+    Defaults to `True`.
+    '''
+    data_path = u''
+    ''' The directory where the output manifests and the pre-process cache
+    are stored. If empty, :attr:`~filers.user_data_path` is used. If they
+    cannot be used, e.g. when the directory is read-only, a `warning` message
+    is sent to :attr:`queue` and the files are processed without them.
+    Defaults to `''`.
+    '''
+    pause_on_skip = 5
+    '''
+    If :attr:`pause_on_skip` files have been skipped, we'll pause. If -1, we
+    don't pause.
+    '''
+
+    stderr_lines = 100
+    ''' The number of the last lines that FFmpeg writes to stderr that are
+    kept for each file, and included in the :attr:`error_list` or
+    :attr:`success_list`. Defaults to `100`.
+    '''
+
+    def __init__(self, **kwargs):
+        super(ProcessorEngine, self).__init__(**kwargs)
+        self.queue = KivyQueue(self.notify_queue)
+        self.ffmpeg_path = find_ffmpeg()
+
+    def notify_queue(self):
+        ''' Called, from the thread that added to :attr:`queue`, after an
+        update is added to the queue. By default it does nothing, but it can
+        be overwritten to read the queue.
+        '''
+        pass
+
+    def save_report(self):
+        ''' Saves a report of what was processed up to now. See
+        :attr:`report`, :attr:`error_list`.
+        The report includes the list of files to be processed, and once
+        processing started, also the list of files that failed.
+
+        If :attr:`output` is a directory, the
+        file will be saved there, otherwise it's saved to the users main
+        directory. The report filename starts with ffmpeg_process_report and
+        ends with .txt.
+        '''
+        odir = self.output
+        if not isdir(odir):
+            odir = dirname(odir)
+        if (not odir) or not isdir(odir):
+            odir = expanduser('~')
+        odir = abspath(odir)
+        (fd, _) = tempfile.mkstemp(suffix='.txt',
+                                   prefix='ffmpeg_process_report_', dir=odir)
+        try:
+            f = os.fdopen(fd, 'w')
+        except:
+            (fd, _) = tempfile.mkstemp(suffix='.txt',
+            prefix='ffmpeg_process_report_', dir=expanduser('~'))
+            try:
+                f = os.fdopen(fd, 'w')
+            except:
+                return
+        f.write(self.report)
+        f.write('Success list:\n')
+        for s in self.success_list:
+            f.write(s)
+            f.write('\n')
+        f.write('Error list:\n')
+        for err in self.error_list:
+            f.write(err)
+            f.write('\n')
+        f.close()
+
+    def start(self):
+        ''' Starts the the processing.
+
+        This launches the second thread that does the disk I/O and starts
+        processing the files according to the settings. If it is already
+        running, it does nothing.
+
+        :return:
+
+            True, if it successfully started, False otherwise.
+        '''
+        if self.running and self.thread and self.thread.is_alive():
+            return True
+        self.stop()
+        self.running = True
+        try:
+            self.thread = Thread(target=self.process_thread, name='Processor')
+            self.thread.start()
+        except:
+            logging.error('Processor: Thread failed:\n' +
+                          traceback.format_exc())
+            self.stop()
+            return False
+        return True
+
+    def set_pause(self, pause):
+        ''' Sets whether the thread is paused or running.
+
+        :Parameters:
+
+            `pause`: bool
+                If True, the state will be set to pause, otherwise, to continue
+                running. This only has an effect once processing started.
+        '''
+        self.pause = pause
+
+    def toggle_pause(self):
+        ''' Changes whether the thread is paused or running to the opposite
+        of its current state.
+        '''
+        self.pause = not self.pause
+        return self.pause
+
+    def stop(self):
+        ''' Asks the processing thread started with :meth:`start` to end.
+        This will cause processing to stop. The FFmpeg processes that are
+        running are terminated and their partial output files are removed.
+        '''
+        self.finish = True
+        while self.running and self.thread and self.thread.is_alive():
+            time.sleep(0.05)
+        self.running = False
+        self.thread = None
+        self.finish = False
+
+    def enumerate_files(self):
+        ''' Returns an iterator that walks all the input files and directories
+        to return the files to be processed according to the current
+        configuration.
+
+        It walks all the input files and directories, and for every input file
+        generates a corresponding output file using the specified output.
+        Multiple input files can be assigned to a single output file, in which
+        case they are merged according to :attr:`merge_type`.
+
+        :returns:
+
+            A 5-tuple of: a dictionary where keys are output files and
+            values is a list of 2-tuples where each 2-tuple is a input file and
+            it size. The number of files processed, the number of directories
+            processed, the total size of the files processed, and a dictionary
+            of ignored files (see `count` in :attr:`queue`). On the final
+            iteration, it returns a sorted list of 2-tuples of the output files
+            dictionary items.
+
+        :raises FilerException:
+
+            When the the config is inavlid an exception is raised.
+        '''
+        files_out = defaultdict(list)
+        odir = self.output
+        if not isdir(odir):
+            raise FilerException('{} is not an output directory.'.
+                                 format(self.output))
+        odir = abspath(odir)
+        ext_out = '.mp4' if self.out_codec == 'h264' else '.avi'
+        filt_group = self.group_filt
+        if self.simple_filt:
+            filt_group = sub(escape('\\?'), '.', sub(escape('\\*'), '.*',
+                                                     escape(filt_group)))
+        try:
+            filt_in = compile_filter(self.input_filter, self.simple_filt).match
+            filt_group = re.compile(filt_group)
+        except:
+            raise FilerException('invalid filtering pattern')
+        apnd = self.out_append
+
+        ignored = defaultdict(int)
+        src_list = [f.strip(''', '"''') for f in
+                    self.input_split_pat.split(self.input)]
+        src_list = [abspath(f) for f in src_list if f]
+
+        count = 0
+        dir_count = 0
+        size = 0
+        for f in src_list:
+            if isfile(f) and filt_in(f):
+                sz = getsize(f)
+                files_out[join(odir, sub(filt_group, '',
+                splitext(split(f)[1])[0]) + apnd + ext_out)].append((f, sz))
+                count += 1
+                size += sz
+                yield files_out, count, dir_count, size, ignored
+            elif isdir(f):
+                dir_count -= 1
+                for root, _, files in walk(f):
+                    dir_count += 1
+                    if not files:
+                        continue
+                    root = abspath(root)
+                    sdir = root.replace(f, '').strip(sep)
+                    for filename, sz, _ in files:
+                        filepath = join(root, filename)
+                        if sz is not None and filt_in(filepath):
+                            files_out[join(odir, sdir, sub(filt_group, '',
+                            splitext(filename)[0]) + apnd + ext_out)].\
+                            append((filepath, sz))
+                            count += 1
+                            size += sz
+                        else:
+                            fname, ext = splitext(filename)
+                            ignored[ext if ext else fname] += 1
+                        yield files_out, count, dir_count, size, ignored
+            else:
+                fname, ext = splitext(f)
+                ignored[ext if ext else fname] += 1
+                yield files_out, count, dir_count, size, ignored
+        yield sorted(files_out.items(), key=lambda x: x[0]), count, dir_count,\
+            size, ignored
+
+    def get_job_threads(self):
+        '''
+        Returns the number of threads that each FFmpeg process should use,
+        given :attr:`num_threads` and :attr:`num_jobs`. With a single job,
+        it's :attr:`num_threads`, or `0` if it's `auto`, so FFmpeg selects
+        the number. Otherwise, the total number of threads is split between
+        the jobs, giving each at least one thread.
+
+        >>> engine = ProcessorEngine()
+        >>> engine.num_threads, engine.num_jobs = 'auto', 4
+        >>> engine.get_job_threads()  # on an 8 core machine
+        2
+        '''
+        num_threads = self.num_threads
+        if num_threads == 'auto':
+            num_threads = 0
+        num_jobs = max(1, self.num_jobs)
+        if num_jobs == 1:
+            return int(num_threads)
+        total = int(num_threads) or cpu_count()
+        return max(1, total // num_jobs)
+
+    def gen_cmd(self, files, input_start=None, input_end=None,
+                seek_input=False):
+        '''
+        Takes a list of input / output files and returns the full FFmpeg
+        command for each output file.
+
+        :Parameters:
+
+            `files`: list
+                The list of tuples of all the input / output files.
+                It is the list of files returned in the first element in the
+                tuple by :attr:`enumerate_files`.
+            `input_start`, `input_end`: float
+                If not None, they are used instead of :attr:`input_start` and
+                :attr:`input_end`. Defaults to None.
+            `seek_input`: bool
+                Whether the start and duration are input options, placed
+                before the input files, rather than output options. FFmpeg
+                then seeks in the input rather than decoding and dropping
+                everything before the start, which is still frame accurate
+                when transcoding. Defaults to False.
+
+        :return:
+
+            A list of tuples. Each 5-tuple is the full FFmpeg command line
+            (string), the total size of the input files for that output
+            file, the number of input files, the first input file for this
+            output file, and the output file name.
+        '''
+        merge_type = self.merge_type
+
+        audio = self.out_audio
+        s = self.input_start if input_start is None else input_start
+        e = self.input_end if input_end is None else input_end
+        seeking = ''
+        if s:
+            seeking = ' -ss {:.3f}'.format(s)
+        if e:
+            seeking = '{} -t {:.3f}'.format(seeking, e)
+        opts = ' {}'.format(self.add_command) if self.add_command else ''
+        if self.out_codec == 'h264':
+            opts += ' -vcodec libx264 -preset {} -crf {}'.\
+            format(self.compress_speed, self.crf)
+        elif self.out_codec == 'raw':
+            opts += ' -vcodec rawvideo'
+        if not audio:
+            opts += ' -an'
+        opts += ' -y' if self.out_overwrite else ' -n'
+        opts += ' -progress pipe:1 -nostats'
+        opts = '{} -threads {}'.format(opts, self.get_job_threads())
+
+        res = []
+        for dst, src_list in files:
+            src = sorted([f[0] for f in src_list])
+            inames = ' -i "{}"'.format('" -i "'.join(src))
+
+            merge_cmd = ''
+            if merge_type == 'overlay' and len(src) > 1:
+                merge_cmd = ' -filter_complex "{}" -shortest'.format(
+                    self.gen_overlay_filter(len(src)))
+            elif merge_type == 'concatenate' and len(src) > 1:
+                if audio:
+                    base_str = ('[{}:0] [{}:1] ' * len(src)).format(
+                    *[int(i / 2) for i in range(2 * len(src))])
+                    merge_cmd = ' -filter_complex \'{} concat=n={:d}:v=1:a=1 '\
+                    '[v] [a]\' -map \'[v]\' -map \'[a]\''.\
+                    format(base_str, len(src))
+                else:
+                    base_str = ('[{}:0] ' * len(src)).format(*range(len(src)))
+                    merge_cmd = ' -filter_complex \'{} concat=n={:d}:v=1 '\
+                    '[v]\' -map \'[v]\''.format(base_str, len(src))
+            if seek_input:
+                cmd = '"{}"{}{}{}{} "{}"'.format(
+                    self.ffmpeg_path, seeking, inames, merge_cmd, opts, dst)
+            else:
+                cmd = '"{}"{}{}{}{} "{}"'.format(
+                    self.ffmpeg_path, inames, seeking, merge_cmd, opts, dst)
+            res.append((cmd, sum([f[1] for f in src_list]), len(src), src[0],
+                        dst))
+        return res
+
+    def gen_overlay_filter(self, n):
+        '''
+        Returns the FFmpeg `xstack` filter graph that arranges the first video
+        stream of `n` inputs in a grid of :attr:`overlay_rows` rows.
+
+        >>> engine.overlay_rows = 2
+        >>> engine.gen_overlay_filter(3)
+        '[0:0][1:0][2:0]xstack=inputs=3:layout=0_0|w0_0|0_h0:fill=black'
+        '''
+        rows = min(self.overlay_rows, n)
+        if rows <= 0:
+            cols = int(math.ceil(math.sqrt(n)))
+        else:
+            cols = int(math.ceil(n / float(rows)))
+
+        layout = []
+        for i in range(n):
+            row, col = divmod(i, cols)
+            x = '+'.join(['w0'] * col) or '0'
+            y = '+'.join(['h0'] * row) or '0'
+            layout.append('{}_{}'.format(x, y))
+        return '{}xstack=inputs={:d}:layout={}:fill=black'.format(
+            ''.join(['[{:d}:0]'.format(i) for i in range(n)]), n,
+            '|'.join(layout))
+
+    def gen_segments(self, src, dst, duration, fps=None):
+        '''
+        Splits encoding the single input file `src` into segments of about
+        :attr:`segment_length` seconds, which can be encoded in parallel and
+        then concatenated with :meth:`gen_concat_cmd`.
+
+        Each segment is encoded by the command returned by :meth:`gen_cmd`
+        with its own start time and duration, within :attr:`input_start` and
+        :attr:`input_end`, which FFmpeg seeks to in the input so it doesn't
+        decode the video before the segment. When the frame rate is known, the
+        segment length is rounded to whole frames, and the segments are cut
+        half a frame before a frame, so each frame is encoded in exactly one
+        segment.
+
+        :Parameters:
+
+            `src`: str
+                The input file.
+            `dst`: str
+                The output file.
+            `duration`: float
+                The duration of the input file, in seconds.
+            `fps`: float
+                The frame rate of the input file, or None if unknown.
+                Defaults to None.
+
+        :return:
+
+            A list of 3-tuples, one for each segment, of the FFmpeg command,
+            the output file of the segment, and its duration in seconds.
+        '''
+        start = self.input_start
+        end = duration
+        if self.input_end:
+            end = min(end, start + self.input_end)
+        length = self.segment_length
+        half = 0.
+        if fps:
+            length = max(1, int(round(length * fps))) / float(fps)
+            half = .5 / fps
+        n = max(1, int(math.ceil((end - start) / length - 1e-6)))
+        root, ext = splitext(dst)
+
+        segments = []
+        for i in range(n):
+            seg_start = start + i * length - half if i else start
+            if i == n - 1:
+                seg_end = end
+                # without input_end, the last segment runs to the end
+                seg_duration = end - seg_start if self.input_end else 0.
+            else:
+                seg_end = seg_duration = start + (i + 1) * length - half
+                seg_duration -= seg_start
+            filename = '{}.part{:03d}{}'.format(root, i, ext)
+            cmd = self.gen_cmd(
+                [(filename, [(src, 0)])], input_start=seg_start,
+                input_end=seg_duration, seek_input=True)[0][0]
+            segments.append((cmd, filename, seg_end - seg_start))
+        return segments
+
+    def gen_concat_cmd(self, list_filename, dst):
+        '''
+        Returns the FFmpeg command that losslessly concatenates the segments
+        listed in the FFmpeg concat file `list_filename` into `dst`. See
+        :meth:`gen_segments`.
+        '''
+        return '"{}" -f concat -safe 0 -i "{}" -map 0 -c copy{} -progress '\
+            'pipe:1 -nostats "{}"'.format(
+                self.ffmpeg_path, list_filename,
+                ' -y' if self.out_overwrite else ' -n', dst)
+
+    def process_thread(self):
+        ''' The thread that processes the input / output files. It communicates
+        with the outside world using :attr:`queue`.
+
+        The FFmpeg processes are run by :attr:`num_jobs` threads, while this
+        thread collects their results and computes the overall statistics.
+
+        Upon exit, it sets :attr:`running` to False.
+        '''
+        queue = self.queue
+        put = queue.put
+        merge_type = self.merge_type
+        put('clean', None)
+        if not self.ffmpeg_path:
+            put('failure', 'Cannot find the ffmpeg binary.')
+            self.running = False
+            return
+        pre = self.pre_process
+        pre_pat = self.pre_process_pat
+        try:
+            pre_pat = re.compile(pre_pat)
+        except Exception as e:
+            put('failure', str(e))
+            self.running = False
+            return
+
+        itr = self.enumerate_files()
+        try:
+            s = clock()
+            while True:
+                if self.finish:
+                    raise FilerException('Processing terminated by user.')
+                files, count, dir_count, size, ignored = next(itr)
+                e = clock()
+                if e - s > 0.3:
+                    s = e
+                    put('count', (len(files), count, dir_count, size,
+                                  dict(ignored)))
+        except StopIteration:
+            pass
+        except FilerException as e:
+            put('failure', str(e))
+            self.running = False
+            return
+        self.error_list = []
+        self.success_list = []
+        file_str = '\n'.join(['{} <-- {}'.format(k, ','.join([vv[0] for vv in
+            v])) for k, v in files])
+        ignored_str = '\n'.join(['{}:{:d}'.format(k, v) for k, v in
+                                 dict(ignored).items()])
+        self.report = 'File list:\n{}\nIgnored list:\n{}\n'.format(file_str,
+                                                                   ignored_str)
+        put('count_done', (len(files), count, dir_count, size, dict(ignored)))
+        for k, v in files:
+            if len(v) > 1 and merge_type == 'none':
+                put('failure', 'More than one input file was provided for a '
+                    'single output file, and merge was not specified.')
+                self.running = False
+                return
+            if len(v) > 1 and pre:
+                put('failure', 'More than one input file was provided for a '
+                'single output file, and pre-processing was not specified.')
+                self.running = False
+                return
+
+        num_jobs = max(1, self.num_jobs)
+        stderr_lines = self.stderr_lines
+        ffmpeg_path = self.ffmpeg_path
+        out_overwrite = self.out_overwrite
+        segmented = self.segment_length > 0 and self.out_codec == 'h264' \
+            and not self.out_audio and not pre
+        input_start = self.input_start
+        input_end = self.input_end
+
+        def send_progress(dst, state, durations, duration=None):
+            ''' Sends the `file_progress` of the file from the state returned
+            by :meth:`~filers.ffmpeg.FFmpegProgress.feed`. If `duration` is
+            None, it's computed from the input files' `durations`.
+            '''
+            if duration is None:
+                duration = input_end
+            if not duration and durations:
+                if merge_type == 'concatenate':
+                    duration = sum(durations) - input_start
+                else:
+                    # a single input, or overlaid with -shortest
+                    duration = min(durations) - input_start
+            out_time = state['out_time']
+            speed = state['speed']
+            done = t_left = None
+            if state['done']:
+                done, t_left = 1., 0.
+            elif duration > 0 and out_time is not None:
+                done = min(max(out_time / duration, 0.), 1.)
+                if speed:
+                    t_left = max(duration - out_time, 0.) / speed
+            put('file_progress', (dst, out_time, done, state['fps'], speed,
+                                  t_left))
+
+        def run_pre_processes(srcs, cache):
+            ''' Runs the pre-process command for all the files in `srcs` that
+            are not in the `cache`, from multiple threads. It returns a dict
+            mapping each file to the command's output, or to the exception
+            if it failed, and the number of files found in the cache.
+            '''
+            outputs = {}
+            misses = Queue()
+            for src in srcs:
+                if src in outputs:
+                    continue
+                outputs[src] = None
+                if cache is not None:
+                    try:
+                        signature = cache.stat_signature(src)
+                    except OSError:
+                        # e.g. it was removed, it'll fail when it's run
+                        signature = None
+                    if signature is not None:
+                        outputs[src] = cache.get(pre, src, signature)
+                if outputs[src] is None:
+                    misses.put(src)
+            hits = len(outputs) - misses.qsize()
+
+            def pre_process_thread():
+                while not self.finish:
+                    try:
+                        src = misses.get_nowait()
+                    except Empty:
+                        return
+                    try:
+                        signature = ProbeCache.stat_signature(src)
+                        sprocess = popen(pre.format(src))
+                        stdoutdata, stderrdata = sprocess.communicate()
+                        if sprocess.wait():
+                            raise FilerException(
+                                'Pre process error: \n{}\n{}'.format(
+                                    stdoutdata, stderrdata))
+                    except Exception as e:
+                        outputs[src] = e
+                        continue
+                    outputs[src] = stdoutdata
+                    if cache is not None:
+                        cache.set(pre, src, stdoutdata, signature)
+
+            n = min(misses.qsize(), max(num_jobs, cpu_count()))
+            threads = [Thread(target=pre_process_thread,
+                              name='Processor_pre{}'.format(i))
+                       for i in range(n)]
+            for t in threads:
+                t.daemon = True
+                t.start()
+            for t in threads:
+                t.join()
+            return outputs, hits
+
+        def run_process(cmd, callback):
+            ''' Runs the FFmpeg command with :func:`~filers.ffmpeg.run_ffmpeg`
+            and returns its exit code and the last lines of its stderr output.
+            While it runs, its process is in `processes`, so that it's
+            terminated if we're asked to finish.
+            '''
+            started = []
+
+            def on_start(process):
+                with processes_lock:
+                    started.append(process)
+                    processes.add(process)
+                    if self.finish:
+                        terminate(process)
+
+            try:
+                code, lines, _ = run_ffmpeg(
+                    cmd, callback=callback, max_lines=stderr_lines,
+                    on_start=on_start)
+            finally:
+                with processes_lock:
+                    for process in started:
+                        processes.discard(process)
+            return code, lines
+
+        def terminate(process):
+            try:
+                process.terminate()
+            except OSError:
+                # it already ended
+                pass
+
+        def check_code(code, lines, dst, existed):
+            ''' Raises an exception if FFmpeg failed. If it was terminated
+            because we're asked to finish, its partial output file `dst` is
+            removed, unless it `existed` before and was not overwritten.
+            '''
+            if not code:
+                return
+            if not self.finish:
+                raise FilerException('Process error: \n{}'.format(
+                    '\n'.join(lines)))
+            if (out_overwrite or not existed) and exists(dst):
+                try:
+                    remove(dst)
+                except Exception as e:
+                    logging.warning('Processor: Cannot remove {}: {}'.format(
+                        dst, e))
+            raise FilerException('Terminated by user.')
+
+        def run_job(cmd, src, dst):
+            ''' Runs FFmpeg, after matching the pre-process output, if any,
+            for a single output file. It raises an exception if either failed
+            and otherwise returns the FFmpeg command and the last lines of its
+            stderr output.
+            '''
+            d = dirname(dst)
+            if not exists(d):
+                try:
+                    makedirs(d)
+                except Exception:
+                    pass
+            if pre:
+                stdoutdata = pre_outputs[src]
+                if isinstance(stdoutdata, Exception):
+                    raise stdoutdata
+                m = match(pre_pat, stdoutdata.decode('utf8', 'replace'))
+                if not m:
+                    raise FilerException('Match not found in pre'
+                    '-processing output')
+                cmd = cmd.format(*m.groups())
+            put('file_cmd', cmd)
+
+            existed = exists(dst)
+            code, lines = run_process(cmd, partial(send_progress, dst))
+            check_code(code, lines, dst, existed)
+            return cmd, '\n'.join(lines)
+
+        def split_file(src, dst):
+            ''' Returns the segments of the file from :meth:`gen_segments`,
+            or None if it's not split.
+            '''
+            if exists(dst) and not out_overwrite:
+                raise FilerException('{} already exists'.format(dst))
+            duration, fps = probe_video(ffmpeg_path, src)
+            if not duration:
+                return None
+            segments = self.gen_segments(src, dst, duration, fps)
+            return segments if len(segments) > 1 else None
+
+        def run_file(cmd, fsize, fcount, src, dst):
+            ''' Runs the job of an output file, or if it's split into
+            segments, adds the jobs of its segments.
+            '''
+            try:
+                if dst in stale_outputs:
+                    try:
+                        remove(dst)
+                    except Exception as e:
+                        raise FilerException(
+                            'Cannot remove the outdated output {}: {}'.format(
+                                dst, e))
+                segments = None
+                if segmented and fcount == 1:
+                    segments = split_file(src, dst)
+                if segments is not None:
+                    d = dirname(dst)
+                    if not exists(d):
+                        try:
+                            makedirs(d)
+                        except Exception:
+                            pass
+                    job = _SegmentedJob(cmd, fsize, fcount, dst, segments)
+                    segmented_jobs.append(job)
+                    for i in range(len(segments)):
+                        add_job(('segment', job, i))
+                    return
+                cmd, stderrdata = run_job(cmd, src, dst)
+            except Exception as e:
+                results.put((cmd, fsize, fcount, dst, None, e))
+            else:
+                results.put((cmd, fsize, fcount, dst, stderrdata, None))
+
+        def run_segment(job, i):
+            ''' Encodes a segment of a :class:`_SegmentedJob`. The last
+            segment to finish concatenates them into the output file.
+            '''
+            cmd, filename, duration = job.segments[i]
+            error = None
+            try:
+                if exists(filename):
+                    remove(filename)
+                if job.error is not None:
+                    # another segment failed, so the file will fail anyway
+                    raise job.error
+                put('file_cmd', cmd)
+                code, lines = run_process(
+                    cmd, partial(send_progress, filename, duration=duration))
+                # the segment files are removed with the job
+                check_code(code, lines, filename, True)
+            except Exception as e:
+                error = e
+            with job.lock:
+                if error is not None and job.error is None:
+                    job.error = error
+                job.remaining -= 1
+                if job.remaining:
+                    return
+
+            filenames = [f for _, f, _ in job.segments]
+            list_filename = segments_list_filename(job)
+            cmd = '\n'.join([c for c, _, _ in job.segments])
+            try:
+                if job.error is not None:
+                    raise job.error
+                with open(list_filename, 'wb') as fh:
+                    for filename in filenames:
+                        # relative to the list file, which is next to them
+                        line = "file '{}'\n".format(
+                            split(filename)[1].replace("'", "'\\''"))
+                        if not isinstance(line, bytes):
+                            line = line.encode('utf8')
+                        fh.write(line)
+                concat_cmd = self.gen_concat_cmd(list_filename, job.dst)
+                cmd = '{}\n{}'.format(cmd, concat_cmd)
+                put('file_cmd', concat_cmd)
+                existed = exists(job.dst)
+                code, lines = run_process(concat_cmd, partial(
+                    send_progress, job.dst,
+                    duration=sum([d for _, _, d in job.segments])))
+                check_code(code, lines, job.dst, existed)
+            except Exception as e:
+                results.put((cmd, job.fsize, job.fcount, job.dst, None, e))
+            else:
+                results.put((cmd, job.fsize, job.fcount, job.dst,
+                             '\n'.join(lines), None))
+            finally:
+                remove_segments(job)
+
+        def segments_list_filename(job):
+            return '{}.parts.txt'.format(splitext(job.dst)[0])
+
+        def remove_segments(job):
+            ''' Removes the temporary segment files of a
+            :class:`_SegmentedJob` and its concat list file.
+            '''
+            for filename in [f for _, f, _ in job.segments] + \
+                    [segments_list_filename(job)]:
+                try:
+                    if exists(filename):
+                        remove(filename)
+                except Exception as e:
+                    logging.warning('Processor: Cannot remove {}: {}'.format(
+                        filename, e))
+
+        def add_job(item):
+            with pending_lock:
+                pending[0] += 1
+            work.put(item)
+
+        def worker():
+            ''' Runs the jobs from the `work` queue until all of them are
+            done or until we're asked to finish, and puts the outcome of each
+            output file in the `results` queue. When we're asked to finish,
+            the FFmpeg process of a job that already started is terminated.
+            '''
+            while True:
+                while self.pause and not self.finish:
+                    sleep(.1)
+                if self.finish:
+                    return
+                try:
+                    item = work.get(timeout=.1)
+                except Empty:
+                    with pending_lock:
+                        if not pending[0]:
+                            return
+                    continue
+                try:
+                    if item[0] == 'segment':
+                        run_segment(*item[1:])
+                    else:
+                        run_file(*item[1:])
+                finally:
+                    with pending_lock:
+                        pending[0] -= 1
+
+        error_list = self.error_list
+        success_list = self.success_list
+        out_size_done = 0
+        out_size_total = 0
+        in_size_done = 0
+        in_size_total = size
+        in_count_done = 0
+        in_count_total = count
+        out_count_done = 0
+        out_count_total = len(files)
+        bps = 0.
+        time_total = 0.
+        t_left = 0
+
+        def warn(msg):
+            ''' Reports a problem that doesn't stop the job. '''
+            logging.warning('Processor: {}'.format(msg))
+            put('warning', msg)
+            self.report += '{}\n'.format(msg)
+
+        def close_manifest():
+            try:
+                manifest.close()
+            except Exception as e:
+                warn('Cannot close the output manifest: {}'.format(e))
+
+        jobs = self.gen_cmd(files)
+        manifest = None
+        job_hashes = {}
+        stale_outputs = set()
+        if self.use_output_manifest:
+            try:
+                manifest = OutputManifest(
+                    output_manifest_filename(self.output, self.data_path))
+            except Exception as e:
+                warn('Cannot open the output manifest: {}'.format(e))
+
+        if manifest is not None:
+            unfinished = []
+            for (_, src_list), item in zip(files, jobs):
+                cmd, fsize, fcount, _, dst = item
+                try:
+                    inputs = [manifest.input_signature(src)
+                              for src in sorted([f[0] for f in src_list])]
+                except OSError:
+                    unfinished.append(item)
+                    continue
+                # without the executable and the options that don't change
+                # the output, e.g. the number of threads
+                cmd_hash = manifest.command_hash(
+                    _run_options_pat.sub('', cmd.split('"', 2)[2]), pre,
+                    self.pre_process_pat)
+                job_hashes[dst] = cmd_hash, inputs
+                if self.out_overwrite or \
+                        not manifest.is_finished(dst, cmd_hash, inputs):
+                    unfinished.append(item)
+                    continue
+                in_size_total -= fsize
+                in_count_total -= fcount
+                out_count_total -= 1
+
+            if len(unfinished) < len(jobs):
+                self.report += 'Finished: skipped {:d} files already '\
+                    'produced with the same settings.\n'.format(
+                        len(jobs) - len(unfinished))
+            if not self.out_overwrite:
+                # our own outputs that are outdated, they are removed just
+                # before they are produced again
+                stale_outputs = set([
+                    item[4] for item in unfinished
+                    if manifest.is_output(item[4])])
+            jobs = unfinished
+
+        pre_outputs = {}
+        if pre:
+            cache = None
+            if self.use_pre_process_cache:
+                try:
+                    cache = _BestEffortCache(
+                        ProbeCache(join(self.data_path or user_data_path,
+                                        'probe_cache.sqlite')),
+                        lambda e: warn(
+                            'Cannot use the pre-process cache: {}'.format(e)))
+                except Exception as e:
+                    warn('Cannot open the pre-process cache: {}'.format(e))
+            try:
+                pre_outputs, hits = run_pre_processes(
+                    [item[3] for item in jobs], cache)
+            finally:
+                if cache is not None:
+                    cache.close()
+            if self.finish:
+                if manifest is not None:
+                    close_manifest()
+                put('failure', 'Processing terminated by user.')
+                self.running = False
+                return
+            if cache is not None:
+                self.report += 'Pre-process cache: {:d} of {:d} files found '\
+                    '({:.0f}%).\n'.format(
+                        hits, len(pre_outputs),
+                        100. * hits / max(len(pre_outputs), 1))
+
+        work = Queue()
+        results = Queue()
+        # the number of jobs added that didn't finish yet
+        pending = [0]
+        pending_lock = Lock()
+        segmented_jobs = []
+        # the FFmpeg processes currently running
+        processes = set()
+        processes_lock = Lock()
+        for item in jobs:
+            add_job(('file', ) + item)
+        threads = [Thread(target=worker, name='Processor_job{}'.format(i))
+                   for i in range(num_jobs)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        # time spent paused is not included in the elapsed time
+        ts = clock()
+        paused_ts = None
+        paused_total = 0.
+        stopped = False
+        while True:
+            if self.pause and paused_ts is None:
+                paused_ts = clock()
+            elif not self.pause and paused_ts is not None:
+                paused_total += clock() - paused_ts
+                paused_ts = None
+            if self.finish and not stopped:
+                # the jobs already running are terminated, but still
+                # accounted for
+                with processes_lock:
+                    for process in processes:
+                        terminate(process)
+                for t in threads:
+                    t.join()
+                stopped = True
+
+            try:
+                cmd, fsize, fcount, dst, stderrdata, e = results.get(
+                    timeout=.1)
+            except Empty:
+                if stopped or not any(t.is_alive() for t in threads) and \
+                        results.empty():
+                    break
+                continue
+
+            if e is None:
+                out_size_done += getsize(dst)
+                in_size_done += fsize
+                in_count_done += fcount
+                out_count_done += 1
+                time_total = max(clock() - ts - paused_total, 0.0000001)
+                bps = in_size_done / time_total
+                if in_size_done:
+                    out_size_total = int(in_size_total / float(in_size_done) *
+                                         out_size_done)
+                t_left = (in_size_total - in_size_done) / bps if bps else 0
+                put('file_stat', (out_size_done, out_size_total, in_size_done,
+                                  in_size_total, in_count_done, in_count_total,
+                                  out_count_done, out_count_total, bps,
+                                  time_total, t_left))
+                success_list.append('{}\n{}'.format(cmd, stderrdata))
+                if manifest is not None and dst in job_hashes:
+                    try:
+                        manifest.add(dst, *job_hashes[dst])
+                    except Exception as exc:
+                        warn('Cannot write the output manifest, finished '
+                             'files will be produced again: {}'.format(exc))
+                        try:
+                            manifest.close()
+                        except Exception:
+                            pass
+                        manifest = None
+            else:
+                in_size_total -= fsize
+                msg = '{}\n{}'.format(cmd, e)
+                error_list.append(msg)
+                put('skipped', msg)
+
+        if manifest is not None:
+            close_manifest()
+        if stopped:
+            # the threads are done, so the segments that were not all
+            # encoded will not be concatenated
+            for job in segmented_jobs:
+                if job.remaining:
+                    remove_segments(job)
+            put('failure', 'Processing terminated by user.')
+        else:
+            put('done', None)
+        self.running = False
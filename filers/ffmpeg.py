@@ -0,0 +1,226 @@
+'''FFmpeg
+=========
+
+Tools for running FFmpeg, e.g. by :class:`~filers.engine.ProcessorEngine`.
+
+FFmpeg writes its progress to stderr as a status line that is overwritten in
+place, mixed with its log, so reading the progress requires buffering all of
+stderr until the process ends. Instead, :func:`run_ffmpeg` runs FFmpeg with
+``-progress pipe:1``, which writes the progress as blocks of ``key=value``
+lines to stdout, and parses them with :class:`FFmpegProgress` as they are
+written. Only the last lines of stderr are kept, for the error report.
+'''
+
+import os
+from os.path import join, exists, abspath, isfile, dirname
+import re
+import shlex
+import shutil
+import subprocess as sp
+from collections import deque
+from threading import Thread
+
+__all__ = ('find_ffmpeg', 'popen', 'parse_time', 'FFmpegProgress',
+           'run_ffmpeg', 'probe_video')
+
+_duration_pat = re.compile(r'^\s*Duration: (\d+:\d+:\d+(?:\.\d+)?)')
+
+_fps_pat = re.compile(r'^\s*Stream #.*Video: .*?(\d+(?:\.\d+)?) fps')
+
+
+def find_ffmpeg():
+    '''
+    Returns the full path to the FFmpeg executable, or `''` if it's not
+    found. It looks in the same path that :py:mod:`ffpyplayer` looks for the
+    binaries (`FFMPEG_ROOT` in os.environ as well as the parent directory of
+    this file), and then in the `PATH`.
+    '''
+    if 'FFMPEG_ROOT' in os.environ and\
+            exists(join(os.environ['FFMPEG_ROOT'], 'bin')):
+        base_path = abspath(join(os.environ['FFMPEG_ROOT'], 'bin'))
+    else:
+        base_path = abspath(dirname(dirname(__file__)))
+    ffmpeg_path = join(base_path, 'ffmpeg')
+    if exists(ffmpeg_path + '.exe') and isfile(ffmpeg_path + '.exe'):
+        return ffmpeg_path + '.exe'
+    if exists(ffmpeg_path) and isfile(ffmpeg_path):
+        return ffmpeg_path
+
+    try:
+        which = shutil.which
+    except AttributeError:
+        from distutils.spawn import find_executable as which
+    return which('ffmpeg') or ''
+
+
+def popen(cmd):
+    '''
+    Starts the command line `cmd` in a second process, with its stdin, stdout,
+    and stderr piped, and returns the :class:`subprocess.Popen` instance. On
+    Windows, the process is started without a console window.
+    '''
+    if os.name == 'nt':
+        info = sp.STARTUPINFO()
+        info.dwFlags = sp.STARTF_USESHOWWINDOW
+        info.wShowWindow = sp.SW_HIDE
+        return sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.PIPE, stdin=sp.PIPE,
+                        startupinfo=info)
+    return sp.Popen(shlex.split(cmd), stdout=sp.PIPE, stderr=sp.PIPE,
+                    stdin=sp.PIPE)
+
+
+def parse_time(value):
+    '''
+    Returns the time in seconds of a FFmpeg time string, e.g.
+    `01:02:03.50`, or None if it's not a time.
+
+    >>> parse_time('01:02:03.50')
+    3723.5
+    '''
+    try:
+        h, m, s = value.strip().split(':')
+        return int(h) * 3600 + int(m) * 60 + float(s)
+    except ValueError:
+        return None
+
+
+class FFmpegProgress(object):
+    '''
+    Parses the ``-progress`` output of FFmpeg, line by line.
+
+    >>> progress = FFmpegProgress()
+    >>> for line in ['frame=240', 'fps=120.5', 'out_time_us=8000000',
+    ...              'total_size=1048576', 'speed=4.02x', 'progress=continue']:
+    ...     state = progress.feed(line)
+    >>> state
+    {'frame': 240, 'fps': 120.5, 'out_time': 8.0, 'total_size': 1048576, \
+'speed': 4.02, 'done': False}
+    '''
+
+    values = {}
+    ''' The `key=value` pairs of the current progress block. '''
+
+    def __init__(self):
+        super(FFmpegProgress, self).__init__()
+        self.values = {}
+
+    @staticmethod
+    def _number(value, conv=float):
+        try:
+            return conv(value.strip().rstrip('x'))
+        except ValueError:
+            return None
+
+    def feed(self, line):
+        '''
+        Parses a line of the progress output. When the line ends a progress
+        block, it returns a dict of the progress, otherwise None. The dict
+        contains `frame`, the number of frames encoded; `fps`, the encoding
+        rate in frames per second; `out_time`, the time in seconds of the
+        output encoded so far; `total_size`, the size in bytes of the output
+        so far; `speed`, the encoding rate as a multiple of real time; and
+        `done`, whether it's the last block. Values that FFmpeg doesn't report
+        (e.g. `N/A`) are None.
+        '''
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return None
+        values = self.values
+        if key != 'progress':
+            values[key] = value
+            return None
+
+        self.values = {}
+        number = self._number
+        if 'out_time_us' in values:
+            out_time = number(values['out_time_us'])
+            out_time = out_time / 1000000. if out_time is not None else None
+        elif 'out_time_ms' in values:
+            # despite its name, it's also in microseconds
+            out_time = number(values['out_time_ms'])
+            out_time = out_time / 1000000. if out_time is not None else None
+        else:
+            out_time = parse_time(values.get('out_time', ''))
+        return {
+            'frame': number(values.get('frame', ''), int),
+            'fps': number(values.get('fps', '')),
+            'out_time': out_time,
+            'total_size': number(values.get('total_size', ''), int),
+            'speed': number(values.get('speed', '')),
+            'done': value.strip() == 'end'}
+
+
+def run_ffmpeg(cmd, callback=None, max_lines=100, on_start=None):
+    '''
+    Runs the FFmpeg command line `cmd` until it ends, and returns a 3-tuple
+    of its exit code, a list of the last `max_lines` lines it wrote to
+    stderr, and a list of the durations in seconds of its inputs, as
+    reported by FFmpeg.
+
+    `cmd` should include ``-progress pipe:1``, in which case `callback`, if
+    not None, is called with the dict returned by
+    :meth:`FFmpegProgress.feed` and the list of the input durations read so
+    far, every time FFmpeg reports its progress (about twice a second). The
+    callback is called from the calling thread, while stderr is read from a
+    second thread.
+
+    If not None, `on_start` is called with the :class:`subprocess.Popen`
+    instance once FFmpeg started, e.g. so that it can be terminated from
+    another thread, in which case the exit code is not zero.
+    '''
+    process = popen(cmd)
+    if on_start is not None:
+        on_start(process)
+    process.stdin.close()
+    lines = deque(maxlen=max_lines)
+    durations = []
+
+    def read_stderr():
+        for line in iter(process.stderr.readline, b''):
+            line = line.decode('utf8', 'replace').rstrip()
+            m = _duration_pat.match(line)
+            if m is not None:
+                duration = parse_time(m.group(1))
+                if duration is not None:
+                    durations.append(duration)
+            lines.append(line)
+
+    thread = Thread(target=read_stderr, name='FFmpeg_stderr')
+    thread.daemon = True
+    thread.start()
+
+    progress = FFmpegProgress()
+    for line in iter(process.stdout.readline, b''):
+        state = progress.feed(line.decode('utf8', 'replace'))
+        if state is not None and callback is not None:
+            callback(state, durations)
+    thread.join()
+    process.stdout.close()
+    process.stderr.close()
+    return process.wait(), list(lines), durations
+
+
+def probe_video(ffmpeg_path, filename):
+    '''
+    Returns a 2-tuple of the duration in seconds, and the frame rate of the
+    first video stream of the video file, as reported by FFmpeg when opening
+    it. Either is None if it's unknown.
+
+    :Parameters:
+
+        `ffmpeg_path`: str
+            The full path to the FFmpeg executable.
+        `filename`: str
+            The video file.
+    '''
+    process = popen('"{}" -hide_banner -i "{}"'.format(ffmpeg_path, filename))
+    _, stderrdata = process.communicate()
+    duration = fps = None
+    for line in stderrdata.decode('utf8', 'replace').splitlines():
+        m = _duration_pat.match(line)
+        if m is not None and duration is None:
+            duration = parse_time(m.group(1))
+        m = _fps_pat.match(line)
+        if m is not None and fps is None:
+            fps = float(m.group(1))
+    return duration, fps
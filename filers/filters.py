@@ -0,0 +1,254 @@
+'''Filters
+==========
+
+Compiles the filename patterns used to select files, e.g.
+:attr:`~filers.file_tools.FileTools.input_filter`, into fast matchers.
+
+A simple pattern is a glob where ``*`` matches any number of characters, and
+``?`` matches a single character. Most globs are of the form ``*.avi``,
+``C:\\videos\\*``, or ``*day1*``, and they are compiled into plain string
+tests, e.g. ``filename.endswith('.avi')``, which are much faster than a regex.
+Only globs that cannot be compiled that way are matched with an anchored regex,
+and even then, filenames that don't end with the literal suffix of the glob
+(e.g. ``.avi`` in ``*day?*.avi``) are rejected before trying the regex.
+Otherwise, the pattern is a regex that is matched from the start of the
+filename.
+
+:class:`DirFilter` uses globs to select the directories to walk into, so that
+whole sub-trees that cannot contain any wanted files are skipped.
+
+>>> filt = compile_filter('*.avi')
+>>> filt.kind
+'suffix'
+>>> bool(filt.match('C:\\\\videos\\\\video1.avi'))
+True
+>>> bool(filt.match('C:\\\\videos\\\\video1.avi.txt'))
+False
+'''
+
+import re
+
+__all__ = ('FileFilter', 'DirFilter', 'compile_filter', 'glob_to_regex',
+           'split_patterns')
+
+
+def glob_to_regex(pattern):
+    '''
+    Returns the regex string that matches the same filenames as the simple
+    glob `pattern`, i.e. the whole filename.
+
+    >>> glob_to_regex('*day?.avi')
+    '.*day.\\\\.avi\\\\Z'
+    '''
+    parts = []
+    for c in pattern:
+        if c == '*':
+            parts.append('.*')
+        elif c == '?':
+            parts.append('.')
+        else:
+            parts.append(re.escape(c))
+    return ''.join(parts) + '\\Z'
+
+
+class FileFilter(object):
+    '''
+    A compiled filename pattern. See :func:`compile_filter`.
+
+    :Parameters:
+
+        `pattern`: str
+            The pattern.
+        `simple`: bool
+            Whether `pattern` is a simple glob rather than a regex. Defaults
+            to True.
+
+    :raises:
+
+        :class:`re.error` if the regex is invalid.
+    '''
+
+    pattern = ''
+    ''' The pattern. '''
+
+    simple = True
+    ''' Whether :attr:`pattern` is a simple glob rather than a regex. '''
+
+    kind = ''
+    ''' How the filenames are matched. Can be one of `all`, `equal`, `prefix`,
+    `suffix`, `contains`, `prefix_suffix`, or `regex`.
+    '''
+
+    regex = None
+    ''' The compiled regex when :attr:`kind` is `regex`, otherwise None. '''
+
+    match = None
+    ''' Matches a filename against the pattern. It takes the filename and
+    returns whether it matched. When :attr:`kind` is `regex`, it returns the
+    regex match object, or None, so its groups can be used.
+    '''
+
+    def __init__(self, pattern, simple=True):
+        super(FileFilter, self).__init__()
+        self.pattern = pattern
+        self.simple = simple
+
+        if not simple:
+            self.kind = 'regex'
+            self.regex = re.compile(pattern)
+            self.match = self.regex.match
+            return
+
+        if '?' in pattern:
+            stars = None
+        else:
+            stars = [i for i, c in enumerate(pattern) if c == '*']
+        n = len(pattern)
+
+        if not pattern.strip('*'):
+            self.kind = 'all'
+            self.match = lambda filename: True
+        elif stars == []:
+            self.kind = 'equal'
+            self.match = lambda filename: filename == pattern
+        elif stars == [0]:
+            suffix = pattern[1:]
+            self.kind = 'suffix'
+            self.match = lambda filename: filename.endswith(suffix)
+        elif stars == [n - 1]:
+            prefix = pattern[:-1]
+            self.kind = 'prefix'
+            self.match = lambda filename: filename.startswith(prefix)
+        elif stars == [0, n - 1]:
+            middle = pattern[1:-1]
+            self.kind = 'contains'
+            self.match = lambda filename: middle in filename
+        elif stars is not None and len(stars) == 1:
+            prefix, suffix = pattern.split('*')
+            min_len = len(prefix) + len(suffix)
+            self.kind = 'prefix_suffix'
+            self.match = lambda filename: (
+                filename.endswith(suffix) and filename.startswith(prefix) and
+                len(filename) >= min_len)
+        else:
+            self.kind = 'regex'
+            self.regex = regex = re.compile(glob_to_regex(pattern))
+            # the literal text before the first and after the last wildcard
+            prefix = re.split('[*?]', pattern)[0]
+            suffix = re.split('[*?]', pattern)[-1]
+            if prefix or suffix:
+                self.match = lambda filename: (
+                    filename.endswith(suffix) and
+                    filename.startswith(prefix) and regex.match(filename) or
+                    None)
+            else:
+                self.match = regex.match
+
+
+def compile_filter(pattern, simple=True):
+    '''
+    Compiles the pattern into a :class:`FileFilter`, whose
+    :attr:`~FileFilter.match` method tests filenames against it.
+
+    :Parameters:
+
+        `pattern`: str
+            The pattern. An empty pattern matches everything.
+        `simple`: bool
+            Whether `pattern` is a simple glob, which must match the whole
+            filename, rather than a regex, which must match the start of the
+            filename. Defaults to True.
+    '''
+    return FileFilter(pattern, simple=simple)
+
+
+def split_patterns(patterns):
+    '''
+    Splits a comma separated string of globs into a list of the globs.
+
+    >>> split_patterns('.git, @eaDir,.thumbnails')
+    ['.git', '@eaDir', '.thumbnails']
+    '''
+    return [p.strip() for p in patterns.split(',') if p.strip()]
+
+
+class DirFilter(object):
+    '''
+    Selects the sub-directories to walk into when walking a directory tree,
+    e.g. with :func:`~filers.walker.walk`.
+
+    >>> dir_filt = DirFilter(include=['day*'], exclude=['.git'])
+    >>> dir_filt.filter_dirs([], ['day1', 'day2', 'notes', '.git'])
+    (['day1', 'day2'], ['notes', '.git'])
+    >>> dir_filt.filter_dirs(['day1'], ['cam1', '.git'])
+    (['cam1'], ['.git'])
+
+    :Parameters:
+
+        `include`: list
+            A list of globs of the directories to walk into. A glob may
+            include the path separator, `/` or `\\`, to match multiple levels
+            of directories, starting from the top directory of the walk. E.g.
+            `*/day*` walks all the directories in the top directory, but
+            within those only the directories that start with `day` (and all
+            the directories they contain). A directory is walked if it matches
+            any of the globs. If empty, all the directories are walked, except
+            those excluded. Defaults to `()`.
+        `exclude`: list
+            A list of globs of directory names, at any depth, that are not
+            walked into, e.g. `.git` or `@eaDir`. Defaults to `()`.
+    '''
+
+    include = []
+    ''' The compiled `include` globs. Each is a list of the
+    :attr:`FileFilter.match` methods of the glob's levels.
+    '''
+
+    exclude = []
+    ''' The :attr:`FileFilter.match` methods of the `exclude` globs. '''
+
+    def __init__(self, include=(), exclude=()):
+        super(DirFilter, self).__init__()
+        self.include = [
+            [compile_filter(level).match for level in re.split(r'[\\/]', pat)
+             if level] for pat in include]
+        self.exclude = [compile_filter(pat).match for pat in exclude]
+
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+
+    __nonzero__ = __bool__
+
+    def filter_dirs(self, parents, dirs):
+        '''
+        Returns a 2-tuple of the list of the directories in `dirs` to walk
+        into, and of those to skip.
+
+        :Parameters:
+
+            `parents`: list
+                The names of the directories, starting from the top directory
+                of the walk, that lead to the directory containing `dirs`.
+                E.g. `[]` for the sub-directories of the top directory.
+            `dirs`: list
+                The names of the sub-directories.
+        '''
+        include = self.include
+        exclude = self.exclude
+        depth = len(parents)
+        if include:
+            # the globs that match all the parents
+            include = [
+                pat for pat in include
+                if all(pat[i](parents[i]) for i in range(min(len(pat), depth)))]
+
+        kept = []
+        pruned = []
+        for name in dirs:
+            if any(match(name) for match in exclude) or self.include and \
+                    not any(len(pat) <= depth or pat[depth](name)
+                            for pat in include):
+                pruned.append(name)
+            else:
+                kept.append(name)
+        return kept, pruned
@@ -0,0 +1,340 @@
+'''Journal
+==========
+
+A durable journal of the files processed by a job, so that an interrupted job
+can be resumed without redoing the files already processed, and a manifest of
+the output files produced by the video processor, so that outputs that are
+already up to date are not encoded again.
+'''
+
+import os
+from os.path import join, exists, isdir, isfile, abspath, getsize
+import json
+import hashlib
+from threading import Lock
+import time
+
+from filers import user_data_path
+
+__all__ = ('FileJournal', 'job_journal_filename', 'OutputManifest',
+           'output_manifest_filename')
+
+
+def job_journal_filename(*settings, **kwargs):
+    '''
+    Returns the default journal filename for a job. The name is derived from
+    the job settings, so that the same job always uses the same journal.
+
+    >>> job_journal_filename('copy', 'C:\\\\videos', '*.avi', 'E:\\\\backup')
+    '.../filers/journals/d7a8fbb307d7809469ca9abcb0082e4f.jsonl'
+
+    :Parameters:
+
+        `settings`: positional args
+            The settings that identify the job, e.g. the mode and the input
+            and output files. They must be json serializable.
+        `data_path`: str
+            The keyword argument of the directory in which the `journals`
+            directory is. If None or empty, :attr:`~filers.user_data_path` is
+            used. Defaults to None.
+    '''
+    key = json.dumps(settings, sort_keys=True).encode('utf8')
+    return join(kwargs.get('data_path') or user_data_path, 'journals',
+                '{}.jsonl'.format(hashlib.md5(key).hexdigest()))
+
+
+def _read_entries(filename):
+    '''
+    Returns the list of the entries (dicts) in the json lines file `filename`.
+    Lines that cannot be parsed are skipped. If the file ends with a partial
+    line, e.g. after a crash, the partial line is removed, so that the lines
+    appended afterwards start on a new line.
+    '''
+    entries = []
+    size = 0
+    with open(filename, 'rb') as fh:
+        for line in fh:
+            if not line.endswith(b'\n'):
+                break
+            size += len(line)
+            try:
+                entries.append(json.loads(line.decode('utf8')))
+            except ValueError:
+                continue
+    if size < getsize(filename):
+        with open(filename, 'r+b') as fh:
+            fh.truncate(size)
+    return entries
+
+
+class FileJournal(object):
+    '''
+    An append-only journal of the files processed by a job.
+
+    Every file processed is added to the journal as a line of json, describing
+    the source and destination files, the file size, whether it succeeded, and
+    its hash if it was verified with a hash. Each line is flushed as it is
+    written, so the journal survives the app being closed or crashing. It is
+    also synced to the disk at most every :attr:`sync_interval` seconds.
+
+    :Parameters:
+
+        `filename`: str
+            The filename of the journal. See :func:`job_journal_filename`.
+        `resume`: bool
+            If True, the existing journal is read and appended to. Otherwise,
+            any existing journal is discarded. Defaults to False.
+    '''
+
+    filename = ''
+    ''' The filename of the journal. '''
+
+    sync_interval = 1.
+    ''' The maximum time, in seconds, between syncing the journal to the disk.
+    '''
+
+    completed = {}
+    ''' A dict of the files that were successfully processed according to the
+    journal when it was opened. The keys are 2-tuples of the source and
+    destination filenames, and the values are the journal entries (dicts).
+    '''
+
+    _fh = None
+
+    _lock = None
+
+    _last_sync = 0.
+
+    def __init__(self, filename, resume=False):
+        super(FileJournal, self).__init__()
+        self.filename = filename
+        self._lock = Lock()
+        self.completed = completed = {}
+
+        dirname = os.path.dirname(filename)
+        if dirname and not isdir(dirname):
+            os.makedirs(dirname)
+
+        if resume and exists(filename):
+            for entry in _read_entries(filename):
+                key = entry['src'], entry['dst']
+                if entry['success']:
+                    completed[key] = entry
+                else:
+                    completed.pop(key, None)
+
+        self._fh = open(filename, 'a' if resume else 'w')
+        self._last_sync = time.time()
+
+    def add(self, src, dst, size, mode, verify_type, success, digest=None,
+            error=None):
+        '''
+        Adds a file to the journal after it has been processed.
+
+        :Parameters:
+
+            `src`: str
+                The source filename.
+            `dst`: str
+                The destination filename.
+            `size`: int
+                The size of the source file.
+            `mode`: str
+                The mode used to process the file, e.g. `'copy'`.
+            `verify_type`: str
+                The method used to verify the file, e.g. `'sha256'`.
+            `success`: bool
+                Whether the file was processed and verified successfully.
+            `digest`: str
+                The hex hash of the file, if it was verified with a hash.
+                Defaults to None.
+            `error`: str
+                The error message if it failed. Defaults to None.
+        '''
+        line = json.dumps({
+            'src': src, 'dst': dst, 'size': size, 'mode': mode,
+            'verify': verify_type, 'success': success, 'hash': digest,
+            'error': error, 'time': time.time()})
+
+        with self._lock:
+            fh = self._fh
+            fh.write(line)
+            fh.write('\n')
+            fh.flush()
+            if time.time() - self._last_sync >= self.sync_interval:
+                os.fsync(fh.fileno())
+                self._last_sync = time.time()
+
+    def close(self, delete=False):
+        '''
+        Syncs and closes the journal.
+
+        :Parameters:
+
+            `delete`: bool
+                Whether to delete the journal after closing it, e.g. when the
+                job has completed successfully. Defaults to False.
+        '''
+        with self._lock:
+            if self._fh is None:
+                return
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            self._fh.close()
+            self._fh = None
+            if delete:
+                os.remove(self.filename)
+
+
+def output_manifest_filename(output, data_path=None):
+    '''
+    Returns the default manifest filename for the output directory `output`,
+    so that all the jobs writing to the same directory share a manifest. It's
+    in the `manifests` directory in `data_path`, or in
+    :attr:`~filers.user_data_path` if `data_path` is None or empty.
+
+    >>> output_manifest_filename('E:\\\\mp4')
+    '.../filers/manifests/5d41402abc4b2a76b9719d911017c592.jsonl'
+    '''
+    key = json.dumps(abspath(output)).encode('utf8')
+    return join(data_path or user_data_path, 'manifests',
+                '{}.jsonl'.format(hashlib.md5(key).hexdigest()))
+
+
+class OutputManifest(object):
+    '''
+    An append-only manifest of the output files produced by a job, e.g. by
+    :class:`~filers.engine.ProcessorEngine`.
+
+    Every output file produced is added to the manifest as a line of json,
+    describing the output file, its size, the hash of the command that
+    produced it, and the signature (filename, size, and modification time) of
+    each of its input files. An output is finished, and doesn't need to be
+    produced again, as long as it still has the same size and it would be
+    produced by the same command from the same inputs. See
+    :meth:`is_finished`.
+
+    :Parameters:
+
+        `filename`: str
+            The filename of the manifest. See :func:`output_manifest_filename`.
+    '''
+
+    filename = ''
+    ''' The filename of the manifest. '''
+
+    outputs = {}
+    ''' A dict of the output files in the manifest. The keys are the output
+    filenames and the values are the latest manifest entries (dicts).
+    '''
+
+    _fh = None
+
+    _lock = None
+
+    def __init__(self, filename):
+        super(OutputManifest, self).__init__()
+        self.filename = filename
+        self._lock = Lock()
+        self.outputs = outputs = {}
+
+        dirname = os.path.dirname(filename)
+        if dirname and not isdir(dirname):
+            os.makedirs(dirname)
+
+        num_lines = 0
+        if exists(filename):
+            entries = _read_entries(filename)
+            num_lines = len(entries)
+            for entry in entries:
+                outputs[entry['dst']] = entry
+
+        if num_lines > 2 * len(outputs) + 100:
+            # most entries were replaced, rewrite only the latest ones
+            with open(filename + '.tmp', 'w') as fh:
+                for entry in outputs.values():
+                    fh.write(json.dumps(entry))
+                    fh.write('\n')
+                fh.flush()
+                os.fsync(fh.fileno())
+            if exists(filename):
+                os.remove(filename)
+            os.rename(filename + '.tmp', filename)
+        self._fh = open(filename, 'a')
+
+    @staticmethod
+    def input_signature(filename):
+        '''
+        Returns the signature of an input file used to tell whether it changed
+        since the output was produced. It's a list of its filename, size, and
+        modification time.
+        '''
+        st = os.stat(filename)
+        return [filename, st.st_size, st.st_mtime]
+
+    @staticmethod
+    def command_hash(*commands):
+        '''
+        Returns the hex hash of the commands (strings) that produce an output,
+        e.g. the FFmpeg command line.
+        '''
+        data = u'\n'.join(commands).encode('utf8')
+        return hashlib.md5(data).hexdigest()
+
+    def is_output(self, dst):
+        '''
+        Returns whether the output file `dst` exists and is the same file that
+        was added to the manifest, i.e. it has the same size.
+        '''
+        entry = self.outputs.get(dst)
+        return entry is not None and isfile(dst) and \
+            getsize(dst) == entry['size']
+
+    def is_finished(self, dst, cmd_hash, inputs):
+        '''
+        Returns whether the output file `dst` is already finished. It is if
+        :meth:`is_output` and it was added to the manifest with the same
+        `cmd_hash` and `inputs`.
+
+        :Parameters:
+
+            `dst`: str
+                The output filename.
+            `cmd_hash`: str
+                The :meth:`command_hash` of the commands that would produce
+                the output.
+            `inputs`: list
+                The list of the :meth:`input_signature` of each of the input
+                files of the output.
+        '''
+        entry = self.outputs.get(dst)
+        return entry is not None and entry['cmd'] == cmd_hash and \
+            entry['inputs'] == inputs and self.is_output(dst)
+
+    def add(self, dst, cmd_hash, inputs):
+        '''
+        Adds the output file `dst` to the manifest after it was produced by
+        the commands whose hash is `cmd_hash` from the `inputs`. See
+        :meth:`is_finished`.
+        '''
+        entry = {'dst': dst, 'size': getsize(dst), 'cmd': cmd_hash,
+                 'inputs': inputs, 'time': time.time()}
+        line = json.dumps(entry)
+
+        with self._lock:
+            self.outputs[dst] = entry
+            fh = self._fh
+            fh.write(line)
+            fh.write('\n')
+            fh.flush()
+
+    def close(self):
+        ''' Syncs and closes the manifest.
+        '''
+        with self._lock:
+            if self._fh is None:
+                return
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            self._fh.close()
+            self._fh = None
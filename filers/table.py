@@ -0,0 +1,263 @@
+'''File Table
+=============
+
+A compact table of the input and output files enumerated by e.g.
+:meth:`~filers.file_tools.FileTools.enumerate_files`.
+
+Storing millions of files as python tuples of strings takes several hundred
+bytes per file, with each path stored in full. Instead, :class:`FileTable`
+interns the directories, so each directory is stored once, stores the
+filenames encoded back to back in a single buffer, and stores the offsets and
+sizes in :mod:`array` arrays. Each file then takes a few tens of bytes beyond
+its filenames. The items are only converted to tuples when they are accessed.
+'''
+
+from array import array
+from heapq import heapify, heappop, heapreplace
+from itertools import compress
+from os.path import join, split
+
+from six import PY2
+
+__all__ = ('FileTable', )
+
+try:
+    array('Q')
+    _uint64 = 'Q'
+except ValueError:
+    # py2 doesn't have Q, double is exact for ints up to 2 ** 53
+    _uint64 = 'd'
+
+_encode_errors = 'strict' if PY2 else 'surrogateescape'
+
+_sort_chunk_size = 1 << 14
+''' The number of files whose sort keys exist at once when sorting a
+:class:`FileTable`. See :func:`_iter_sorted`.
+'''
+
+
+def _iter_sorted(indices, key, typecode, chunk_size=_sort_chunk_size):
+    '''
+    Yields the `indices` (a sequence) sorted by `key`, like :func:`sorted` but
+    without creating the keys of all the indices at once. Instead, chunks of
+    `chunk_size` indices are each sorted into an array of type `typecode`,
+    and the chunks are then merged, so only the keys of one chunk, or of the
+    first remaining index of each chunk, exist at a time. Like
+    :func:`sorted`, it's stable.
+    '''
+    chunks = [array(typecode, sorted(indices[i:i + chunk_size], key=key))
+              for i in range(0, len(indices), chunk_size)]
+    del indices
+    # ties are broken by the chunk and the position in the chunk, so equal
+    # indices stay in their original order
+    heap = [(key(int(chunk[0])), c, 0) for c, chunk in enumerate(chunks)]
+    heapify(heap)
+    while heap:
+        _, c, pos = heap[0]
+        chunk = chunks[c]
+        yield int(chunk[pos])
+        pos += 1
+        if pos < len(chunk):
+            heapreplace(heap, (key(int(chunk[pos])), c, pos))
+        else:
+            heappop(heap)
+
+
+class FileTable(object):
+    '''
+    A compact table of files. Each file has a source filename, a destination
+    filename, and the size of the source file.
+
+    >>> table = FileTable()
+    >>> table.add('C:\\\\videos\\\\video2.avi', 'E:\\\\backup\\\\video2.avi', 2048)
+    0
+    >>> table.add('C:\\\\videos\\\\video1.avi', 'E:\\\\backup\\\\video1.avi', 1024)
+    1
+    >>> table.item(1)
+    (('E:\\\\backup\\\\video1.avi', 'video1.avi'),
+     ('C:\\\\videos\\\\video1.avi', 'video1.avi', 1024))
+    >>> table.sort()
+    >>> [src for _, (src, _, _) in table]
+    ['C:\\\\videos\\\\video1.avi', 'C:\\\\videos\\\\video2.avi']
+
+    Each item is a 2-tuple of a 2-tuple of the destination filename and its
+    name, and a 3-tuple of the source filename, its name, and its size, as
+    returned by :meth:`item`.
+
+    Before :meth:`sort` is called, the table contains all the files added in
+    the order they were added. Afterwards, it contains the files sorted by
+    their source filename, and when multiple files have the same destination
+    filename, only the first one added is kept.
+    '''
+
+    _dirs = None
+    ''' The list of the interned directories. '''
+
+    _dir_index = None
+    ''' Maps each directory in :attr:`_dirs`, keyed by its type and value, to
+    its index.
+    '''
+
+    _names = None
+    ''' The bytearray of all the encoded filenames. '''
+
+    _fields = None
+    ''' A list of arrays. For each file, the index in :attr:`_dirs` of the
+    source and destination directories, the offset in :attr:`_names` of the
+    source and destination names, their lengths, and the file size.
+    '''
+
+    _flags = None
+    ''' For each file, bit 0 is set if the source name is text (rather than
+    bytes) and bit 1 if the destination name is text.
+    '''
+
+    _order = None
+    ''' Once sorted, the indices of the files in their sorted order. '''
+
+    def __init__(self):
+        super(FileTable, self).__init__()
+        self._dirs = []
+        self._dir_index = {}
+        self._names = bytearray()
+        self._fields = [array('I'), array('I'), array(_uint64),
+                        array(_uint64), array('I'), array('I'),
+                        array(_uint64)]
+        self._flags = array('B')
+
+    def __len__(self):
+        if self._order is not None:
+            return len(self._order)
+        return len(self._flags)
+
+    def __iter__(self):
+        item = self.item
+        if self._order is None:
+            for i in range(len(self._flags)):
+                yield item(i)
+        else:
+            for i in self._order:
+                yield item(int(i))
+
+    def _intern_dir(self, dirname):
+        # in py2, equal bytes and unicode must not be interned together
+        key = type(dirname), dirname
+        index = self._dir_index.get(key)
+        if index is None:
+            index = self._dir_index[key] = len(self._dirs)
+            self._dirs.append(dirname)
+        return index
+
+    def _add_name(self, name):
+        if isinstance(name, bytes):
+            data, is_text = name, 0
+        else:
+            data, is_text = name.encode('utf8', _encode_errors), 1
+        offset = len(self._names)
+        self._names.extend(data)
+        return offset, len(data), is_text
+
+    def _name(self, offset, length, is_text):
+        offset = int(offset)
+        data = bytes(self._names[offset:offset + length])
+        if is_text:
+            return data.decode('utf8', _encode_errors)
+        return data
+
+    def add(self, src, dst, size):
+        '''
+        Adds a file to the table and returns its index, which can be passed to
+        :meth:`item` until the table is sorted.
+
+        :Parameters:
+
+            `src`: str
+                The full source filename.
+            `dst`: str
+                The full destination filename.
+            `size`: int
+                The size of the source file.
+        '''
+        if self._order is not None:
+            raise Exception('Cannot add files to a sorted table')
+        src_dir, src_name = split(src)
+        dst_dir, dst_name = split(dst)
+        src_off, src_len, src_text = self._add_name(src_name)
+        if type(dst_name) is type(src_name) and dst_name == src_name:
+            dst_off, dst_len, dst_text = src_off, src_len, src_text
+        else:
+            dst_off, dst_len, dst_text = self._add_name(dst_name)
+
+        fields = self._fields
+        fields[0].append(self._intern_dir(src_dir))
+        fields[1].append(self._intern_dir(dst_dir))
+        fields[2].append(src_off)
+        fields[3].append(dst_off)
+        fields[4].append(src_len)
+        fields[5].append(dst_len)
+        fields[6].append(size)
+        self._flags.append(src_text | dst_text << 1)
+        return len(self._flags) - 1
+
+    def item(self, index):
+        '''
+        Returns the file at index `index` (in the order it was added) as a
+        2-tuple of a 2-tuple of the destination filename and its name, and a
+        3-tuple of the source filename, its name, and its size.
+        '''
+        src_dir, dst_dir, src_off, dst_off, src_len, dst_len, size = [
+            f[index] for f in self._fields]
+        flags = self._flags[index]
+        src_name = self._name(src_off, src_len, flags & 1)
+        dst_name = self._name(dst_off, dst_len, flags & 2)
+        return ((join(self._dirs[dst_dir], dst_name), dst_name),
+                (join(self._dirs[src_dir], src_name), src_name, int(size)))
+
+    def src_filename(self, index):
+        ''' Returns the full source filename of the file at `index`.
+        '''
+        fields = self._fields
+        return join(self._dirs[fields[0][index]], self._name(
+            fields[2][index], fields[4][index], self._flags[index] & 1))
+
+    def dst_filename(self, index):
+        ''' Returns the full destination filename of the file at `index`.
+        '''
+        fields = self._fields
+        return join(self._dirs[fields[1][index]], self._name(
+            fields[3][index], fields[5][index], self._flags[index] & 2))
+
+    def _dst_key(self, index):
+        fields = self._fields
+        offset = int(fields[3][index])
+        return (fields[1][index], self._flags[index] & 2,
+                bytes(self._names[offset:offset + fields[5][index]]))
+
+    def sort(self):
+        '''
+        Removes the files whose destination filename is the same as a file
+        added before them, and sorts the remaining files by their source
+        filename. Only arrays of the indices of the files are sorted, in
+        chunks that are then merged, and the filenames are read from the table
+        as they are needed. So only the filenames of a chunk of files exist at
+        a time, as the sort keys. Afterwards, no files can be added.
+        '''
+        n = len(self._flags)
+        typecode = _uint64 if n >= 2 ** 32 else 'I'
+        # for each destination, keep the first file added. Equal destinations
+        # only need to be next to each other, so they're sorted by their
+        # interned directory and encoded name rather than by the filename.
+        # The sort is stable, so they are in the order they were added
+        keep = bytearray(n)
+        last = None
+        for i in _iter_sorted(range(n), self._dst_key, typecode):
+            dst = self._dst_key(i)
+            if dst != last:
+                keep[i] = 1
+                last = dst
+        # files with the same source stay in the order they were added
+        indices = array(typecode, compress(range(n), keep))
+        del keep
+        order = _iter_sorted(indices, self.src_filename, typecode)
+        del indices
+        self._order = array(typecode, order)
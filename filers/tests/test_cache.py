@@ -0,0 +1,113 @@
+import os
+import hashlib
+
+import filers.cache
+from filers.cache import HashCache, ProbeCache
+from filers.tools import hashfile
+
+
+def make_file(tmpdir, name, data=b'data'):
+    filename = str(tmpdir.join(name))
+    with open(filename, 'wb') as fh:
+        fh.write(data)
+    return filename
+
+
+def test_hash_cache(tmpdir):
+    filename = make_file(tmpdir, 'a.avi')
+    cache = HashCache(str(tmpdir.join('cache', 'hashes.sqlite')))
+    assert cache.get(filename, 'sha256') is None
+
+    cache.set(filename, 'sha256', b'digest')
+    cache.set(filename, 'md5', b'md5 digest')
+    assert cache.get(filename, 'SHA256') == b'digest'
+    assert cache.get(filename, 'md5') == b'md5 digest'
+
+    cache.remove(filename, 'md5')
+    assert cache.get(filename, 'md5') is None
+    assert cache.get(filename, 'sha256') == b'digest'
+    cache.remove(filename)
+    assert cache.get(filename, 'sha256') is None
+    cache.close()
+
+
+def test_hash_cache_persistent(tmpdir):
+    filename = make_file(tmpdir, 'a.avi')
+    db = str(tmpdir.join('hashes.sqlite'))
+    cache = HashCache(db)
+    cache.set(filename, 'sha256', b'digest')
+    cache.close()
+
+    cache = HashCache(db)
+    assert cache.get(filename, 'sha256') == b'digest'
+    cache.clear()
+    assert cache.get(filename, 'sha256') is None
+    cache.close()
+
+
+def test_hash_cache_file_changed(tmpdir):
+    filename = make_file(tmpdir, 'a.avi')
+    cache = HashCache(str(tmpdir.join('hashes.sqlite')))
+    cache.set(filename, 'sha256', b'digest')
+
+    with open(filename, 'ab') as fh:
+        fh.write(b'more')
+    assert cache.get(filename, 'sha256') is None
+    # the outdated hash was removed
+    size, mtime, inode = HashCache.stat_signature(filename)
+    assert cache.get(filename, 'sha256', (size - 4, mtime, inode)) is None
+    cache.close()
+
+
+def test_hash_cache_lru_eviction(tmpdir, monkeypatch):
+    now = [0.]
+
+    def clock():
+        now[0] += 1.
+        return now[0]
+    monkeypatch.setattr(filers.cache.time, 'time', clock)
+
+    files = [make_file(tmpdir, '{}.avi'.format(i)) for i in range(4)]
+    cache = HashCache(str(tmpdir.join('hashes.sqlite')), max_entries=3)
+    for filename in files[:3]:
+        cache.set(filename, 'sha256', b'digest')
+    # file 0 is now more recently used than file 1
+    assert cache.get(files[0], 'sha256') == b'digest'
+    cache.set(files[3], 'sha256', b'digest')
+
+    assert cache.get(files[1], 'sha256') is None
+    for filename in (files[0], files[2], files[3]):
+        assert cache.get(filename, 'sha256') == b'digest'
+    cache.close()
+
+
+def test_hashfile_cache(tmpdir):
+    filename = make_file(tmpdir, 'a.avi', b'data' * 1000)
+    digest = hashlib.sha256(b'data' * 1000).digest()
+    cache = HashCache(str(tmpdir.join('hashes.sqlite')))
+
+    assert hashfile(filename, 'sha256', cache=cache) == digest
+    assert cache.get(filename, 'sha256') == digest
+    # the cached hash is used, unless forced
+    cache.set(filename, 'sha256', b'cached')
+    assert hashfile(filename, 'sha256', cache=cache) == b'cached'
+    assert hashfile(filename, 'sha256', cache=cache, force=True) == digest
+    assert cache.get(filename, 'sha256') == digest
+    cache.close()
+
+
+def test_probe_cache(tmpdir):
+    filename = make_file(tmpdir, 'a.avi')
+    db = str(tmpdir.join('probe.sqlite'))
+    cache = ProbeCache(db)
+    assert cache.get('ffprobe {}', filename) is None
+    cache.set('ffprobe {}', filename, b'duration=10')
+    assert cache.get('ffprobe {}', filename) == b'duration=10'
+    assert cache.get('ffprobe -v {}', filename) is None
+    cache.close()
+
+    cache = ProbeCache(db)
+    assert cache.get('ffprobe {}', filename) == b'duration=10'
+    os.utime(filename, (1, 1))
+    assert cache.get('ffprobe {}', filename) is None
+    cache.close()
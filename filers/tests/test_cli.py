@@ -0,0 +1,88 @@
+import os
+import json
+
+import pytest
+
+from filers import cli
+from filers.engine import FileToolsEngine
+
+
+def make_input(tmpdir):
+    src = tmpdir.mkdir('src')
+    for name in ('a.avi', 'b.avi'):
+        src.join(name).write_binary(name.encode('ascii') * 100)
+    return src
+
+
+def run_files(tmpdir, src, dst, *args):
+    return cli.main([
+        'files', '--input', str(src), '--output', str(dst), '--preview',
+        'false', '--data-path', str(tmpdir.mkdir('data')),
+        '--use-hash-cache', 'false'] + list(args))
+
+
+def read_events(capsys):
+    return [json.loads(line) for line in
+            capsys.readouterr().out.splitlines()]
+
+
+def test_copy(tmpdir, capsys):
+    src = make_input(tmpdir)
+    dst = tmpdir.mkdir('dst')
+    assert run_files(tmpdir, src, dst) == cli.EXIT_OK
+
+    assert sorted(os.listdir(str(dst))) == ['a.avi', 'b.avi']
+    assert dst.join('a.avi').read_binary() == b'a.avi' * 100
+    events = read_events(capsys)
+    assert events[-1] == {'event': 'done'}
+    assert sorted(e['src'] for e in events if e['event'] == 'cmd') == \
+        [str(src.join('a.avi')), str(src.join('b.avi'))]
+
+
+def test_skipped(tmpdir, capsys):
+    src = make_input(tmpdir)
+    dst = tmpdir.mkdir('dst')
+    dst.join('a.avi').write_binary(b'existing')
+    assert run_files(tmpdir, src, dst) == cli.EXIT_SKIPPED
+
+    assert dst.join('a.avi').read_binary() == b'existing'
+    assert dst.join('b.avi').read_binary() == b'b.avi' * 100
+    events = read_events(capsys)
+    assert len([e for e in events if e['event'] == 'skipped']) == 1
+    assert events[-1] == {'event': 'done'}
+
+
+def test_failed(tmpdir, capsys):
+    src = make_input(tmpdir)
+    dst = tmpdir.join('dst')
+    dst.write_binary(b'not a directory')
+    assert run_files(tmpdir, src, dst) == cli.EXIT_FAILED
+    assert [e['event'] for e in read_events(capsys)][-1] == 'failure'
+
+
+def test_interrupted(monkeypatch, capsys):
+    engine = FileToolsEngine()
+    stopped = []
+
+    def start():
+        engine.running = True
+        return True
+
+    def interrupt(interval):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(engine, 'start', start)
+    monkeypatch.setattr(engine, 'stop', lambda: stopped.append(True))
+    monkeypatch.setattr(cli, 'sleep', interrupt)
+    fields = cli.engines['files'][1]
+    assert cli.run(engine, fields) == cli.EXIT_INTERRUPTED
+    assert stopped == [True]
+
+
+def test_invalid_options(capsys):
+    with pytest.raises(SystemExit) as exc:
+        cli.main([])
+    assert exc.value.code == 2
+    with pytest.raises(SystemExit) as exc:
+        cli.main(['files', '--preview', 'maybe'])
+    assert exc.value.code == 2
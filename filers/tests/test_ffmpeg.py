@@ -0,0 +1,48 @@
+from filers.ffmpeg import parse_time, FFmpegProgress
+
+
+def test_parse_time():
+    assert parse_time('01:02:03.50') == 3723.5
+    assert parse_time(' 00:00:10 ') == 10
+    assert parse_time('N/A') is None
+    assert parse_time('') is None
+
+
+def feed(progress, lines):
+    states = [progress.feed(line) for line in lines]
+    assert all(state is None for state in states[:-1])
+    return states[-1]
+
+
+def test_progress():
+    progress = FFmpegProgress()
+    assert feed(progress, [
+        'frame=240', 'fps=120.5', 'out_time_us=8000000',
+        'total_size=1048576', 'speed=4.02x', 'progress=continue']) == {
+        'frame': 240, 'fps': 120.5, 'out_time': 8.0, 'total_size': 1048576,
+        'speed': 4.02, 'done': False}
+
+    # values not reported are None, and each block starts over
+    assert feed(progress, [
+        'frame=480', 'fps=N/A', 'out_time_ms=16000000', 'speed=N/A',
+        'progress=end\n']) == {
+        'frame': 480, 'fps': None, 'out_time': 16.0, 'total_size': None,
+        'speed': None, 'done': True}
+
+
+def test_progress_out_time():
+    progress = FFmpegProgress()
+    assert feed(progress, [
+        'out_time=00:01:00.500000', 'progress=continue'])['out_time'] == 60.5
+    assert feed(progress, [
+        'out_time_us=N/A', 'out_time=00:01:00', 'progress=continue'
+    ])['out_time'] is None
+    assert feed(progress, ['progress=continue'])['out_time'] is None
+
+
+def test_progress_ignored_lines():
+    progress = FFmpegProgress()
+    assert progress.feed('') is None
+    assert progress.feed('Press [q] to stop') is None
+    assert feed(progress, [
+        'frame=1', 'not a value', 'progress=continue'])['frame'] == 1
@@ -0,0 +1,97 @@
+import re
+
+import pytest
+
+from filers.filters import compile_filter, glob_to_regex, split_patterns, \
+    DirFilter
+
+
+@pytest.mark.parametrize('pattern,kind', [
+    ('', 'all'), ('*', 'all'), ('**', 'all'), ('/videos/a.avi', 'equal'),
+    ('*.avi', 'suffix'), ('/videos/*', 'prefix'), ('*day1*', 'contains'),
+    ('/videos/*.avi', 'prefix_suffix'), ('*day?.avi', 'regex'),
+    ('/videos/*/*.avi', 'regex')])
+def test_glob_kind(pattern, kind):
+    assert compile_filter(pattern).kind == kind
+
+
+@pytest.mark.parametrize('pattern,filename,matched', [
+    ('*', '/videos/a.avi', True),
+    ('/videos/a.avi', '/videos/a.avi', True),
+    ('/videos/a.avi', '/videos/a.avi.txt', False),
+    ('*.avi', '/videos/a.avi', True),
+    ('*.avi', '/videos/a.avi.txt', False),
+    ('/videos/*', '/videos/a.avi', True),
+    ('/videos/*', '/other/videos/a.avi', False),
+    ('*day1*', '/videos/day1/a.avi', True),
+    ('*day1*', '/videos/day2/a.avi', False),
+    ('/videos/*.avi', '/videos/day1/a.avi', True),
+    ('/videos/*.avi', '/videos/a.avi.txt', False),
+    # the prefix and suffix cannot overlap
+    ('/videos/*videos/', '/videos/', False),
+    ('*day?.avi', '/videos/day1.avi', True),
+    ('*day?.avi', '/videos/day12.avi', False),
+    ('*day?.avi', '/videos/day1.avi.txt', False),
+    ('/videos/*/*.avi', '/videos/day1/a.avi', True),
+    ('/videos/*/*.avi', '/other/day1/a.avi', False),
+    # globs match the whole path, not just the filename
+    ('day*', '/videos/day1.avi', False),
+    ('a.avi', '/videos/a.avi', False),
+    ('?.avi', '/videos/a.avi', False),
+])
+def test_glob_match(pattern, filename, matched):
+    assert bool(compile_filter(pattern).match(filename)) == matched
+    # the same as the regex, which is used for the complex globs
+    assert bool(re.match(glob_to_regex(pattern), filename)) == matched
+
+
+def test_regex_filter():
+    filt = compile_filter(r'.*day(\d+)_cam(\d+)\.avi', simple=False)
+    assert filt.kind == 'regex'
+    assert filt.match('/videos/day3_cam1.avi').groups() == ('3', '1')
+    assert filt.match('/videos/day3_cam1.mp4') is None
+    # a regex is only matched from the start
+    assert compile_filter('day', simple=False).match('/videos/day1') is None
+
+    with pytest.raises(re.error):
+        compile_filter('day(', simple=False)
+
+
+def test_glob_to_regex():
+    assert re.match(glob_to_regex('*.a?i'), 'x.avi')
+    assert not re.match(glob_to_regex('*.a?i'), 'x.avi2')
+    # the other characters are literal
+    assert re.match(glob_to_regex('a+(b).avi'), 'a+(b).avi')
+    assert not re.match(glob_to_regex('a+(b).avi'), 'aa(b)xavi')
+
+
+def test_split_patterns():
+    assert split_patterns('.git, @eaDir,,.thumbnails ') == \
+        ['.git', '@eaDir', '.thumbnails']
+    assert split_patterns('') == []
+
+
+def test_dir_filter():
+    assert not DirFilter()
+    assert DirFilter(exclude=['.git'])
+
+    dir_filt = DirFilter(include=['day*'], exclude=['.git'])
+    assert dir_filt.filter_dirs([], ['day1', 'day2', 'notes', '.git']) == \
+        (['day1', 'day2'], ['notes', '.git'])
+    # below an included directory, everything is included but the excluded
+    assert dir_filt.filter_dirs(['day1'], ['cam1', '.git']) == \
+        (['cam1'], ['.git'])
+
+
+def test_dir_filter_levels():
+    dir_filt = DirFilter(include=['*/day*', 'raw'])
+    assert dir_filt.filter_dirs([], ['mouse1', 'raw']) == \
+        (['mouse1', 'raw'], [])
+    assert dir_filt.filter_dirs(['mouse1'], ['day1', 'notes']) == \
+        (['day1'], ['notes'])
+    assert dir_filt.filter_dirs(['mouse1', 'day1'], ['cam1']) == \
+        (['cam1'], [])
+    assert dir_filt.filter_dirs(['raw'], ['notes']) == (['notes'], [])
+    # backslashes also separate the levels
+    assert DirFilter(include=['*\\day*']).filter_dirs(
+        ['mouse1'], ['day1', 'notes']) == (['day1'], ['notes'])
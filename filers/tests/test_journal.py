@@ -0,0 +1,138 @@
+import json
+import os
+
+from filers.journal import FileJournal, job_journal_filename, \
+    OutputManifest, output_manifest_filename
+
+
+def test_job_journal_filename(tmpdir):
+    data_path = str(tmpdir)
+    filename = job_journal_filename(
+        'copy', 'sha256', '/videos', data_path=data_path)
+    assert filename == job_journal_filename(
+        'copy', 'sha256', '/videos', data_path=data_path)
+    assert filename != job_journal_filename(
+        'move', 'sha256', '/videos', data_path=data_path)
+    assert os.path.dirname(filename) == os.path.join(data_path, 'journals')
+
+
+def test_journal_resume(tmpdir):
+    filename = str(tmpdir.join('journals', 'job.jsonl'))
+    journal = FileJournal(filename)
+    journal.add('a', 'A', 10, 'copy', 'sha256', True, digest='aa')
+    journal.add('b', 'B', 20, 'copy', 'sha256', False, error='failed')
+    journal.add('c', 'C', 30, 'copy', 'sha256', True, digest='cc')
+    # c was processed again and failed this time
+    journal.add('c', 'C', 30, 'copy', 'sha256', False, error='failed')
+    journal.close()
+    # the last line may be partial after a crash
+    with open(filename, 'a') as fh:
+        fh.write('{"src": "d", "dst"')
+
+    journal = FileJournal(filename, resume=True)
+    assert list(journal.completed.keys()) == [('a', 'A')]
+    assert journal.completed[('a', 'A')]['hash'] == 'aa'
+    journal.add('b', 'B', 20, 'copy', 'sha256', True, digest='bb')
+    journal.close()
+
+    journal = FileJournal(filename, resume=True)
+    assert sorted(journal.completed.keys()) == [('a', 'A'), ('b', 'B')]
+    journal.close()
+
+
+def test_journal_discard_and_delete(tmpdir):
+    filename = str(tmpdir.join('job.jsonl'))
+    journal = FileJournal(filename)
+    journal.add('a', 'A', 10, 'copy', 'size', True)
+    journal.close()
+
+    journal = FileJournal(filename, resume=False)
+    assert not journal.completed
+    journal.close(delete=True)
+    assert not os.path.exists(filename)
+
+
+def test_output_manifest_filename(tmpdir):
+    filename = output_manifest_filename('/mp4', str(tmpdir))
+    assert filename == output_manifest_filename('/mp4/', str(tmpdir))
+    assert filename != output_manifest_filename('/mp4_2', str(tmpdir))
+
+
+def test_manifest_finished(tmpdir):
+    src = str(tmpdir.join('in.avi'))
+    dst = str(tmpdir.join('out.mp4'))
+    with open(src, 'wb') as fh:
+        fh.write(b'input')
+    with open(dst, 'wb') as fh:
+        fh.write(b'output')
+    filename = str(tmpdir.join('manifest.jsonl'))
+
+    manifest = OutputManifest(filename)
+    cmd_hash = OutputManifest.command_hash('ffmpeg -i in.avi out.mp4')
+    inputs = [OutputManifest.input_signature(src)]
+    assert not manifest.is_output(dst)
+    assert not manifest.is_finished(dst, cmd_hash, inputs)
+    manifest.add(dst, cmd_hash, inputs)
+    manifest.close()
+
+    manifest = OutputManifest(filename)
+    # the signatures went through json, like they do in the engine
+    inputs = json.loads(json.dumps(inputs))
+    assert manifest.is_output(dst)
+    assert manifest.is_finished(dst, cmd_hash, inputs)
+    assert not manifest.is_finished(
+        dst, OutputManifest.command_hash('ffmpeg -crf 20'), inputs)
+    assert not manifest.is_finished(dst, cmd_hash, [[src, 6, inputs[0][2]]])
+
+    # the output changed since it was produced
+    with open(dst, 'ab') as fh:
+        fh.write(b'more')
+    assert not manifest.is_output(dst)
+    assert not manifest.is_finished(dst, cmd_hash, inputs)
+    manifest.close()
+
+
+def test_manifest_partial_line(tmpdir):
+    dst = str(tmpdir.join('out.mp4'))
+    dst2 = str(tmpdir.join('out2.mp4'))
+    for name in (dst, dst2):
+        with open(name, 'wb') as fh:
+            fh.write(b'output')
+    filename = str(tmpdir.join('manifest.jsonl'))
+
+    manifest = OutputManifest(filename)
+    manifest.add(dst, 'cmd', [])
+    manifest.close()
+    # the last line may be partial after a crash
+    with open(filename, 'a') as fh:
+        fh.write('{"dst": ')
+
+    manifest = OutputManifest(filename)
+    manifest.add(dst2, 'cmd', [])
+    manifest.close()
+    manifest = OutputManifest(filename)
+    assert sorted(manifest.outputs.keys()) == [dst, dst2]
+    manifest.close()
+
+
+def test_manifest_compaction(tmpdir):
+    dst = str(tmpdir.join('out.mp4'))
+    with open(dst, 'wb') as fh:
+        fh.write(b'output')
+    filename = str(tmpdir.join('manifest.jsonl'))
+
+    manifest = OutputManifest(filename)
+    for i in range(150):
+        manifest.add(dst, str(i), [])
+    manifest.close()
+    with open(filename) as fh:
+        assert len(fh.readlines()) == 150
+
+    # most entries were replaced, so only the latest is kept
+    manifest = OutputManifest(filename)
+    assert manifest.outputs[dst]['cmd'] == '149'
+    manifest.close()
+    with open(filename) as fh:
+        lines = fh.readlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])['cmd'] == '149'
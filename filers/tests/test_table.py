@@ -0,0 +1,62 @@
+import random
+from os.path import join
+
+import pytest
+
+from filers.table import FileTable, _iter_sorted
+
+
+def test_add_item():
+    table = FileTable()
+    assert table.add(join('src', 'b.avi'), join('dst', 'b.mp4'), 20) == 0
+    assert table.add(join(b'src', b'a.avi'), join(b'dst', b'a.avi'), 10) == 1
+    assert len(table) == 2
+
+    assert table.item(0) == ((join('dst', 'b.mp4'), 'b.mp4'),
+                             (join('src', 'b.avi'), 'b.avi', 20))
+    # bytes filenames stay bytes
+    assert table.item(1) == ((join(b'dst', b'a.avi'), b'a.avi'),
+                             (join(b'src', b'a.avi'), b'a.avi', 10))
+    assert table.src_filename(0) == join('src', 'b.avi')
+    assert table.dst_filename(1) == join(b'dst', b'a.avi')
+
+
+def test_sort_dedupe():
+    table = FileTable()
+    table.add(join('src', 'c.avi'), join('dst', 'c.avi'), 3)
+    table.add(join('src', 'a.avi'), join('dst', 'x.avi'), 1)
+    table.add(join('src2', 'a.avi'), join('dst', 'x.avi'), 2)
+    table.add(join('src', 'b.avi'), join('dst', 'b.avi'), 4)
+    table.sort()
+
+    # the first file added with a destination is kept
+    assert [(dst, src, size) for (dst, _), (src, _, size) in table] == [
+        (join('dst', 'x.avi'), join('src', 'a.avi'), 1),
+        (join('dst', 'b.avi'), join('src', 'b.avi'), 4),
+        (join('dst', 'c.avi'), join('src', 'c.avi'), 3)]
+    assert len(table) == 3
+
+    with pytest.raises(Exception):
+        table.add(join('src', 'd.avi'), join('dst', 'd.avi'), 5)
+
+
+def test_sort_stable():
+    table = FileTable()
+    # the same source copied to different destinations keeps its order
+    for i in range(5):
+        table.add(join('src', 'a.avi'), join('dst{}'.format(4 - i), 'a.avi'),
+                  i)
+    table.sort()
+    assert [size for _, (_, _, size) in table] == list(range(5))
+
+
+def test_iter_sorted():
+    rand = random.Random(0)
+    keys = [rand.randint(0, 20) for _ in range(100)]
+    for chunk_size in (1, 3, 7, 100, 1000):
+        result = list(_iter_sorted(
+            range(len(keys)), keys.__getitem__, 'I', chunk_size=chunk_size))
+        # the same as the stable sort of the indices
+        assert result == sorted(range(len(keys)), key=keys.__getitem__)
+
+    assert list(_iter_sorted([], keys.__getitem__, 'I', chunk_size=3)) == []
@@ -0,0 +1,111 @@
+import os
+import hashlib
+
+import pytest
+
+from filers import FilerException
+from filers.tools import copyfile_resumable, copyfile, copyfile_hash
+
+data = os.urandom(10000)
+
+
+def make_src(tmpdir):
+    src = str(tmpdir.join('src.avi'))
+    with open(src, 'wb') as fh:
+        fh.write(data)
+    return src
+
+
+def read(filename):
+    with open(filename, 'rb') as fh:
+        return fh.read()
+
+
+def interrupt(src, dst):
+    ''' Copies until the first checkpoint and then stops. '''
+    with pytest.raises(FilerException):
+        copyfile_resumable(
+            src, dst, 'sha256', blocksize=1000, checkpoint_size=4000,
+            should_stop=lambda: True)
+    assert os.path.getsize(dst + '.part') == 4000
+    assert os.path.exists(dst + '.part.chk')
+    assert not os.path.exists(dst)
+
+
+def test_copyfile_resumable(tmpdir):
+    src = make_src(tmpdir)
+    dst = str(tmpdir.join('dst.avi'))
+    digest = copyfile_resumable(
+        src, dst, 'sha256', blocksize=1000, checkpoint_size=4000)
+
+    assert digest == hashlib.sha256(data).digest()
+    assert read(dst) == data
+    assert os.stat(dst).st_mtime == os.stat(src).st_mtime
+    assert not os.path.exists(dst + '.part')
+    assert not os.path.exists(dst + '.part.chk')
+
+
+def test_copyfile_resume(tmpdir):
+    src = make_src(tmpdir)
+    dst = str(tmpdir.join('dst.avi'))
+    interrupt(src, dst)
+
+    # mark the part that was already copied, it's not copied again
+    with open(dst + '.part', 'r+b') as fh:
+        fh.write(b'X')
+    # anything after the checkpoint may not have been synced
+    with open(dst + '.part', 'ab') as fh:
+        fh.write(b'garbage')
+
+    digest = copyfile_resumable(
+        src, dst, 'sha256', blocksize=1000, checkpoint_size=4000)
+    # the hash is of the source, including the part that was not copied again
+    assert digest == hashlib.sha256(data).digest()
+    assert read(dst) == b'X' + data[1:]
+    assert not os.path.exists(dst + '.part')
+    assert not os.path.exists(dst + '.part.chk')
+
+
+def test_copyfile_resume_source_changed(tmpdir):
+    src = make_src(tmpdir)
+    dst = str(tmpdir.join('dst.avi'))
+    interrupt(src, dst)
+
+    with open(dst + '.part', 'r+b') as fh:
+        fh.write(b'X')
+    # the checkpoint is of a different version of the source
+    os.utime(src, (1, 1))
+
+    copyfile_resumable(src, dst, blocksize=1000, checkpoint_size=4000)
+    assert read(dst) == data
+
+
+def test_copyfile_resumable_verify(tmpdir):
+    src = make_src(tmpdir)
+    dst = str(tmpdir.join('dst.avi'))
+    verified = []
+
+    def verify(part, digest):
+        verified.append((read(part), digest))
+        return True
+    copyfile_resumable(src, dst, 'sha256', verify=verify)
+    assert verified == [(data, hashlib.sha256(data).digest())]
+
+    os.remove(dst)
+    with pytest.raises(FilerException):
+        copyfile_resumable(src, dst, verify=lambda part, digest: False)
+    assert not os.path.exists(dst)
+    assert not os.path.exists(dst + '.part')
+    assert not os.path.exists(dst + '.part.chk')
+
+
+def test_copyfile(tmpdir):
+    src = make_src(tmpdir)
+    dst = str(tmpdir.join('dst.avi'))
+    copyfile(src, dst, blocksize=1000)
+    assert read(dst) == data
+
+    dst2 = str(tmpdir.join('dst2.avi'))
+    assert copyfile_hash(src, dst2, 'sha256', blocksize=1000) == \
+        hashlib.sha256(data).digest()
+    assert read(dst2) == data
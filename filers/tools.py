@@ -3,6 +3,18 @@
 A module that provides common tools.
 '''
 
+import os
+import io
+import errno
+import shutil
+import mmap
+import json
+import hashlib
+import zlib
+import struct
+from collections import deque
+from threading import Lock
+from six import string_types
 from cplcom.utils import pretty_time, pretty_space, byteify
 try:
     import Queue as queue
@@ -10,10 +22,13 @@ try:
 except:
     import queue
     from queue import Queue
-from kivy.properties import ConfigParserProperty
+
+from filers import FilerException
 
 __all__ = (
-    'KivyQueue', 'str_to_float', 'hashfile', 'to_bool', 'ConfigProperty')
+    'KivyQueue', 'CoalescingKivyQueue', 'str_to_float', 'hash_backends',
+    'register_hash_backend', 'get_hasher', 'CRCHasher', 'hashfile', 'copyfile',
+    'copyfile_hash', 'copyfile_resumable', 'to_bool', 'ConfigProperty')
 
 
 class KivyQueue(Queue):
@@ -56,6 +71,127 @@ class KivyQueue(Queue):
         return Queue.get(self, False)
 
 
+class CoalescingKivyQueue(KivyQueue):
+    '''
+    A :class:`KivyQueue` for high rate updates, that coalesces and batches
+    the items waiting in the queue, and only calls the callback when the
+    queue goes from empty to non-empty.
+
+    When an item is added whose key is in :attr:`coalesce_keys` and another
+    item with that key is still waiting in the queue, the waiting item's value
+    is replaced with the new value, so only the latest value is read. Items
+    whose key is in :attr:`batch_keys` are instead read as a list of all the
+    values added while waiting in the queue, up to the last
+    :attr:`batch_size` values. Other items are queued as in
+    :class:`KivyQueue`.
+
+    The callback is only called again once the queue has been read until it
+    was empty, so when it's a Kivy Clock trigger, the queue is read at most
+    once per frame, no matter how many items are added.
+
+    >>> def callabck():
+    ...     print('Added')
+    >>> q = CoalescingKivyQueue(notify_func=callabck,
+    ...                         coalesce_keys=('stat', ), batch_keys=('cmd', ))
+    >>> q.put('stat', 1)
+    Added
+    >>> q.put('cmd', 'a')
+    >>> q.put('stat', 2)
+    >>> q.put('cmd', 'b')
+    >>> q.get()
+    ('stat', 2)
+    >>> q.get()
+    ('cmd', ['a', 'b'])
+
+    :param notify_func: The function to call when adding to an empty queue.
+    :param coalesce_keys: The value of :attr:`coalesce_keys`.
+    :param batch_keys: The value of :attr:`batch_keys`.
+    :param batch_size: The value of :attr:`batch_size`. Defaults to 100.
+    '''
+
+    coalesce_keys = frozenset()
+    ''' The keys for which only the latest value is kept. '''
+
+    batch_keys = frozenset()
+    ''' The keys whose values are read in batches, as a list. '''
+
+    batch_size = 100
+    ''' The maximum number of values in a batch. When more values are added,
+    the oldest values are dropped.
+    '''
+
+    _items = None
+
+    _waiting = None
+    ''' Maps each coalesced or batched key to its item waiting in the queue.
+    '''
+
+    _lock = None
+
+    _notified = False
+
+    def __init__(self, notify_func, coalesce_keys=(), batch_keys=(),
+                 batch_size=100, **kwargs):
+        KivyQueue.__init__(self, notify_func, **kwargs)
+        self.coalesce_keys = frozenset(coalesce_keys)
+        self.batch_keys = frozenset(batch_keys)
+        self.batch_size = batch_size
+        self._items = deque()
+        self._waiting = {}
+        self._lock = Lock()
+
+    def put(self, key, val):
+        '''
+        Adds a (key, value) tuple to the queue and calls the callback function
+        if the queue was empty.
+        '''
+        with self._lock:
+            item = self._waiting.get(key)
+            if item is not None:
+                if key in self.batch_keys:
+                    item[1].append(val)
+                    if len(item[1]) > self.batch_size:
+                        del item[1][0]
+                else:
+                    item[1] = val
+            else:
+                if key in self.batch_keys:
+                    item = [key, [val]]
+                    self._waiting[key] = item
+                elif key in self.coalesce_keys:
+                    item = [key, val]
+                    self._waiting[key] = item
+                else:
+                    item = (key, val)
+                self._items.append(item)
+
+            if self._notified:
+                return
+            self._notified = True
+        self.notify_func()
+
+    def get(self):
+        '''
+        Returns the next items in the queue, if non-empty, otherwise a
+        :py:attr:`Queue.Empty` exception is raised.
+        '''
+        with self._lock:
+            if not self._items:
+                self._notified = False
+                raise queue.Empty
+            item = self._items.popleft()
+            if self._waiting.get(item[0]) is item:
+                del self._waiting[item[0]]
+        return item[0], item[1]
+
+    def qsize(self):
+        with self._lock:
+            return len(self._items)
+
+    def empty(self):
+        return not self.qsize()
+
+
 def str_to_float(strnum, minval=0, maxval=2 ** 31 - 1, err_max=True,
                  val_type=float, err_val=None):
     '''
@@ -93,26 +229,525 @@ def str_to_float(strnum, minval=0, maxval=2 ** 31 - 1, err_max=True,
     return val
 
 
-def hashfile(filename, hasher, blocksize=65536):
+hash_backends = {}
+''' A dict of all the hash algorithms that can be used e.g. to verify files.
+The keys are the names of the algorithms and the values are callables that
+return a new hasher instance. See :func:`register_hash_backend`.
+
+`sha256`, `sha1`, and `md5` from :mod:`hashlib` and `crc32` from :mod:`zlib`
+are always available. `blake2b` and `blake2s` are available from
+:mod:`hashlib` (or the `pyblake2` package, if installed). `xxh64` and
+`xxh3_128` are available if the `xxhash` package is installed, and `crc32c` if
+the `crc32c` package is installed.
+'''
+
+
+def register_hash_backend(name, factory):
+    '''
+    Registers a hash algorithm in :attr:`hash_backends` so that it can be used
+    e.g. to verify files.
+
+    :param name: The name of the algorithm, e.g. `'sha256'`.
+    :param factory:
+        A callable that takes no arguments and returns a new hasher instance.
+        Like the :mod:`hashlib` hashers, the instance must have `update` and
+        `digest` methods.
+    '''
+    hash_backends[name] = factory
+
+
+def get_hasher(name):
+    '''
+    Returns a new hasher instance of the algorithm registered in
+    :attr:`hash_backends`.
+
+    >>> get_hasher('sha256')
+    <sha256 HASH object @ 0x0000000002E1F8A0>
+
+    :param name: The name of the algorithm, e.g. `'sha256'`.
+    '''
+    try:
+        return hash_backends[name]()
+    except KeyError:
+        raise ValueError('{} is not a known hash algorithm'.format(name))
+
+
+class CRCHasher(object):
+    '''
+    Wraps a CRC function, e.g. :func:`zlib.crc32`, with a hasher interface
+    similar to :mod:`hashlib` hashers.
+
+    :param name: The name of the algorithm.
+    :param func:
+        The CRC function. It takes the data and the previous CRC value and
+        returns the updated CRC value.
+    '''
+
+    name = ''
+
+    digest_size = 4
+
+    _func = None
+
+    _value = 0
+
+    def __init__(self, name, func):
+        super(CRCHasher, self).__init__()
+        self.name = name
+        self._func = func
+
+    def update(self, data):
+        try:
+            self._value = self._func(data, self._value)
+        except TypeError:
+            # on py2 zlib doesn't accept a memoryview
+            self._value = self._func(memoryview(data).tobytes(), self._value)
+
+    def digest(self):
+        return struct.pack('>I', self._value & 0xFFFFFFFF)
+
+    def hexdigest(self):
+        return '{:08x}'.format(self._value & 0xFFFFFFFF)
+
+
+for _name in ('sha256', 'sha1', 'md5'):
+    register_hash_backend(_name, getattr(hashlib, _name))
+register_hash_backend('crc32', lambda: CRCHasher('crc32', zlib.crc32))
+
+if hasattr(hashlib, 'blake2b'):
+    register_hash_backend('blake2b', hashlib.blake2b)
+    register_hash_backend('blake2s', hashlib.blake2s)
+else:
+    try:
+        import pyblake2
+        register_hash_backend('blake2b', pyblake2.blake2b)
+        register_hash_backend('blake2s', pyblake2.blake2s)
+    except ImportError:
+        pass
+
+try:
+    import xxhash
+    register_hash_backend('xxh64', xxhash.xxh64)
+    if hasattr(xxhash, 'xxh3_128'):
+        register_hash_backend('xxh3_128', xxhash.xxh3_128)
+except ImportError:
+    pass
+
+try:
+    import crc32c as _crc32c
+    register_hash_backend(
+        'crc32c', lambda: CRCHasher('crc32c', _crc32c.crc32c))
+except ImportError:
+    pass
+
+
+_kernel_copy_errnos = set(
+    getattr(errno, name) for name in (
+        'EXDEV', 'ENOSYS', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP', 'EBADF',
+        'ENOTSOCK', 'EPERM') if hasattr(errno, name))
+''' The errors raised by :func:`os.copy_file_range` or :func:`os.sendfile`
+when the kernel cannot copy between the given files, in which case we fall
+back to copying through a buffer.
+'''
+
+
+def _iter_blocks(f, blocksize, size=None):
+    '''
+    Yields the consecutive blocks of the file as :class:`memoryview` slices of
+    a single buffer that is re-used for all the blocks, so no memory is
+    allocated while reading. Each block is only valid until the next one is
+    read. If `size` is not None, at most `size` bytes are read.
+    '''
+    buf = bytearray(blocksize)
+    view = memoryview(buf)
+    if size is None:
+        n = f.readinto(buf)
+        while n:
+            yield view[:n]
+            n = f.readinto(buf)
+        return
+
+    n = f.readinto(view[:min(blocksize, size)]) if size > 0 else 0
+    while n:
+        yield view[:n]
+        size -= n
+        n = f.readinto(view[:min(blocksize, size)]) if size > 0 else 0
+
+
+def _kernel_copy(fsrc, fdst, blocksize):
+    '''
+    Copies the file from `fsrc` to `fdst` within the kernel, without copying
+    the data through python, using :func:`os.copy_file_range` or
+    :func:`os.sendfile` when available (e.g. on Linux).
+
+    Like :mod:`shutil`, if a method copies nothing at all, e.g. for some
+    FUSE or procfs files that report the wrong size, the next method is
+    tried, since the file may not actually be empty.
+
+    :returns:
+
+        True if the whole file was copied. False if the kernel cannot copy
+        these files, or copied less than the size of the source file. The
+        rest of the file must then be copied from the current position of
+        both files, which is the start if nothing was copied.
+    '''
+    infd = fsrc.fileno()
+    outfd = fdst.fileno()
+    size = os.fstat(infd).st_size
+    count = max(blocksize, 64 * 1024 * 1024)
+    for name in ('copy_file_range', 'sendfile'):
+        func = getattr(os, name, None)
+        if func is None:
+            continue
+
+        offset = 0
+        try:
+            while True:
+                if name == 'copy_file_range':
+                    n = func(infd, outfd, count)
+                else:
+                    n = func(outfd, infd, offset, count)
+                if not n:
+                    break
+                offset += n
+        except OSError as e:
+            if offset or e.errno not in _kernel_copy_errnos:
+                raise
+            continue
+        if not offset:
+            continue
+        if offset < size:
+            # continue copying from where the kernel stopped
+            fsrc.seek(offset)
+            fdst.seek(offset)
+            return False
+        return True
+    return False
+
+
+def _hash_mmap(f, hasher, blocksize):
+    '''
+    Hashes the file by memory mapping it, rather than reading it, so that the
+    data is hashed directly from the page cache without any copies.
+
+    When supported (python 3.8+ on Linux), the kernel is told that the file is
+    read sequentially, and the pages already hashed are released as we go, so
+    the whole file doesn't remain mapped in memory.
+    '''
+    # madvise requires page aligned offsets
+    page = mmap.PAGESIZE
+    blocksize = max(page, (blocksize + page - 1) // page * page)
+
+    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = None
+    try:
+        madvise = getattr(m, 'madvise', None)
+        if madvise is not None and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            madvise(mmap.MADV_SEQUENTIAL)
+        dontneed = getattr(mmap, 'MADV_DONTNEED', None)
+        if madvise is None or dontneed is None:
+            madvise = None
+
+        try:
+            view = memoryview(m)
+        except TypeError:  # py2 mmap has only the old buffer interface
+            pass
+
+        size = len(m)
+        offset = 0
+        while offset < size:
+            n = min(blocksize, size - offset)
+            if view is not None:
+                hasher.update(view[offset:offset + n])
+            else:
+                hasher.update(buffer(m, offset, n))
+            if madvise is not None:
+                madvise(dontneed, offset, n)
+            offset += n
+    finally:
+        if view is not None:
+            view.release()
+        m.close()
+
+
+def hashfile(filename, hasher, blocksize=1024 * 1024, cache=None,
+             force=False, mmap_threshold=None):
     '''
     Returns a hash of the file.
 
+    The file is read into a single buffer that is re-used for all the blocks,
+    so that hashing large files is not limited by memory allocation.
+    Alternatively, files larger than `mmap_threshold` are memory mapped and
+    hashed without reading them. Either way, the hash is identical.
+
     >>> from hashlib import sha256
     >>> hashfile('filepath', sha256())
     '6Zxvdsfk327*'
+    >>> hashfile('filepath', 'blake2b')
+    '\xc5ek\x8b+h\xf3'
 
     :param filename: The filename of the file to hash.
-    :param hasher: A hasher instance to use for computing the hash.
+    :param hasher:
+        A hasher instance, or the name of an algorithm in
+        :attr:`hash_backends`, to use for computing the hash.
     :param blocksize:
         Splits the file up into blocksizes and reads them piecemeal. Defaults
-        to 65536.
+        to 1MB.
+    :param cache:
+        A :class:`~filers.cache.HashCache` instance. If not None, the hash is
+        read from the cache when the file is unchanged since it was last
+        hashed, and the computed hash is added to the cache otherwise.
+        Defaults to None.
+    :param force:
+        If True, the file is re-hashed even if its hash is in `cache`.
+        Defaults to False.
+    :param mmap_threshold:
+        If not None, files whose size is at least `mmap_threshold` bytes are
+        hashed through a memory map rather than by reading them. This is
+        typically faster for very large files, e.g. multi-GB raw video files.
+        Defaults to None.
+    '''
+    name = hasher
+    if isinstance(hasher, string_types):
+        hasher = get_hasher(hasher)
+    else:
+        name = hasher.name
+
+    if cache is not None:
+        signature = cache.stat_signature(filename)
+        if not force:
+            digest = cache.get(filename, name, signature)
+            if digest is not None:
+                return digest
+
+    with io.open(filename, 'rb', buffering=0) as f:
+        if mmap_threshold is not None and \
+                0 < mmap_threshold <= os.fstat(f.fileno()).st_size:
+            _hash_mmap(f, hasher, blocksize)
+        else:
+            for block in _iter_blocks(f, blocksize):
+                hasher.update(block)
+    digest = hasher.digest()
+
+    if cache is not None:
+        cache.set(filename, name, digest, signature)
+    return digest
+
+
+def copyfile(src, dst, blocksize=1024 * 1024):
+    '''
+    Copies the file and its stat info, similar to :func:`shutil.copy2`.
+
+    When possible (e.g. on Linux), the data is copied within the kernel using
+    :func:`os.copy_file_range` or :func:`os.sendfile` so that it's never
+    copied into python. Otherwise, it's copied through a single buffer that is
+    re-used for all the blocks.
+
+    >>> copyfile('filepath', 'filepath_copy')
+
+    :param src: The filename of the file to copy.
+    :param dst: The filename of the destination file.
+    :param blocksize:
+        When the kernel cannot copy the file, splits the file up into
+        blocksizes and copies them piecemeal. Defaults to 1MB.
     '''
-    with open(filename, 'rb') as f:
-        buf = f.read(blocksize)
-        while len(buf) > 0:
-            hasher.update(buf)
-            buf = f.read(blocksize)
-    return hasher.digest()
+    with io.open(src, 'rb', buffering=0) as fsrc:
+        with io.open(dst, 'wb') as fdst:
+            if not _kernel_copy(fsrc, fdst, blocksize):
+                for block in _iter_blocks(fsrc, blocksize):
+                    fdst.write(block)
+    shutil.copystat(src, dst)
+
+
+def copyfile_hash(src, dst, hasher, blocksize=1024 * 1024, fsync=False,
+                  cache=None):
+    '''
+    Copies the file and its stat info, similar to :func:`shutil.copy2`, while
+    computing the hash of the data as it's copied. This way the source file
+    is only read once. Like :func:`hashfile`, the data is read into a single
+    re-used buffer.
+
+    >>> from hashlib import sha256
+    >>> copyfile_hash('filepath', 'filepath_copy', sha256())
+    '6Zxvdsfk327*'
+
+    :param src: The filename of the file to copy.
+    :param dst: The filename of the destination file.
+    :param hasher:
+        A hasher instance, or the name of an algorithm in
+        :attr:`hash_backends`, to use for computing the hash.
+    :param blocksize:
+        Splits the file up into blocksizes and reads them piecemeal. Defaults
+        to 1MB.
+    :param fsync:
+        Whether the destination file is flushed to the disk with
+        :func:`os.fsync` before returning. Defaults to False.
+    :param cache:
+        A :class:`~filers.cache.HashCache` instance. If not None, the computed
+        hash of the source file is added to the cache. Defaults to None.
+    :returns: The hash of the source file data.
+    '''
+    name = hasher
+    if isinstance(hasher, string_types):
+        hasher = get_hasher(hasher)
+    else:
+        name = hasher.name
+
+    if cache is not None:
+        signature = cache.stat_signature(src)
+
+    with io.open(src, 'rb', buffering=0) as fsrc:
+        with io.open(dst, 'wb') as fdst:
+            for block in _iter_blocks(fsrc, blocksize):
+                hasher.update(block)
+                fdst.write(block)
+            if fsync:
+                fdst.flush()
+                os.fsync(fdst.fileno())
+    shutil.copystat(src, dst)
+    digest = hasher.digest()
+
+    if cache is not None:
+        cache.set(src, name, digest, signature)
+    return digest
+
+
+def _read_checkpoint(filename, signature):
+    '''
+    Returns the offset saved in the checkpoint file by
+    :func:`copyfile_resumable`, or zero if there's no valid checkpoint for a
+    source file with this stat signature.
+    '''
+    try:
+        with open(filename, 'r') as fh:
+            checkpoint = json.load(fh)
+        if checkpoint['src'] == list(signature):
+            return int(checkpoint['offset'])
+    except Exception:
+        pass
+    return 0
+
+
+def _write_checkpoint(filename, signature, offset):
+    ''' Saves the checkpoint of :func:`copyfile_resumable` to disk.
+    '''
+    with open(filename, 'w') as fh:
+        json.dump({'src': list(signature), 'offset': offset}, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+def copyfile_resumable(
+        src, dst, hasher=None, verify=None, blocksize=1024 * 1024,
+        checkpoint_size=256 * 1024 * 1024, fsync=False, should_stop=None):
+    '''
+    Copies the file and its stat info, similar to :func:`shutil.copy2`, such
+    that if the copy is interrupted, e.g. by a crash, it can later be resumed
+    from where it left off.
+
+    The file is copied into a temporary `dst + '.part'` file. Every
+    `checkpoint_size` bytes, the part file is synced to disk and its length is
+    saved to a `dst + '.part.chk'` checkpoint file. When called again for the
+    same files, if the source file is unchanged, the copy resumes from the
+    last checkpoint. Once fully copied, the part file is verified with
+    `verify` and only then renamed to `dst`, replacing any existing file, so a
+    partial copy can never be mistaken for a complete file.
+
+    >>> copyfile_resumable('filepath', 'filepath_copy', 'sha256',
+    ...                    verify=lambda part, digest: True)
+    '6Zxvdsfk327*'
+
+    :param src: The filename of the file to copy.
+    :param dst: The filename of the destination file.
+    :param hasher:
+        If not None, a hasher instance, or the name of an algorithm in
+        :attr:`hash_backends`, used to hash the source data as it's copied.
+        When resuming, the part of the source that was already copied is
+        re-read to hash it. Defaults to None.
+    :param verify:
+        If not None, a callable that is called with the filename of the
+        completed part file and the hash of the source (or None if `hasher`
+        is None). If it returns False, the part file is deleted and a
+        :class:`~filers.FilerException` is raised. Defaults to None.
+    :param blocksize:
+        Splits the file up into blocksizes and copies them piecemeal.
+        Defaults to 1MB.
+    :param checkpoint_size:
+        The number of bytes copied between checkpoints. Defaults to 256MB.
+    :param fsync:
+        Whether the part file is flushed to the disk with :func:`os.fsync`
+        once it's fully copied. Defaults to False.
+    :param should_stop:
+        If not None, a callable that is called after every checkpoint. If it
+        returns True, the copy is interrupted by raising a
+        :class:`~filers.FilerException`, and it can be resumed later.
+        Defaults to None.
+    :returns: The hash of the source file data, or None if `hasher` is None.
+    '''
+    if isinstance(hasher, string_types):
+        hasher = get_hasher(hasher)
+    part = dst + '.part'
+    checkpoint = part + '.chk'
+    st = os.stat(src)
+    signature = st.st_size, st.st_mtime
+
+    offset = 0
+    if os.path.exists(part):
+        offset = min(_read_checkpoint(checkpoint, signature),
+                     os.path.getsize(part))
+
+    with io.open(src, 'rb', buffering=0) as fsrc:
+        with io.open(part, 'r+b' if offset else 'wb') as fdst:
+            if offset:
+                if hasher is not None:
+                    for block in _iter_blocks(fsrc, blocksize, offset):
+                        hasher.update(block)
+                else:
+                    fsrc.seek(offset)
+                fdst.seek(offset)
+                # anything after the checkpoint may not have been synced
+                fdst.truncate()
+
+            since_checkpoint = 0
+            for block in _iter_blocks(fsrc, blocksize):
+                if hasher is not None:
+                    hasher.update(block)
+                fdst.write(block)
+                offset += len(block)
+                since_checkpoint += len(block)
+
+                if since_checkpoint >= checkpoint_size:
+                    since_checkpoint = 0
+                    fdst.flush()
+                    os.fsync(fdst.fileno())
+                    _write_checkpoint(checkpoint, signature, offset)
+                    if should_stop is not None and should_stop():
+                        raise FilerException(
+                            '{}: copy interrupted after {} bytes, it will be '
+                            'resumed from there.'.format(dst, offset))
+
+            if fsync:
+                fdst.flush()
+                os.fsync(fdst.fileno())
+    shutil.copystat(src, part)
+    digest = hasher.digest() if hasher is not None else None
+
+    if verify is not None and not verify(part, digest):
+        os.remove(part)
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        raise FilerException('{}, {}: verification failed.'.format(src, dst))
+
+    if hasattr(os, 'replace'):
+        os.replace(part, dst)
+    else:
+        # on Windows, rename fails if dst exists
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(part, dst)
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return digest
 
 
 def to_bool(val):
@@ -147,5 +782,7 @@ def ConfigProperty(val, name, val_type, section, config_name):
 
         A :py:class:`~kivy.properties.ConfigParserProperty` instance.
     '''
+    # imported here so that this module can be used without importing kivy
+    from kivy.properties import ConfigParserProperty
     return ConfigParserProperty(val, section, name, config_name,
                                 val_type=val_type, errorvalue=val)
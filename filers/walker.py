@@ -0,0 +1,339 @@
+'''Walker
+=========
+
+Walks directory trees, returning the size and modification time of every file
+along with its name, in one pass.
+
+Unlike :func:`os.walk` followed by :func:`os.path.isfile` and
+:func:`os.path.getsize` on every file, which requires two or three ``stat``
+system calls per file, the walker uses the :func:`os.scandir` directory
+entries, which cache the file type and stat information. On Windows, the stat
+information comes with the directory listing so no extra system calls are
+needed, while elsewhere a single ``stat`` is needed per file. This is much
+faster for large trees, especially on network shares.
+
+:func:`os.scandir` is used when available (Python 3.5+), otherwise the
+`scandir` package is used if it's installed, otherwise it falls back to
+:func:`os.listdir` and :func:`os.stat`.
+
+When the round-trip latency of listing a directory dominates, e.g. on network
+shares, :func:`walk_parallel` and :func:`walk_many` list multiple directories
+concurrently from a pool of threads, while still returning them in the same
+order as :func:`walk`.
+'''
+
+import os
+from os.path import join
+from stat import S_ISDIR, S_ISLNK, S_ISREG
+from threading import Thread, Event
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+__all__ = ('walk', 'walk_parallel', 'walk_many', 'iter_files')
+
+
+def _scan_dir(root):
+    '''
+    Lists the directory using :func:`scandir` and returns a 3-tuple of the
+    directory names, the files (see :func:`walk`), and the names of the
+    directories that are symlinks.
+    '''
+    dirs = []
+    files = []
+    links = []
+    for entry in scandir(root):
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            dirs.append(entry.name)
+            try:
+                if entry.is_symlink():
+                    links.append(entry.name)
+            except OSError:
+                pass
+            continue
+
+        size = mtime = None
+        try:
+            if entry.is_file():
+                st = entry.stat()
+                size, mtime = st.st_size, st.st_mtime
+        except OSError:
+            pass
+        files.append((entry.name, size, mtime))
+    return dirs, files, links
+
+
+def _list_dir(root):
+    '''
+    Like :func:`_scan_dir`, but using :func:`os.listdir` and :func:`os.lstat`,
+    for when :func:`scandir` is not available. Only symlinks need a second
+    ``stat``.
+    '''
+    dirs = []
+    files = []
+    links = []
+    for name in os.listdir(root):
+        path = join(root, name)
+        is_link = False
+        try:
+            st = os.lstat(path)
+            if S_ISLNK(st.st_mode):
+                is_link = True
+                st = os.stat(path)
+        except OSError:
+            files.append((name, None, None))
+            continue
+
+        if S_ISDIR(st.st_mode):
+            dirs.append(name)
+            if is_link:
+                links.append(name)
+        elif S_ISREG(st.st_mode):
+            files.append((name, st.st_size, st.st_mtime))
+        else:
+            files.append((name, None, None))
+    return dirs, files, links
+
+
+def walk(top, followlinks=False, onerror=None):
+    '''
+    Walks the directory tree rooted at `top`, similar to :func:`os.walk`
+    (top-down), except that the files are listed with their size and
+    modification time.
+
+    >>> for root, dirs, files in walk('C:\\\\videos'):
+    ...     print(root, dirs, files)
+    C:\\videos ['day1'] [('video1.avi', 1048576, 1428958241.2)]
+    C:\\videos\\day1 [] [('video2.avi', 2097152, 1428958832.9)]
+
+    :Parameters:
+
+        `top`: str
+            The directory to walk.
+        `followlinks`: bool
+            Whether to walk into directories that are symlinks. Defaults to
+            False.
+        `onerror`: callable
+            If not None, it's called with the :class:`OSError` raised when a
+            directory cannot be listed. That directory is then skipped.
+            Defaults to None, in which case errors are ignored.
+
+    :yields:
+
+        For every directory, a 3-tuple of the directory path, a list of the
+        names of its sub-directories, and a list of its files. Each file is a
+        3-tuple of the filename, its size, and its modification time. For
+        entries that are not regular files, e.g. broken links, the size and
+        time are None. As with :func:`os.walk`, the sub-directory list can be
+        modified in place to prune the walk.
+    '''
+    list_dir = _list_dir if scandir is None else _scan_dir
+    stack = [top]
+    while stack:
+        root = stack.pop()
+        try:
+            dirs, files, links = list_dir(root)
+        except OSError as e:
+            if onerror is not None:
+                onerror(e)
+            continue
+
+        yield root, dirs, files
+        if not followlinks and links:
+            links = set(links)
+            dirs = [d for d in dirs if d not in links]
+        stack.extend(join(root, d) for d in reversed(dirs))
+
+
+def iter_files(top, followlinks=False, onerror=None):
+    '''
+    Walks the directory tree rooted at `top` like :func:`walk` and yields a
+    3-tuple of the full path, size, and modification time of every regular
+    file.
+
+    >>> for filename, size, mtime in iter_files('C:\\\\videos'):
+    ...     print(filename, size, mtime)
+    C:\\videos\\video1.avi 1048576 1428958241.2
+    C:\\videos\\day1\\video2.avi 2097152 1428958832.9
+    '''
+    for root, _, files in walk(top, followlinks=followlinks, onerror=onerror):
+        for name, size, mtime in files:
+            if size is not None:
+                yield join(root, name), size, mtime
+
+
+class _Listing(object):
+    ''' A directory that is listed by a :func:`walk_parallel` thread.
+    '''
+
+    __slots__ = ('path', 'event', 'result', 'error')
+
+    def __init__(self, path):
+        self.path = path
+        self.event = Event()
+        self.result = self.error = None
+
+
+def _list_dir_into(list_dir, listing):
+    ''' Lists the directory of the :class:`_Listing`. '''
+    try:
+        listing.result = list_dir(listing.path)
+    except OSError as e:
+        listing.error = e
+    listing.event.set()
+
+
+def _list_dirs(list_dir, tasks):
+    ''' The :func:`walk_parallel` threads, which list the directories from
+    the `tasks` queue until they get a `None`.
+    '''
+    while True:
+        listing = tasks.get()
+        if listing is None:
+            return
+        _list_dir_into(list_dir, listing)
+
+
+def walk_parallel(tops, num_threads=4, max_pending=256, followlinks=False,
+                  onerror=None):
+    '''
+    Walks all the directory trees rooted at `tops`, like calling :func:`walk`
+    for each of them in turn, except that up to `num_threads` directories are
+    listed concurrently.
+
+    The directories are returned in exactly the same order as :func:`walk`.
+    While a directory is being returned, the directories that will be
+    returned next, e.g. its sub-directories and siblings, are already being
+    listed in the background. At most `max_pending` directories are listed
+    ahead. A directory's sub-directories are only listed after it's returned,
+    so they can still be pruned by modifying the sub-directory list in place.
+
+    :Parameters:
+
+        `tops`: list
+            The directories to walk.
+        `num_threads`: int
+            The number of threads listing the directories. If less than 2,
+            the directories are listed from the calling thread. Defaults to 4.
+        `max_pending`: int
+            The maximum number of directories listed ahead of the one being
+            returned. Defaults to 256.
+        `followlinks`, `onerror`:
+            See :func:`walk`.
+
+    :yields:
+
+        For every directory, a 4-tuple of the index in `tops` of the tree
+        being walked, followed by the 3-tuple yielded by :func:`walk`.
+    '''
+    if num_threads < 2:
+        for i, top in enumerate(tops):
+            for root, dirs, files in walk(
+                    top, followlinks=followlinks, onerror=onerror):
+                yield i, root, dirs, files
+        return
+
+    list_dir = _list_dir if scandir is None else _scan_dir
+    max_pending = max(max_pending, 1)
+    tasks = Queue()
+    threads = []
+    # the directories yet to be walked, in reverse order. Each is a list of
+    # the index of its tree, its path, and its _Listing once it's submitted
+    stack = [[i, top, None] for i, top in reversed(list(enumerate(tops)))]
+    pending = 0
+
+    try:
+        while stack:
+            # list ahead the directories that are next in line
+            n = len(stack)
+            k = n - 1
+            while pending < max_pending and k >= max(n - 2 * max_pending, 0):
+                item = stack[k]
+                if item[2] is None:
+                    item[2] = _Listing(item[1])
+                    tasks.put(item[2])
+                    pending += 1
+                    if len(threads) < num_threads:
+                        t = Thread(target=_list_dirs, args=(list_dir, tasks),
+                                   name='Filers_walker{}'.format(len(threads)))
+                        t.daemon = True
+                        t.start()
+                        threads.append(t)
+                k -= 1
+
+            i, root, listing = stack.pop()
+            if listing is None:
+                # too many directories are listed ahead, list it ourselves
+                listing = _Listing(root)
+                _list_dir_into(list_dir, listing)
+            else:
+                pending -= 1
+                listing.event.wait()
+            if listing.error is not None:
+                if onerror is not None:
+                    onerror(listing.error)
+                continue
+
+            dirs, files, links = listing.result
+            yield i, root, dirs, files
+            if not followlinks and links:
+                links = set(links)
+                dirs = [d for d in dirs if d not in links]
+            stack.extend([i, join(root, d), None] for d in reversed(dirs))
+    finally:
+        for _ in threads:
+            tasks.put(None)
+        # if the walk was cut short, a thread may still be listing a directory
+        if not stack:
+            for t in threads:
+                t.join()
+
+
+def walk_many(tops, **kwargs):
+    '''
+    Walks all the directory trees rooted at `tops` with
+    :func:`walk_parallel`, returning each tree as its own iterator.
+
+    >>> for top, entries in walk_many(['C:\\\\videos', 'D:\\\\videos']):
+    ...     for root, dirs, files in entries:
+    ...         print(root, dirs, files)
+
+    :Parameters:
+
+        `tops`: list
+            The directories to walk.
+        `kwargs`:
+            Passed on to :func:`walk_parallel`.
+
+    :yields:
+
+        For each directory in `tops`, in order, a 2-tuple of the directory,
+        and an iterator that yields the 3-tuples of :func:`walk` for its tree.
+        Each iterator must be used before the next one is yielded, any of its
+        items not used are skipped.
+    '''
+    items = walk_parallel(tops, **kwargs)
+    peeked = [next(items, None)]
+
+    def entries(i):
+        while peeked[0] is not None and peeked[0][0] == i:
+            yield peeked[0][1:]
+            peeked[0] = next(items, None)
+
+    for i, top in enumerate(tops):
+        while peeked[0] is not None and peeked[0][0] < i:
+            peeked[0] = next(items, None)
+        yield top, entries(i)
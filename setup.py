@@ -27,5 +27,6 @@ setup(
     install_requires=['pybarst', 'pyflycap2', 'ffpyplayer', 'cplcom', 'kivy',
                       'psutil', 'six'],
     package_data={'filers': ['data/*', '*.kv']},
-    entry_points={'console_scripts': ['filers=filers.main:run_app']},
+    entry_points={'console_scripts': ['filers=filers.main:run_app',
+                                      'filers-cli=filers.cli:main']},
 )